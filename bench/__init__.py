@@ -0,0 +1,4 @@
+"""
+Сквозной бенчмарк бота на локальных заглушках Telegram, Abacus и Mem.ai.
+Запуск: python -m bench.run --help
+"""
@@ -0,0 +1,255 @@
+"""
+Локальные заглушки внешних сервисов для бенчмарка: Telegram Bot API,
+OpenAI-совместимый Abacus и Mem.ai v2 /notes. У каждой настраиваются
+задержка ответа и доля ошибок.
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import random
+import time
+from dataclasses import dataclass
+
+from aiohttp import ClientSession, web
+
+
+@dataclass
+class Behaviour:
+    # Задержка ответа: latency ± jitter (секунды)
+    latency: float = 0.0
+    jitter: float = 0.0
+    # Доля запросов, на которые отвечаем error_status
+    error_rate: float = 0.0
+    error_status: int = 503
+
+    async def delay(self) -> None:
+        value = self.latency + random.uniform(-self.jitter, self.jitter)
+        if value > 0:
+            await asyncio.sleep(value)
+
+    def should_fail(self) -> bool:
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+
+class FakeServer:
+    def __init__(self, behaviour: Behaviour | None = None) -> None:
+        self.behaviour = behaviour or Behaviour()
+        self.requests = 0
+        self.errors = 0
+        self.port = 0
+        self._runner: web.AppRunner | None = None
+
+    def build_app(self) -> web.Application:
+        raise NotImplementedError
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", 0).start()
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _before(self) -> web.Response | None:
+        self.requests += 1
+        await self.behaviour.delay()
+        if self.behaviour.should_fail():
+            self.errors += 1
+            return web.json_response(
+                {"error": "injected failure"}, status=self.behaviour.error_status
+            )
+        return None
+
+
+class FakeTelegram(FakeServer):
+    """
+    Минимальный Bot API: getMe, sendMessage, editMessageText, getFile,
+    setWebhook и отдача файлов, зарегистрированных через add_file().
+    deliver() доставляет апдейт на зарегистрированный webhook, как Telegram.
+    """
+
+    def __init__(self, behaviour: Behaviour | None = None) -> None:
+        super().__init__(behaviour)
+        self.files: dict[str, bytes] = {}
+        self.sent: list[dict] = []
+        self.webhook: dict | None = None
+        self._message_ids = itertools.count(10_000)
+        self._session: ClientSession | None = None
+
+    def add_file(self, file_id: str, data: bytes) -> None:
+        self.files[file_id] = data
+
+    async def stop(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+        await super().stop()
+
+    async def deliver(self, update: dict) -> int:
+        """
+        POST апдейта на webhook с секретным токеном. Возвращает HTTP-статус ответа бота.
+        """
+        if self.webhook is None:
+            raise RuntimeError("webhook не зарегистрирован (setWebhook)")
+        if self._session is None:
+            self._session = ClientSession()
+        headers = {"X-Telegram-Bot-Api-Secret-Token": str(self.webhook.get("secret_token", ""))}
+        async with self._session.post(self.webhook["url"], json=update, headers=headers) as resp:
+            await resp.read()
+            return resp.status
+
+    def build_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self._method)
+        app.router.add_get("/file/bot{token}/files/{file_id}", self._download)
+        return app
+
+    @staticmethod
+    async def _params(request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        params = {}
+        for key, value in (await request.post()).items():
+            try:
+                params[key] = json.loads(value)
+            except (TypeError, ValueError):
+                params[key] = value
+        return params
+
+    def _message(self, params: dict, message_id: int | None = None) -> dict:
+        return {
+            "message_id": message_id or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+            "text": params.get("text", ""),
+        }
+
+    async def _method(self, request: web.Request) -> web.Response:
+        failure = await self._before()
+        if failure is not None:
+            return failure
+
+        method = request.match_info["method"]
+        params = await self._params(request)
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif method == "sendMessage":
+            result = self._message(params)
+            self.sent.append(result)
+        elif method == "editMessageText":
+            result = self._message(params, int(params.get("message_id", 0)))
+        elif method == "setWebhook":
+            self.webhook = params
+            result = True
+        elif method == "getFile":
+            file_id = params["file_id"]
+            data = self.files.get(file_id, b"")
+            result = {
+                "file_id": file_id,
+                "file_unique_id": file_id,
+                "file_size": len(data),
+                "file_path": f"files/{file_id}",
+            }
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _download(self, request: web.Request) -> web.Response:
+        failure = await self._before()
+        if failure is not None:
+            return failure
+        data = self.files.get(request.match_info["file_id"])
+        if data is None:
+            return web.Response(status=404)
+        return web.Response(body=data)
+
+
+class FakeAbacus(FakeServer):
+    """
+    OpenAI-совместимый /v1/chat/completions: отвечает сокращённым эхом запроса.
+    При stream=true ответ отдаётся через SSE по словам с задержкой token_delay.
+    """
+
+    def __init__(self, behaviour: Behaviour | None = None, token_delay: float = 0.0) -> None:
+        super().__init__(behaviour)
+        self.token_delay = token_delay
+
+    def build_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/v1/chat/completions", self._completions)
+        return app
+
+    async def _completions(self, request: web.Request) -> web.Response:
+        failure = await self._before()
+        if failure is not None:
+            return failure
+        body = await request.json()
+        prompt = body["messages"][-1]["content"]
+        content = f"Заметка: {prompt[:200]}"
+        if body.get("stream"):
+            return await self._stream(request, content)
+        return web.json_response(
+            {
+                "id": "bench",
+                "object": "chat.completion",
+                "model": body.get("model"),
+                "choices": [
+                    {"index": 0, "message": {"role": "assistant", "content": content}}
+                ],
+            }
+        )
+
+
+    async def _stream(self, request: web.Request, content: str) -> web.StreamResponse:
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        for word in content.split(" "):
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            chunk = {"choices": [{"index": 0, "delta": {"content": word + " "}}]}
+            await resp.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+        await resp.write(b"data: [DONE]\n\n")
+        await resp.write_eof()
+        return resp
+
+
+class FakeMem(FakeServer):
+    """
+    Mem.ai v2: POST /v2/notes и PATCH /v2/notes/{id}.
+    """
+
+    def __init__(self, behaviour: Behaviour | None = None) -> None:
+        super().__init__(behaviour)
+        self.notes: dict[str, str] = {}
+        self._ids = itertools.count(1)
+
+    def build_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/v2/notes", self._create)
+        app.router.add_patch("/v2/notes/{note_id}", self._update)
+        return app
+
+    async def _create(self, request: web.Request) -> web.Response:
+        failure = await self._before()
+        if failure is not None:
+            return failure
+        body = await request.json()
+        note_id = f"note-{next(self._ids)}"
+        self.notes[note_id] = body["content"]
+        return web.json_response({"id": note_id})
+
+    async def _update(self, request: web.Request) -> web.Response:
+        failure = await self._before()
+        if failure is not None:
+            return failure
+        body = await request.json()
+        note_id = request.match_info["note_id"]
+        self.notes[note_id] = body["content"]
+        return web.json_response({"id": note_id})
@@ -0,0 +1,329 @@
+"""
+Сквозной бенчмарк: настоящие хендлеры бота против локальных заглушек
+Telegram Bot API, Abacus и Mem.ai.
+
+    python -m bench.run --messages 500 --concurrency 32 --mix text=6,photo=2,pdf=1 \\
+        --abacus-latency 0.3 --mem-latency 0.1 --output bench.json
+
+Печатает p50/p95/p99 и пропускную способность по видам сообщений, время
+до полной отправки outbox и, если передан --baseline, разницу с прошлым
+прогоном. С --webhook апдейты доставляются через webhook бота, а задержка —
+это время до подтверждения апдейта (200), пропускная способность — с учётом
+обработки.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from .fake_servers import Behaviour, FakeAbacus, FakeMem, FakeTelegram
+
+_TOKEN = "123456:bench"
+
+
+def _parse_mix(value: str) -> dict[str, float]:
+    mix: dict[str, float] = {}
+    for part in value.split(","):
+        kind, _, weight = part.partition("=")
+        mix[kind.strip()] = float(weight or 1)
+    return mix
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _summary(latencies: list[float], errors: int, elapsed: float) -> dict:
+    return {
+        "count": len(latencies),
+        "errors": errors,
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+        "throughput_per_s": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+def _voice_available() -> bool:
+    from bot.config import WHISPER_BACKEND
+    from bot.voice_utils import BACKENDS
+
+    module = BACKENDS[WHISPER_BACKEND].module
+    return shutil.which("ffmpeg") is not None and importlib.util.find_spec(module) is not None
+
+
+def _configure_env(args: argparse.Namespace, abacus: FakeAbacus, mem: FakeMem, data_dir: str) -> None:
+    # Конфиг бота читается при импорте, поэтому окружение выставляется до import bot.*
+    os.environ.update(
+        {
+            "TELEGRAM_BOT_TOKEN": _TOKEN,
+            "ABACUS_API_KEY": "bench",
+            "ABACUS_BASE_URL": f"{abacus.url}/v1",
+            "MEM_API_KEY": "bench",
+            "MEM_API_BASE_URL": f"{mem.url}/v2",
+            "BOT_DATA_DIR": data_dir,
+            "METRICS_PORT": "0",
+            "LLM_CACHE_ENABLED": "1" if args.llm_cache else "0",
+            "LLM_STREAMING": "0" if args.no_streaming else "1",
+            "TEXT_DEBOUNCE_SECONDS": str(args.text_debounce),
+            # Бэкофф outbox укорочен, чтобы прогон с ошибками Mem не затягивался
+            "OUTBOX_BACKOFF_BASE": os.environ.get("OUTBOX_BACKOFF_BASE", "0.2"),
+            "OUTBOX_BACKOFF_MAX": os.environ.get("OUTBOX_BACKOFF_MAX", "2"),
+        }
+    )
+
+
+async def _drain_outbox(store, timeout: float) -> float:
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        counts = store.count_by_status()
+        if not counts.get("pending") and not counts.get("sending"):
+            break
+        await asyncio.sleep(0.05)
+    return time.perf_counter() - start
+
+
+async def run(args: argparse.Namespace) -> dict:
+    telegram = FakeTelegram(Behaviour(args.telegram_latency, args.jitter, args.telegram_error_rate))
+    abacus = FakeAbacus(
+        Behaviour(args.abacus_latency, args.jitter, args.abacus_error_rate),
+        token_delay=args.abacus_token_delay,
+    )
+    mem = FakeMem(Behaviour(args.mem_latency, args.jitter, args.mem_error_rate))
+    for server in (telegram, abacus, mem):
+        await server.start()
+
+    data_dir = tempfile.mkdtemp(prefix="mem-bot-bench-")
+    _configure_env(args, abacus, mem, data_dir)
+
+    from telegram import Update
+    from telegram.ext import ApplicationBuilder
+
+    from bot.main import build_application, build_sharded_application
+    from .workloads import KINDS, WorkloadGenerator
+
+    mix = _parse_mix(args.mix)
+    unknown = set(mix) - set(KINDS)
+    if unknown:
+        raise SystemExit(f"Неизвестные виды сообщений: {', '.join(sorted(unknown))}")
+    if mix.get("voice") and not _voice_available():
+        print("ffmpeg или whisper не найдены, голосовые исключены из прогона", file=sys.stderr)
+        mix.pop("voice")
+
+    builder = (
+        ApplicationBuilder()
+        .base_url(f"{telegram.url}/bot")
+        .base_file_url(f"{telegram.url}/file/bot")
+    )
+    if args.shards:
+        application = build_sharded_application(_TOKEN, builder, workers=args.shards)
+    else:
+        application = build_application(_TOKEN, builder)
+    await application.initialize()
+    await application.post_init(application)
+
+    webhook = None
+    if args.webhook:
+        from bot.webhook import WebhookServer
+
+        webhook = WebhookServer(
+            application, url="http://127.0.0.1/telegram", host="127.0.0.1", port=0,
+            queue_size=args.webhook_queue,
+        )
+        await webhook.start()
+        webhook.url = f"http://127.0.0.1:{webhook.port}/telegram"
+        await webhook.set_webhook()
+
+    generator = WorkloadGenerator(
+        telegram.add_file,
+        pdf_pages=args.pdf_pages,
+        voice_seconds=args.voice_seconds,
+        repeat_files=args.repeat_files,
+    )
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+
+    random.seed(args.seed)
+    plan = random.choices(kinds, weights=weights, k=args.messages)
+    latencies: dict[str, list[float]] = {kind: [] for kind in kinds}
+    errors: dict[str, int] = {kind: 0 for kind in kinds}
+    queue: asyncio.Queue[tuple[int, str]] = asyncio.Queue()
+    for number, kind in enumerate(plan):
+        queue.put_nowait((number, kind))
+
+    processor = application.update_processor
+
+    async def client() -> None:
+        # Замкнутый цикл: каждый «клиент» отправляет следующее сообщение после ответа на предыдущее
+        while True:
+            try:
+                number, kind = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            chat_id = 1000 + number % args.chats
+            payload = generator.make(kind, chat_id)
+            start = time.perf_counter()
+            try:
+                if webhook is not None:
+                    # Как Telegram: на 503 (очередь бота полна) доставка повторяется
+                    while await telegram.deliver(payload) == 503:
+                        await asyncio.sleep(0.05)
+                else:
+                    update = Update.de_json(payload, application.bot)
+                    await processor.process_update(update, application.process_update(update))
+            except Exception:
+                errors[kind] += 1
+            latencies[kind].append(time.perf_counter() - start)
+
+    from bot.metrics import HANDLER_ERRORS
+
+    handler_names = {"text": "text", "voice": "voice", "photo": "photo", "pdf": "document"}
+    errors_before = {k: HANDLER_ERRORS.values.get((handler_names[k],), 0) for k in kinds}
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(args.concurrency)))
+    if webhook is not None:
+        # Подтверждённые апдейты ещё обрабатываются: дожидаемся их
+        await webhook.stop()
+    elapsed = time.perf_counter() - started
+    # Склеенные тексты обрабатываются в фоне: дожидаемся их до замера outbox
+    if args.shards:
+        # Шарды дообрабатывают склеенные тексты при остановке, заметки отправляет поллер
+        await application.post_stop(application)
+        store = application.bot_data["outbox"].store
+    else:
+        services = application.bot_data["services"]
+        await services.text_coalescer.stop()
+        store = services.outbox.store
+    drain = await _drain_outbox(store, args.drain_timeout)
+    outbox_counts = store.count_by_status()
+
+    # Исключения хендлеров PTB перехватывает сам, поэтому считаем их по метрике
+    for kind in kinds:
+        errors[kind] += int(
+            HANDLER_ERRORS.values.get((handler_names[kind],), 0) - errors_before[kind]
+        )
+
+    await application.post_shutdown(application)
+    await application.shutdown()
+    for server in (telegram, abacus, mem):
+        await server.stop()
+    shutil.rmtree(data_dir, ignore_errors=True)
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "params": {
+            key: value for key, value in vars(args).items() if key not in ("output", "baseline")
+        },
+        "elapsed_s": round(elapsed, 3),
+        "outbox_drain_s": round(drain, 3),
+        "outbox": outbox_counts,
+        "total": _summary(all_latencies, sum(errors.values()), elapsed),
+        "handlers": {
+            kind: _summary(latencies[kind], errors[kind], elapsed) for kind in kinds if latencies[kind]
+        },
+        "backend_requests": {
+            "telegram": telegram.requests,
+            "abacus": abacus.requests,
+            "mem": mem.requests,
+        },
+    }
+
+
+def _format_delta(current: float, previous: float | None) -> str:
+    if not previous:
+        return ""
+    change = (current - previous) / previous * 100
+    return f" ({change:+.1f}%)"
+
+
+def print_report(result: dict, baseline: dict | None = None) -> None:
+    print(
+        f"Сообщений: {result['total']['count']} за {result['elapsed_s']:.2f} с, "
+        f"outbox отправлен за {result['outbox_drain_s']:.2f} с, статусы: {result['outbox']}"
+    )
+    header = f"{'вид':<8}{'кол-во':>8}{'ошибок':>8}{'p50 мс':>18}{'p95 мс':>18}{'p99 мс':>18}{'в сек':>16}"
+    print(header)
+    rows = [("total", result["total"]), *result["handlers"].items()]
+    for name, row in rows:
+        base = None
+        if baseline is not None:
+            base = baseline["total"] if name == "total" else baseline["handlers"].get(name)
+        cells = []
+        for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_per_s"):
+            value = row[key]
+            cells.append(f"{value:.1f}{_format_delta(value, base and base.get(key))}")
+        print(
+            f"{name:<8}{row['count']:>8}{row['errors']:>8}"
+            f"{cells[0]:>18}{cells[1]:>18}{cells[2]:>18}{cells[3]:>16}"
+        )
+    print(f"Запросов к бэкендам: {result['backend_requests']}")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200, help="всего сообщений")
+    parser.add_argument("--concurrency", type=int, default=16, help="одновременных отправителей")
+    parser.add_argument("--chats", type=int, default=8, help="число разных чатов")
+    parser.add_argument("--mix", default="text=6,photo=2,pdf=1,voice=1", help="доли видов сообщений")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--pdf-pages", type=int, default=20)
+    parser.add_argument("--voice-seconds", type=float, default=20.0)
+    parser.add_argument("--llm-cache", action="store_true", help="включить кэш ответов LLM")
+    parser.add_argument(
+        "--repeat-files", action="store_true",
+        help="слать один и тот же PDF/голосовое (проверка кэша по file_unique_id)",
+    )
+    parser.add_argument("--jitter", type=float, default=0.0, help="разброс задержки заглушек, с")
+    for name, latency in (("telegram", 0.01), ("abacus", 0.2), ("mem", 0.05)):
+        parser.add_argument(f"--{name}-latency", type=float, default=latency, help="задержка, с")
+        parser.add_argument(f"--{name}-error-rate", type=float, default=0.0, help="доля ошибок")
+    parser.add_argument(
+        "--abacus-token-delay", type=float, default=0.0, help="пауза между словами в потоковом ответе, с"
+    )
+    parser.add_argument("--no-streaming", action="store_true", help="выключить потоковые ответы LLM")
+    parser.add_argument(
+        "--text-debounce", type=float, default=0.0,
+        help="окно склейки текстовых сообщений, с (0 — каждое сообщение отдельно)",
+    )
+    parser.add_argument("--webhook", action="store_true", help="доставлять апдейты через webhook бота")
+    parser.add_argument("--webhook-queue", type=int, default=1000, help="размер очереди webhook")
+    parser.add_argument(
+        "--shards", type=int, default=0,
+        help="обрабатывать апдейты в N процессах-шардах (ошибки хендлеров в шардах не считаются)",
+    )
+    parser.add_argument("--drain-timeout", type=float, default=60.0, help="ожидание outbox, с")
+    parser.add_argument("--output", type=Path, help="сохранить результат в JSON")
+    parser.add_argument("--baseline", type=Path, help="JSON прошлого прогона для сравнения")
+    return parser
+
+
+def main() -> None:
+    args = build_parser().parse_args()
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else None
+    result = asyncio.run(run(args))
+    print_report(result, baseline)
+    if args.output:
+        args.output.write_text(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Бенчмарк распознавания речи: скорость (RTF) и точность (WER) движков Whisper
+на наборе фикстур, с вырезанием тишины и без.
+
+    python -m bench.transcribe fixtures/voice --backends openai,faster \\
+        --models base,small --output asr.json
+
+Фикстура — аудиофайл (ogg, mp3, wav, ...) и рядом файл с эталонным текстом
+с тем же именем и расширением .txt. RTF — время распознавания, делённое на
+длительность исходной записи (меньше — быстрее; вырезанная VAD тишина
+засчитывается в выигрыш). WER — доля ошибок по словам относительно эталона.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import re
+import sys
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+
+_AUDIO_SUFFIXES = {".ogg", ".oga", ".opus", ".mp3", ".wav", ".m4a", ".flac"}
+_WORD_RE = re.compile(r"\w+")
+
+
+def _words(text: str) -> list[str]:
+    return _WORD_RE.findall(text.lower().replace("ё", "е"))
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    """
+    Расстояние Левенштейна по словам, делённое на число слов эталона.
+    """
+    ref, hyp = _words(reference), _words(hypothesis)
+    if not ref:
+        return float(bool(hyp))
+    previous = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, start=1):
+        current = [i]
+        for j, h in enumerate(hyp, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (r != h)))
+        previous = current
+    return previous[-1] / len(ref)
+
+
+def _load_fixtures(directory: Path) -> list[tuple[str, np.ndarray, str]]:
+    from bot.audio_utils import decode_to_pcm
+
+    fixtures = []
+    for path in sorted(directory.iterdir()):
+        reference = path.with_suffix(".txt")
+        if path.suffix.lower() not in _AUDIO_SUFFIXES or not reference.exists():
+            continue
+        audio = asyncio.run(decode_to_pcm(str(path)))
+        fixtures.append((path.name, audio, reference.read_text(encoding="utf-8")))
+    return fixtures
+
+
+def run(args: argparse.Namespace) -> list[dict]:
+    from bot.audio_utils import SAMPLE_RATE, trim_silence
+    from bot.voice_utils import BACKENDS, FasterWhisperBackend, ModelManager, create_backend
+
+    fixtures = _load_fixtures(args.fixtures)
+    if not fixtures:
+        raise SystemExit(f"В {args.fixtures} нет аудио с эталонными .txt")
+    audio_seconds = sum(len(audio) for _, audio, _ in fixtures) / SAMPLE_RATE
+
+    trimmed = {}
+    vad_seconds = 0.0
+    if args.vad != "off":
+        started = time.perf_counter()
+        trimmed = {name: trim_silence(audio) for name, audio, _ in fixtures}
+        vad_seconds = time.perf_counter() - started
+
+    rows = []
+    for backend_name in args.backends.split(","):
+        if importlib.util.find_spec(BACKENDS[backend_name].module) is None:
+            print(f"{BACKENDS[backend_name].module} не установлен, {backend_name} пропущен", file=sys.stderr)
+            continue
+        if backend_name == FasterWhisperBackend.name:
+            backend = FasterWhisperBackend(args.threads, args.compute_type)
+        else:
+            backend = create_backend(backend_name, args.threads)
+        for model_name in args.models.split(","):
+            models = ModelManager(backend)
+            started = time.perf_counter()
+            model = models.get(model_name)
+            load_seconds = time.perf_counter() - started
+            # Первый прогон прогревает модель и не входит в замер
+            backend.transcribe(model, fixtures[0][1][: SAMPLE_RATE])
+
+            for vad in {"on": (True,), "off": (False,), "both": (False, True)}[args.vad]:
+                errors = []
+                elapsed = vad_seconds if vad else 0.0
+                for name, audio, reference in fixtures:
+                    started = time.perf_counter()
+                    result = backend.transcribe(model, trimmed[name] if vad else audio)
+                    elapsed += time.perf_counter() - started
+                    errors.append(word_error_rate(reference, result.text))
+                rows.append(
+                    {
+                        "backend": backend_name,
+                        "model": model_name,
+                        "compute_type": getattr(backend, "compute_type", "float32"),
+                        "vad": vad,
+                        "files": len(fixtures),
+                        "audio_seconds": audio_seconds,
+                        "seconds": elapsed,
+                        "rtf": elapsed / audio_seconds,
+                        "wer": sum(errors) / len(errors),
+                        "load_seconds": load_seconds,
+                        "resident_mb": models.resident_bytes / 2**20,
+                    }
+                )
+    return rows
+
+
+def print_report(rows: list[dict]) -> None:
+    if not rows:
+        print("Нет результатов: ни один движок не установлен")
+        return
+    print(f"Фикстур: {rows[0]['files']}, аудио {rows[0]['audio_seconds']:.1f} с")
+    print(f"{'движок':<10}{'модель':<10}{'тип':<10}{'VAD':<6}{'RTF':>8}{'WER':>8}{'загрузка с':>12}{'МБ':>8}")
+    for row in rows:
+        print(
+            f"{row['backend']:<10}{row['model']:<10}{row['compute_type']:<10}"
+            f"{'да' if row['vad'] else 'нет':<6}{row['rtf']:>8.3f}{row['wer']:>8.1%}"
+            f"{row['load_seconds']:>12.1f}{row['resident_mb']:>8.0f}"
+        )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fixtures", type=Path, help="каталог с аудио и эталонными .txt")
+    parser.add_argument("--backends", default="openai,faster", help="движки через запятую")
+    parser.add_argument("--models", default="base", help="модели Whisper через запятую")
+    parser.add_argument("--compute-type", default="int8", help="тип вычислений faster-whisper")
+    parser.add_argument("--vad", choices=("on", "off", "both"), default="both", help="вырезание тишины")
+    parser.add_argument("--threads", type=int, default=4, help="потоков на движок")
+    parser.add_argument("--output", type=Path, help="сохранить результат в JSON")
+    return parser
+
+
+def main() -> None:
+    args = build_parser().parse_args()
+    rows = run(args)
+    print_report(rows)
+    if args.output:
+        args.output.write_text(json.dumps(rows, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Синтетические сообщения для бенчмарка: текст, голосовое, фото и PDF
+в виде JSON апдейтов Telegram, плюс генерация файлов-фикстур.
+"""
+from __future__ import annotations
+
+import io
+import itertools
+import math
+import random
+import struct
+import time
+import wave
+
+from bot.config import ALLOWED_USERNAMES
+
+KINDS = ("text", "voice", "photo", "pdf")
+
+_LOREM = (
+    "идея прототип робот модель статья эксперимент метрика данные задача "
+    "заметка проект встреча обучение оценка архитектура latency throughput"
+).split()
+
+
+def make_pdf(pages: list[str]) -> bytes:
+    """
+    Минимальный корректный PDF с одной строкой текста (Helvetica) на странице.
+    """
+    objects: list[bytes] = [b"<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(len(pages)))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>".encode())
+    font_id = 3 + 2 * len(pages)
+    for i, text in enumerate(pages):
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R"
+            f" /Resources << /Font << /F1 {font_id} 0 R >> >> >>".encode()
+        )
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref,
+    )
+    return out
+
+
+def make_wav(seconds: float, sample_rate: int = 16000) -> bytes:
+    """
+    Моно WAV: тон с паузами каждые несколько секунд (чтобы было где резать запись).
+    """
+    frames = bytearray()
+    for n in range(int(seconds * sample_rate)):
+        t = n / sample_rate
+        amplitude = 0.0 if (t % 7) > 6 else 0.3
+        frames += struct.pack("<h", int(amplitude * 32767 * math.sin(2 * math.pi * 220 * t)))
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(bytes(frames))
+    return buffer.getvalue()
+
+
+class WorkloadGenerator:
+    """
+    Генерирует апдейты заданного вида; файлы (PDF, аудио) регистрируются
+    в заглушке Telegram через register_file.
+    """
+
+    def __init__(
+        self,
+        register_file,
+        pdf_pages: int = 20,
+        voice_seconds: float = 20.0,
+        repeat_files: bool = False,
+    ) -> None:
+        self.register_file = register_file
+        # repeat_files: один и тот же PDF/голосовое (проверка кэша по file_unique_id),
+        # иначе у каждого сообщения свой файл с тем же содержимым
+        self.repeat_files = repeat_files
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._pdf = make_pdf(
+            [" ".join(random.choices(_LOREM, k=40)) for _ in range(pdf_pages)]
+        )
+        self._voice = make_wav(voice_seconds) if voice_seconds else b""
+        self._voice_seconds = voice_seconds
+        register_file("pdf-fixture", self._pdf)
+        register_file("voice-fixture", self._voice)
+
+    def _file_id(self, fixture: str, data: bytes) -> str:
+        if self.repeat_files:
+            return fixture
+        file_id = f"{fixture}-{next(self._update_ids)}"
+        self.register_file(file_id, data)
+        return file_id
+
+    def _envelope(self, chat_id: int, **message: object) -> dict:
+        return {
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {
+                    "id": chat_id,
+                    "is_bot": False,
+                    "first_name": "Bench",
+                    "username": ALLOWED_USERNAMES[0],
+                },
+                **message,
+            },
+        }
+
+    def make(self, kind: str, chat_id: int) -> dict:
+        if kind == "text":
+            words = random.randint(5, 40)
+            return self._envelope(chat_id, text=" ".join(random.choices(_LOREM, k=words)))
+        if kind == "photo":
+            file_id = f"photo-{random.randrange(1 << 30)}"
+            self.register_file(file_id, b"\xff\xd8\xff" + b"\0" * 1024)
+            return self._envelope(
+                chat_id,
+                caption="фото #bench",
+                photo=[
+                    {"file_id": file_id, "file_unique_id": file_id, "width": 800, "height": 600}
+                ],
+            )
+        if kind == "pdf":
+            file_id = self._file_id("pdf-fixture", self._pdf)
+            return self._envelope(
+                chat_id,
+                document={
+                    "file_id": file_id,
+                    "file_unique_id": file_id,
+                    "file_name": "bench.pdf",
+                    "mime_type": "application/pdf",
+                    "file_size": len(self._pdf),
+                },
+            )
+        if kind == "voice":
+            file_id = self._file_id("voice-fixture", self._voice)
+            return self._envelope(
+                chat_id,
+                voice={
+                    "file_id": file_id,
+                    "file_unique_id": file_id,
+                    "duration": int(self._voice_seconds),
+                    "mime_type": "audio/wav",
+                    "file_size": len(self._voice),
+                },
+            )
+        raise ValueError(f"неизвестный вид сообщения: {kind}")
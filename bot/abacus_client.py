@@ -1,66 +1,312 @@
 from __future__ import annotations
 
+import json
+import time
+from typing import AsyncIterator, Callable
+
 import httpx
 
-from .config import ABACUS_API_KEY, ABACUS_BASE_URL, ABACUS_MODEL
+from .concurrency import llm_stage
+from .config import (
+    ABACUS_API_KEY,
+    ABACUS_BASE_URL,
+    ABACUS_MODEL,
+    ABACUS_RATE_BURST,
+    ABACUS_RATE_LIMIT,
+)
+from .http_client import build_async_client
+from .llm_cache import LLMCache
+from .metrics import STAGE_SECONDS, stage
+from .quotas import LLM_TOKENS, charge
+from .resilience import ResilientBackend
+
+# Грубая оценка: для смеси кириллицы и латиницы ~3 символа на токен
+CHARS_PER_TOKEN = 3
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _prompt_tokens(messages: list[dict]) -> int:
+    return sum(estimate_tokens(m["content"]) for m in messages)
 
 
 class AbacusClient:
-    def __init__(self, api_key: str | None = None, base_url: str | None = None) -> None:
+    def __init__(
+        self,
+        api_key: str | None = None,
+        base_url: str | None = None,
+        cache: LLMCache | None = None,
+    ) -> None:
         self.api_key = api_key or ABACUS_API_KEY
         self.base_url = (base_url or ABACUS_BASE_URL).rstrip("/")
+        self.cache = cache
 
         if not self.api_key:
             raise RuntimeError("ABACUS_API_KEY is not set")
 
-    async def _chat(self, messages: list[dict]) -> str:
-        url = f"{self.base_url}/chat/completions"
+        self._http: httpx.AsyncClient | None = None
+        # Запрос к chat/completions без побочных эффектов, поэтому его можно повторять
+        self.backend = ResilientBackend("abacus", ABACUS_RATE_LIMIT, ABACUS_RATE_BURST)
 
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
+    @property
+    def http(self) -> httpx.AsyncClient:
+        """
+        Общий пул соединений к Abacus. Обычно открывается в post_init приложения,
+        но при прямом использовании клиента создаётся лениво.
+        """
+        if self._http is None or self._http.is_closed:
+            self._http = build_async_client(
+                self.base_url,
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json",
+                },
+            )
+        return self._http
+
+    async def open(self) -> None:
+        _ = self.http
+
+    async def aclose(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        if self.cache is not None:
+            self.cache.close()
+
+    async def _chat(self, messages: list[dict], use_cache: bool = True) -> str:
+        """
+        Запрос к chat/completions. Повторный запрос с теми же сообщениями
+        отдаётся из кэша, если он подключён и use_cache не выключен.
+        """
+        cache_key = None
+        if self.cache is not None and use_cache:
+            cache_key = self.cache.make_key(ABACUS_MODEL, messages)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
 
         payload = {
             "model": ABACUS_MODEL,
             "messages": messages,
         }
 
-        async with httpx.AsyncClient(timeout=60) as client:
-            resp = await client.post(url, headers=headers, json=payload)
-            resp.raise_for_status()
-            data = resp.json()
+        prompt_tokens = _prompt_tokens(messages)
+        # Доля пользователя в стадии считается по размеру запроса
+        async with llm_stage.slot(prompt_tokens):
+            with stage("abacus"):
+                resp = await self.backend.call(
+                    lambda: self.http.post("/chat/completions", json=payload)
+                )
+        resp.raise_for_status()
+        data = resp.json()
 
-        return data["choices"][0]["message"]["content"]
+        content = data["choices"][0]["message"]["content"]
+        usage = data.get("usage") or {}
+        charge(LLM_TOKENS, usage.get("total_tokens") or prompt_tokens + estimate_tokens(content))
+        if cache_key is not None:
+            self.cache.put(cache_key, content)
+        return content
 
-    async def expand_text(self, text: str) -> str:
+    async def _chat_stream(
+        self, messages: list[dict], use_cache: bool = True
+    ) -> AsyncIterator[str]:
         """
-        Вызывает Abacus RouteLLM (OpenAI-совместимую) для развёртывания мысли.
+        Потоковый запрос к chat/completions (SSE): отдаёт фрагменты ответа
+        по мере генерации. Ответ из кэша отдаётся одним фрагментом; полный
+        ответ после завершения потока кладётся в кэш.
+
+        Если сервер проигнорировал stream и вернул обычный JSON, ответ
+        отдаётся целиком.
         """
+        cache_key = None
+        if self.cache is not None and use_cache:
+            cache_key = self.cache.make_key(ABACUS_MODEL, messages)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+        payload = {
+            "model": ABACUS_MODEL,
+            "messages": messages,
+            "stream": True,
+        }
+
+        parts: list[str] = []
+        prompt_tokens = _prompt_tokens(messages)
+        async with llm_stage.slot(prompt_tokens):
+            with stage("abacus"):
+                start = time.perf_counter()
+                request = self.http.build_request("POST", "/chat/completions", json=payload)
+                # Повторяется только установка потока; оборванный посреди ответа поток — ошибка
+                resp = await self.backend.call(lambda: self.http.send(request, stream=True))
+                try:
+                    resp.raise_for_status()
+
+                    if not resp.headers.get("content-type", "").startswith("text/event-stream"):
+                        data = json.loads(await resp.aread())
+                        parts.append(data["choices"][0]["message"]["content"])
+                        yield parts[0]
+                    else:
+                        async for delta in _iter_sse_deltas(resp):
+                            if not parts:
+                                STAGE_SECONDS.observe(
+                                    time.perf_counter() - start, "abacus_first_token"
+                                )
+                            parts.append(delta)
+                            yield delta
+                finally:
+                    await resp.aclose()
+                    # Поток usage не возвращает: расход оценивается по длине текста
+                    charge(LLM_TOKENS, prompt_tokens + estimate_tokens("".join(parts)))
+
+        if cache_key is not None:
+            self.cache.put(cache_key, "".join(parts))
+
+    @staticmethod
+    def _expand_text_messages(text: str) -> list[dict]:
         system_prompt = (
             "Ты помощник, который помогает пользователю развёртывать краткие мысли "
             "в более подробные и структурированные заметки для персональной базы знаний."
         )
-        messages = [
+        return [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": text},
         ]
-        return await self._chat(messages)
 
-    async def summarize_pdf(self, text: str, target_lang: str = "ru") -> str:
-        """
-        Перевод и объяснение сути PDF-документа.
-        """
+    @staticmethod
+    def _summarize_pdf_messages(text: str, target_lang: str) -> list[dict]:
         system_prompt = (
             "Ты помощник, который получает текст PDF-документа и должен:\n"
             "1) Кратко и понятно изложить его суть и ключевые идеи.\n"
             f"2) Перевести и объяснить содержание на {target_lang} языке.\n"
             "Ответ дай в виде структурированной заметки (заголовки, списки по необходимости)."
         )
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": text},
+        ]
+
+    @staticmethod
+    def _merge_summaries_messages(summaries: list[str], target_lang: str) -> list[dict]:
+        system_prompt = (
+            "Ты помощник, который получает конспекты последовательных частей одного документа и должен:\n"
+            "1) Кратко и понятно изложить суть и ключевые идеи всего документа.\n"
+            f"2) Объяснить содержание на {target_lang} языке, убрав повторы между частями.\n"
+            "Ответ дай в виде структурированной заметки (заголовки, списки по необходимости)."
+        )
+        parts = "\n\n".join(
+            f"### Часть {i}\n{summary}" for i, summary in enumerate(summaries, start=1)
+        )
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": parts},
+        ]
+
+    async def expand_text(self, text: str, use_cache: bool = True) -> str:
+        """
+        Вызывает Abacus RouteLLM (OpenAI-совместимую) для развёртывания мысли.
+        """
+        return await self._chat(self._expand_text_messages(text), use_cache=use_cache)
+
+    def expand_text_stream(self, text: str, use_cache: bool = True) -> AsyncIterator[str]:
+        """
+        То же, что expand_text, но фрагментами по мере генерации.
+        """
+        return self._chat_stream(self._expand_text_messages(text), use_cache=use_cache)
+
+    async def summarize_pdf(
+        self, text: str, target_lang: str = "ru", use_cache: bool = True
+    ) -> str:
+        """
+        Перевод и объяснение сути PDF-документа.
+        """
+        messages = self._summarize_pdf_messages(text, target_lang)
+        return await self._chat(messages, use_cache=use_cache)
+
+    def summarize_pdf_stream(
+        self, text: str, target_lang: str = "ru", use_cache: bool = True
+    ) -> AsyncIterator[str]:
+        messages = self._summarize_pdf_messages(text, target_lang)
+        return self._chat_stream(messages, use_cache=use_cache)
+
+    async def summarize_pdf_chunk(
+        self, text: str, part: int, total: int, target_lang: str = "ru", use_cache: bool = True
+    ) -> str:
+        """
+        Конспект одной части длинного документа (шаг map в map-reduce суммаризации).
+        """
+        system_prompt = (
+            f"Ты помощник, который получает часть {part} из {total} длинного документа.\n"
+            "Сделай подробный конспект только этой части: ключевые идеи, факты, "
+            "определения, числа и выводы. Не додумывай то, чего нет в тексте.\n"
+            f"Пиши на {target_lang} языке, списками, без вступлений."
+        )
         messages = [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": text},
         ]
-        return await self._chat(messages)
+        return await self._chat(messages, use_cache=use_cache)
+
+    async def merge_summaries(
+        self, summaries: list[str], target_lang: str = "ru", use_cache: bool = True
+    ) -> str:
+        """
+        Сводит конспекты частей документа в одну структурированную заметку (шаг reduce).
+        """
+        messages = self._merge_summaries_messages(summaries, target_lang)
+        return await self._chat(messages, use_cache=use_cache)
+
+    def merge_summaries_stream(
+        self, summaries: list[str], target_lang: str = "ru", use_cache: bool = True
+    ) -> AsyncIterator[str]:
+        messages = self._merge_summaries_messages(summaries, target_lang)
+        return self._chat_stream(messages, use_cache=use_cache)
+
+
+async def _iter_sse_deltas(resp: httpx.Response) -> AsyncIterator[str]:
+    """
+    Разбирает поток Server-Sent Events от OpenAI-совместимого API
+    и отдаёт непустые choices[0].delta.content.
+    """
+    async for line in resp.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return
+        if not data:
+            continue
+        choices = json.loads(data).get("choices") or []
+        if not choices:
+            continue
+        delta = (choices[0].get("delta") or {}).get("content")
+        if delta:
+            yield delta
 
 
+async def collect_stream(
+    stream: AsyncIterator[str],
+    on_text: Callable[[str], None] | None = None,
+    interval: float = 0.25,
+) -> str:
+    """
+    Собирает потоковый ответ целиком; on_text получает накопленный текст
+    не чаще раза в interval секунд (например, для StatusMessage.set),
+    чтобы не склеивать длинный ответ заново на каждый фрагмент.
+    """
+    parts: list[str] = []
+    last_call = 0.0
+    async for delta in stream:
+        parts.append(delta)
+        now = time.monotonic()
+        if on_text is not None and now - last_call >= interval:
+            last_call = now
+            on_text("".join(parts))
+    text = "".join(parts)
+    if on_text is not None:
+        on_text(text)
+    return text
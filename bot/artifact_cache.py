@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from .config import (
+    ARTIFACT_CACHE_MAX_MB,
+    ARTIFACT_CACHE_PATH,
+    PDF_MAX_CHARS,
+    PDF_MAX_PAGES,
+    VOICE_MAX_SILENCE_SECONDS,
+    VOICE_VAD_ENABLED,
+    VOICE_VAD_MIN_RMS,
+    WHISPER_BACKEND,
+    WHISPER_COMPUTE_TYPE,
+    WHISPER_FALLBACK_LOGPROB,
+    WHISPER_FALLBACK_MODEL,
+    WHISPER_LANGUAGE,
+    WHISPER_MODEL,
+)
+from .sqlite_store import BoundedStore
+
+# Результат обработки зависит от её параметров: после их смены файл обрабатывается заново
+_VAD = f"{VOICE_MAX_SILENCE_SECONDS}@{VOICE_VAD_MIN_RMS}" if VOICE_VAD_ENABLED else "off"
+TRANSCRIPT_KIND = (
+    f"transcript:{WHISPER_BACKEND}:{WHISPER_MODEL}:{WHISPER_COMPUTE_TYPE}:{WHISPER_LANGUAGE}"
+    f":fallback={WHISPER_FALLBACK_MODEL}@{WHISPER_FALLBACK_LOGPROB}:vad={_VAD}"
+)
+PDF_KIND = f"pdf_pages:{PDF_MAX_PAGES}:{PDF_MAX_CHARS}"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    file_unique_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL,
+    outbox_id INTEGER,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (file_unique_id, kind)
+);
+CREATE INDEX IF NOT EXISTS artifacts_accessed ON artifacts (accessed_at);
+"""
+
+
+@dataclass
+class Artifact:
+    value: str
+    # Запись outbox (и индекса заметок), созданная из этого файла в прошлый раз
+    outbox_id: int | None
+    created_at: float
+
+
+class ArtifactCache(BoundedStore):
+    """
+    Результаты тяжёлой обработки файлов Telegram (расшифровка голосового,
+    текст PDF) по file_unique_id — он одинаков у пересланных копий файла.
+
+    Повторно присланный файл не скачивается и не обрабатывается заново.
+    kind включает параметры обработки (движок и модель Whisper, VAD,
+    лимиты PDF), чтобы после их смены результат считался заново. Размер
+    на диске ограничен, вытесняются давно не читанные записи.
+    """
+
+    SCHEMA = _SCHEMA
+    TABLE = "artifacts"
+
+    def __init__(
+        self,
+        path: str | Path = ARTIFACT_CACHE_PATH,
+        max_bytes: int = int(ARTIFACT_CACHE_MAX_MB * 1024 * 1024),
+    ) -> None:
+        super().__init__(path, max_bytes)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, file_unique_id: str, kind: str) -> Artifact | None:
+        db = self._conn
+        row = db.execute(
+            "SELECT value, outbox_id, created_at FROM artifacts WHERE file_unique_id = ? AND kind = ?",
+            (file_unique_id, kind),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        db.execute(
+            "UPDATE artifacts SET accessed_at = ? WHERE file_unique_id = ? AND kind = ?",
+            (time.time(), file_unique_id, kind),
+        )
+        self.hits += 1
+        return Artifact(*row)
+
+    def put(self, file_unique_id: str, kind: str, value: str) -> None:
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        db = self._conn
+        old = db.execute(
+            "SELECT size FROM artifacts WHERE file_unique_id = ? AND kind = ?",
+            (file_unique_id, kind),
+        ).fetchone()
+        db.execute(
+            "INSERT OR REPLACE INTO artifacts"
+            " (file_unique_id, kind, value, outbox_id, size, created_at, accessed_at)"
+            " VALUES (?, ?, ?, NULL, ?, ?, ?)",
+            (file_unique_id, kind, value, size, now, now),
+        )
+        self._grew(size - (old[0] if old else 0), size)
+
+    def set_outbox_id(self, file_unique_id: str, kind: str, outbox_id: int) -> None:
+        self._conn.execute(
+            "UPDATE artifacts SET outbox_id = ? WHERE file_unique_id = ? AND kind = ?",
+            (outbox_id, file_unique_id, kind),
+        )
+
+    def delete(self, file_unique_id: str, kind: str) -> None:
+        db = self._conn
+        row = db.execute(
+            "DELETE FROM artifacts WHERE file_unique_id = ? AND kind = ? RETURNING size",
+            (file_unique_id, kind),
+        ).fetchone()
+        if row is not None:
+            self._disk_bytes -= row[0]
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "disk_bytes": self._disk_bytes}
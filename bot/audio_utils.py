@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import asyncio
+import tempfile
+from typing import TYPE_CHECKING
+
+from .config import (
+    MEDIA_TMP_DIR,
+    VOICE_MAX_SILENCE_SECONDS,
+    VOICE_SEGMENT_SECONDS,
+    VOICE_SPLIT_WINDOW_SECONDS,
+    VOICE_VAD_MIN_RMS,
+)
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Whisper работает с моно 16 кГц
+SAMPLE_RATE = 16000
+_FRAME_SAMPLES = SAMPLE_RATE * 30 // 1000  # окна по 30 мс для оценки энергии
+
+
+class AudioDecodeError(RuntimeError):
+    pass
+
+
+async def _run_ffmpeg(input_arg: str, data: bytes | memoryview | None) -> np.ndarray:
+    args = ["ffmpeg", "-hide_banner", "-threads", "0", "-i", input_arg]
+    args += ["-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE), "-"]
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=asyncio.subprocess.PIPE if data is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    out, err = await process.communicate(data)
+    if process.returncode != 0:
+        lines = err.decode(errors="replace").strip().splitlines()
+        raise AudioDecodeError(lines[-1] if lines else "ffmpeg завершился с ошибкой")
+    # numpy импортируется при первом голосовом, а не при старте бота
+    import numpy as np
+
+    return np.frombuffer(out, np.int16).astype(np.float32) / 32768.0
+
+
+async def decode_to_pcm(source: str | bytes | memoryview) -> np.ndarray:
+    """
+    Декодирует аудио через ffmpeg в моно float32 PCM 16 кГц (как whisper.load_audio),
+    но асинхронно, не блокируя event loop.
+
+    source — путь к файлу или байты в памяти; байты подаются в ffmpeg через stdin.
+    """
+    if isinstance(source, str):
+        return await _run_ffmpeg(source, None)
+
+    try:
+        return await _run_ffmpeg("pipe:0", source)
+    except AudioDecodeError:
+        # Некоторым контейнерам (mp4/m4a с индексом в конце) нужен seek — пробуем через файл
+        MEDIA_TMP_DIR.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=MEDIA_TMP_DIR) as tmp:
+            tmp.write(source)
+            tmp.flush()
+            return await _run_ffmpeg(tmp.name, None)
+
+
+def frame_energy(audio: np.ndarray) -> np.ndarray:
+    """
+    Среднеквадратичная энергия по окнам 30 мс (векторно, без цикла по окнам).
+    """
+    import numpy as np
+
+    frames = len(audio) // _FRAME_SAMPLES
+    if frames == 0:
+        return np.zeros(0, dtype=np.float32)
+    windows = audio[: frames * _FRAME_SAMPLES].reshape(frames, _FRAME_SAMPLES)
+    return np.sqrt(np.mean(windows * windows, axis=1))
+
+
+def trim_silence(
+    audio: np.ndarray,
+    max_silence_seconds: float = VOICE_MAX_SILENCE_SECONDS,
+    min_rms: float = VOICE_VAD_MIN_RMS,
+) -> np.ndarray:
+    """
+    Вырезает тишину в начале и в конце записи и сжимает паузы длиннее
+    max_silence_seconds до этой длины, чтобы в модель шло меньше аудио.
+
+    Окно 30 мс считается речью, если его энергия выше порога: не ниже min_rms
+    и в несколько раз выше фонового шума (10-й перцентиль энергии), но не
+    выше половины медианы — иначе в сплошной речи терялись бы тихие слоги.
+    Возвращает пустой массив, если речи нет совсем.
+    """
+    import numpy as np
+
+    energy = frame_energy(audio)
+    frames = len(energy)
+    if frames == 0:
+        return audio
+    noise = float(np.percentile(energy, 10))
+    threshold = max(min_rms, min(noise * 3, float(np.median(energy)) * 0.5))
+    voiced = energy > threshold
+    if not voiced.any():
+        return audio[:0]
+
+    # Вокруг каждого окна речи оставляем по половине max_silence: окно сохраняется,
+    # если в пределах pad окон от него есть речь (расширение маски через префиксные суммы)
+    pad = int(max_silence_seconds * SAMPLE_RATE / 2) // _FRAME_SAMPLES
+    counts = np.concatenate(([0], np.cumsum(voiced)))
+    index = np.arange(frames)
+    keep = counts[np.minimum(index + pad + 1, frames)] - counts[np.maximum(index - pad, 0)] > 0
+    if keep.all():
+        return audio
+
+    mask = np.repeat(keep, _FRAME_SAMPLES)
+    # Хвост короче окна идёт за последним окном
+    mask = np.concatenate((mask, np.full(len(audio) - len(mask), keep[-1])))
+    return audio[mask]
+
+
+def split_on_silence(
+    audio: np.ndarray,
+    segment_seconds: float = VOICE_SEGMENT_SECONDS,
+    window_seconds: float = VOICE_SPLIT_WINDOW_SECONDS,
+) -> list[np.ndarray]:
+    """
+    Режет длинную запись на куски примерно по segment_seconds.
+
+    Граница каждого куска выбирается в самом тихом окне в пределах
+    ±window_seconds от целевой точки, чтобы не разрезать слово пополам.
+    Короткие записи (до полутора длин сегмента) возвращаются целиком.
+    """
+    import numpy as np
+
+    segment = int(segment_seconds * SAMPLE_RATE)
+    if len(audio) <= segment * 1.5:
+        return [audio]
+
+    energy = frame_energy(audio)
+    window = max(1, int(window_seconds * SAMPLE_RATE) // _FRAME_SAMPLES)
+    cuts: list[int] = []
+    start = 0
+    while len(audio) - start > segment * 1.5:
+        target = (start + segment) // _FRAME_SAMPLES
+        lo = max(start // _FRAME_SAMPLES + 1, target - window)
+        hi = min(len(energy), target + window + 1)
+        quietest = lo + int(np.argmin(energy[lo:hi]))
+        cut = quietest * _FRAME_SAMPLES + _FRAME_SAMPLES // 2
+        cuts.append(cut)
+        start = cut
+
+    return np.split(audio, cuts)
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Hashable
+
+from telegram import Message
+
+from .config import TEXT_BATCH_MAX_CHARS, TEXT_BATCH_MAX_MESSAGES, TEXT_DEBOUNCE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+ProcessBatch = Callable[[Hashable, list[Message]], Awaitable[None]]
+
+
+class _Buffer:
+    __slots__ = ("messages", "chars", "timer")
+
+    def __init__(self) -> None:
+        self.messages: list[Message] = []
+        self.chars = 0
+        self.timer: asyncio.TimerHandle | None = None
+
+
+class _KeyLock:
+    __slots__ = ("lock", "users")
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class MessageCoalescer:
+    """
+    Склейка быстрых сообщений с одним ключом (чат, альбом) в одну пачку.
+
+    Сообщение попадает в буфер по ключу, и каждое новое сообщение перезапускает
+    таймер на debounce секунд. Когда таймер срабатывает (или в буфере набралось
+    max_messages сообщений / max_chars символов, или вызван flush), пачка
+    обрабатывается в фоне через process. Пачки с одним ключом обрабатываются
+    строго по очереди; если обработка упала, отвечаем на последнее сообщение.
+
+    Хендлер при этом не ждёт таймера, поэтому не держит очередь апдейтов чата.
+    Чтобы следующий апдейт чата не обогнал пачку, перед ним вызывается drain.
+    """
+
+    def __init__(
+        self,
+        process: ProcessBatch,
+        debounce: float = TEXT_DEBOUNCE_SECONDS,
+        max_messages: int = TEXT_BATCH_MAX_MESSAGES,
+        max_chars: int = TEXT_BATCH_MAX_CHARS,
+    ) -> None:
+        self.process = process
+        self.debounce = debounce
+        self.max_messages = max_messages
+        self.max_chars = max_chars
+        self._buffers: dict[Hashable, _Buffer] = {}
+        self._locks: dict[Hashable, _KeyLock] = {}
+        # Фоновая задача пачки -> её ключ
+        self._tasks: dict[asyncio.Task, Hashable] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.debounce > 0
+
+    @property
+    def pending(self) -> int:
+        """
+        Сообщения, которые ждут в буферах.
+        """
+        return sum(len(buffer.messages) for buffer in self._buffers.values())
+
+    def add(self, key: Hashable, message: Message) -> None:
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            buffer = self._buffers[key] = _Buffer()
+        buffer.messages.append(message)
+        buffer.chars += len(message.text or "")
+
+        if len(buffer.messages) >= self.max_messages or buffer.chars >= self.max_chars:
+            self.flush(key)
+            return
+
+        if buffer.timer is not None:
+            buffer.timer.cancel()
+        buffer.timer = asyncio.get_running_loop().call_later(self.debounce, self.flush, key)
+
+    def flush(self, key: Hashable) -> bool:
+        """
+        Отправить буфер в обработку, не дожидаясь таймера.
+        Возвращает False, если буфер пуст.
+        """
+        buffer = self._buffers.pop(key, None)
+        if buffer is None:
+            return False
+        if buffer.timer is not None:
+            buffer.timer.cancel()
+
+        key_lock = self._locks.get(key)
+        if key_lock is None:
+            key_lock = self._locks[key] = _KeyLock()
+        key_lock.users += 1
+
+        task = asyncio.create_task(self._run(key, key_lock, buffer.messages))
+        self._tasks[task] = key
+        task.add_done_callback(self._forget)
+        return True
+
+    def _forget(self, task: asyncio.Task) -> None:
+        self._tasks.pop(task, None)
+
+    async def drain(self, match: Callable[[Hashable], bool]) -> bool:
+        """
+        Сразу обработать буферы с ключами, для которых match истинно, и
+        дождаться их пачек (в том числе уже запущенных). Возвращает False,
+        если ждать было нечего.
+        """
+        for key in [key for key in self._buffers if match(key)]:
+            self.flush(key)
+        tasks = [task for task, key in self._tasks.items() if match(key)]
+        if not tasks:
+            return False
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return True
+
+    async def _run(self, key: Hashable, key_lock: _KeyLock, messages: list[Message]) -> None:
+        try:
+            async with key_lock.lock:
+                await self.process(key, messages)
+        except Exception:
+            logger.exception("Не удалось обработать пачку из %s сообщений (%s)", len(messages), key)
+            try:
+                await messages[-1].reply_text("Не удалось обработать сообщение, пришли его ещё раз.")
+            except Exception as e:
+                logger.warning("Не удалось сообщить об ошибке обработки: %s", e)
+        finally:
+            key_lock.users -= 1
+            if key_lock.users == 0:
+                self._locks.pop(key, None)
+
+    async def stop(self) -> None:
+        """
+        Обработать всё, что осталось в буферах, и дождаться фоновых задач.
+        """
+        await self.drain(lambda key: True)
@@ -0,0 +1,300 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Hashable, Iterator
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from .config import (
+    FAIR_INTERACTIVE_RESERVE,
+    FAIR_MAX_WAIT_SECONDS,
+    LLM_CONCURRENCY,
+    MEM_CONCURRENCY,
+    UPDATES_CONCURRENCY,
+    UPDATES_MAX_PENDING,
+    WHISPER_CONCURRENCY,
+)
+from .metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+STAGE_WAIT_SECONDS = Histogram(
+    "bot_stage_wait_seconds", "Ожидание слота стадии по классу задачи.", ["stage", "class"]
+)
+
+
+@dataclass
+class Job:
+    """
+    Чья работа сейчас выполняется: по ней стадии делят слоты между
+    пользователями. Задаётся job_context() и наследуется задачами asyncio,
+    созданными внутри него.
+    """
+
+    # Ключ справедливого разделения (id пользователя)
+    user: Hashable
+    weight: float = 1.0
+    # Короткая задача, ответа на которую ждут (текст, фото, короткое голосовое)
+    interactive: bool = True
+    # meter(user, вид ресурса, количество) — учёт расхода для квот
+    meter: Callable[[Hashable, str, float], None] | None = None
+
+    def charge(self, kind: str, amount: float) -> None:
+        if self.meter is not None and amount > 0:
+            self.meter(self.user, kind, amount)
+
+
+_current_job: ContextVar[Job | None] = ContextVar("job", default=None)
+
+
+def current_job() -> Job | None:
+    return _current_job.get()
+
+
+@contextmanager
+def job_context(
+    user: Hashable,
+    weight: float = 1.0,
+    interactive: bool = True,
+    meter: Callable[[Hashable, str, float], None] | None = None,
+) -> Iterator[Job]:
+    job = Job(user, weight, interactive, meter)
+    token = _current_job.set(job)
+    try:
+        yield job
+    finally:
+        _current_job.reset(token)
+
+
+@dataclass(eq=False)
+class _Waiter:
+    future: asyncio.Future
+    user: Hashable
+    interactive: bool
+    # Виртуальные время начала и окончания (start-time fair queuing)
+    start_tag: float
+    finish_tag: float
+    enqueued_at: float
+
+
+class _Slot:
+    __slots__ = ("limiter", "cost", "interactive")
+
+    def __init__(self, limiter: "StageLimiter", cost: float) -> None:
+        self.limiter = limiter
+        self.cost = cost
+        self.interactive = True
+
+    async def __aenter__(self) -> "_Slot":
+        self.interactive = await self.limiter.acquire(self.cost)
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        self.limiter.release(self.interactive)
+
+
+class StageLimiter:
+    """
+    Ограничение параллельности одной стадии обработки (LLM, Mem.ai, Whisper).
+
+    У каждой стадии свой лимит, поэтому быстрые текстовые заметки не ждут,
+    пока освободится место, занятое тяжёлой транскрибацией.
+
+    Когда слотов не хватает, очередь разбирается не по порядку прихода,
+    а взвешенно-справедливо между пользователями (start-time fair queuing):
+    каждый запрос получает виртуальное время окончания start + cost / weight,
+    и первым идёт запрос с наименьшим. Пользователь, отправивший пачку PDF,
+    ждёт своих же запросов, а не занимает стадию целиком. Интерактивные
+    запросы обслуживаются раньше длинных, а длинным не достаются последние
+    reserve слотов; длинный запрос, прождавший max_wait секунд, больше не
+    уступает интерактивным. Работа без job_context() — один общий пользователь.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        limit: int,
+        reserve: int = FAIR_INTERACTIVE_RESERVE,
+        max_wait: float = FAIR_MAX_WAIT_SECONDS,
+    ) -> None:
+        self.name = name
+        self.limit = limit
+        self.bulk_limit = max(1, limit - reserve)
+        self.max_wait = max_wait
+        self.active = 0
+        self.active_bulk = 0
+        self._waiters: list[_Waiter] = []
+        self._virtual_time = 0.0
+        self._last_finish: dict[Hashable, float] = {}
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def slot(self, cost: float = 1.0) -> _Slot:
+        """
+        async with stage.slot(cost): cost — оценка объёма работы (токены, секунды
+        аудио), по которой считается справедливая доля пользователя.
+        """
+        return _Slot(self, cost)
+
+    async def acquire(self, cost: float = 1.0) -> bool:
+        """
+        Занимает слот; возвращает класс слота (True — интерактивный) для release().
+        """
+        job = _current_job.get()
+        user = job.user if job is not None else None
+        weight = job.weight if job is not None else 1.0
+        interactive = job.interactive if job is not None else True
+
+        start_tag = max(self._virtual_time, self._last_finish.get(user, 0.0))
+        finish_tag = start_tag + max(cost, 1e-9) / weight
+        self._last_finish[user] = finish_tag
+        waiter = _Waiter(
+            asyncio.get_running_loop().create_future(),
+            user, interactive, start_tag, finish_tag, time.monotonic(),
+        )
+        self._waiters.append(waiter)
+        self._dispatch()
+
+        if not waiter.future.done():
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                if waiter.future.cancelled():
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+                else:
+                    # Слот выдан, но задача уже отменена — возвращаем его
+                    self.release(interactive)
+                raise
+        STAGE_WAIT_SECONDS.observe(
+            time.monotonic() - waiter.enqueued_at, self.name, "interactive" if interactive else "bulk"
+        )
+        return interactive
+
+    def release(self, interactive: bool) -> None:
+        self.active -= 1
+        if not interactive:
+            self.active_bulk -= 1
+        self._dispatch()
+
+    def _next(self) -> _Waiter | None:
+        now = time.monotonic()
+        best: _Waiter | None = None
+        best_key: tuple[bool, float, float] | None = None
+        for waiter in self._waiters:
+            if not waiter.interactive and self.active_bulk >= self.bulk_limit:
+                continue
+            overdue = not waiter.interactive and now - waiter.enqueued_at >= self.max_wait
+            key = (not (waiter.interactive or overdue), waiter.finish_tag, waiter.enqueued_at)
+            if best_key is None or key < best_key:
+                best, best_key = waiter, key
+        return best
+
+    def _dispatch(self) -> None:
+        while self.active < self.limit and self._waiters:
+            waiter = self._next()
+            if waiter is None:
+                break
+            self._waiters.remove(waiter)
+            if waiter.future.done():
+                # Ожидание отменено, а задача ещё не успела убрать себя из очереди
+                continue
+            self.active += 1
+            if not waiter.interactive:
+                self.active_bulk += 1
+            self._virtual_time = max(self._virtual_time, waiter.start_tag)
+            waiter.future.set_result(None)
+        if not self._waiters and self.active == 0:
+            # Стадия простаивает: накопленная история пользователей больше не нужна
+            self._virtual_time = 0.0
+            self._last_finish.clear()
+
+
+llm_stage = StageLimiter("llm", LLM_CONCURRENCY)
+mem_stage = StageLimiter("mem", MEM_CONCURRENCY)
+whisper_stage = StageLimiter("whisper", WHISPER_CONCURRENCY)
+
+
+class _ChatQueue:
+    __slots__ = ("lock", "users")
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Параллельная обработка апдейтов с сохранением порядка внутри одного чата.
+
+    Апдейты одного чата выполняются строго по очереди, разных чатов — параллельно,
+    но не более concurrency одновременно. Если все слоты заняты, пользователь
+    получает ответ «поставлено в очередь»; если в системе уже max_pending
+    апдейтов, новый отклоняется с просьбой повторить позже, чтобы очередь
+    не росла без ограничений.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = UPDATES_CONCURRENCY,
+        max_pending: int = UPDATES_MAX_PENDING,
+    ) -> None:
+        # Семафор базового класса — только страховочный верхний предел;
+        # реальные лимиты применяются в do_process_update
+        super().__init__(max_concurrent_updates=max_pending + concurrency)
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self._slots = asyncio.Semaphore(concurrency)
+        self._chats: dict[int, _ChatQueue] = {}
+        self.pending = 0
+        self.rejected = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    @staticmethod
+    async def _notify(update: object, text: str) -> None:
+        if isinstance(update, Update) and update.effective_message is not None:
+            try:
+                await update.effective_message.reply_text(text)
+            except Exception as e:
+                logger.warning("Не удалось отправить уведомление о загрузке: %s", e)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            if asyncio.iscoroutine(coroutine):
+                coroutine.close()
+            await self._notify(update, "Бот сейчас перегружен, отправь это сообщение чуть позже.")
+            return
+
+        chat = update.effective_chat if isinstance(update, Update) else None
+        chat_id = chat.id if chat is not None else 0
+        queue = self._chats.setdefault(chat_id, _ChatQueue())
+        queue.users += 1
+        self.pending += 1
+        try:
+            async with queue.lock:
+                if self._slots.locked():
+                    await self._notify(
+                        update,
+                        "Сейчас много задач — сообщение поставлено в очередь, обработаю его следом.",
+                    )
+                async with self._slots:
+                    await coroutine
+        finally:
+            self.pending -= 1
+            queue.users -= 1
+            if queue.users == 0:
+                self._chats.pop(chat_id, None)
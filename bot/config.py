@@ -1,4 +1,6 @@
 import os
+import tempfile
+from pathlib import Path
 
 from dotenv import load_dotenv
 
@@ -6,7 +8,44 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if not value:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_list(name: str, default: str = "") -> list[str]:
+    value = os.getenv(name) or default
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def _env_weights(name: str) -> dict[str, float]:
+    """
+    "alice:3,bob" -> {"alice": 3.0, "bob": 1.0}
+    """
+    weights: dict[str, float] = {}
+    for item in _env_list(name):
+        user, _, weight = item.partition(":")
+        weights[user.strip().lstrip("@").lower()] = float(weight) if weight.strip() else 1.0
+    return weights
+
+
 TELEGRAM_BOT_TOKEN: str | None = os.getenv("TELEGRAM_BOT_TOKEN")
+# Кому доступен бот: usernames Telegram (без @) или числовые id пользователей через запятую
+ALLOWED_USERNAMES: list[str] = _env_list("ALLOWED_USERNAMES", "AlexGorshunov")
+# Кому доступны служебные команды (/stats, /reindex); по умолчанию — первому из ALLOWED_USERNAMES
+ADMIN_USERNAMES: list[str] = _env_list("ADMIN_USERNAMES", ",".join(ALLOWED_USERNAMES[:1]))
 
 ABACUS_API_KEY: str | None = os.getenv("ABACUS_API_KEY")
 ABACUS_BASE_URL: str = os.getenv("ABACUS_BASE_URL", "https://routellm.abacus.ai/v1")
@@ -15,6 +54,174 @@ ABACUS_MODEL: str = os.getenv("ABACUS_MODEL", "route-llm")
 MEM_API_KEY: str | None = os.getenv("MEM_API_KEY")
 MEM_API_BASE_URL: str = os.getenv("MEM_API_BASE_URL", "https://api.mem.ai/v2")
 
+# Пул HTTP-соединений к Abacus и Mem.ai (один долгоживущий клиент на бэкенд)
+HTTP_MAX_CONNECTIONS: int = _env_int("HTTP_MAX_CONNECTIONS", 20)
+HTTP_MAX_KEEPALIVE_CONNECTIONS: int = _env_int("HTTP_MAX_KEEPALIVE_CONNECTIONS", 10)
+HTTP_KEEPALIVE_EXPIRY: float = _env_float("HTTP_KEEPALIVE_EXPIRY", 60.0)
+HTTP2_ENABLED: bool = _env_bool("HTTP2", False)
+HTTP_CONNECT_TIMEOUT: float = _env_float("HTTP_CONNECT_TIMEOUT", 10.0)
+HTTP_READ_TIMEOUT: float = _env_float("HTTP_READ_TIMEOUT", 120.0)
+HTTP_WRITE_TIMEOUT: float = _env_float("HTTP_WRITE_TIMEOUT", 30.0)
+HTTP_POOL_TIMEOUT: float = _env_float("HTTP_POOL_TIMEOUT", 10.0)
+
+# Лимиты частоты запросов к внешним API (запросов в секунду, 0 — без лимита),
+# повторы временных ошибок и предохранитель при недоступности бэкенда
+ABACUS_RATE_LIMIT: float = _env_float("ABACUS_RATE_LIMIT", 5.0)
+ABACUS_RATE_BURST: int = _env_int("ABACUS_RATE_BURST", 10)
+MEM_RATE_LIMIT: float = _env_float("MEM_RATE_LIMIT", 5.0)
+MEM_RATE_BURST: int = _env_int("MEM_RATE_BURST", 10)
+BACKEND_MAX_RETRIES: int = _env_int("BACKEND_MAX_RETRIES", 3)
+BACKEND_RETRY_BASE: float = _env_float("BACKEND_RETRY_BASE", 0.5)
+BACKEND_RETRY_MAX: float = _env_float("BACKEND_RETRY_MAX", 30.0)
+BREAKER_FAILURE_THRESHOLD: int = _env_int("BREAKER_FAILURE_THRESHOLD", 5)
+BREAKER_RESET_SECONDS: float = _env_float("BREAKER_RESET_SECONDS", 30.0)
+
+# Приём апдейтов через webhook вместо long polling (пустой WEBHOOK_URL — polling).
+# WEBHOOK_URL — публичный https-адрес, который Telegram будет вызывать; локальный
+# сервер слушает WEBHOOK_HOST:WEBHOOK_PORT (обычно за reverse proxy с TLS).
+# Без WEBHOOK_SECRET секрет генерируется при каждом запуске.
+WEBHOOK_URL: str = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_HOST: str = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT: int = _env_int("WEBHOOK_PORT", 8080)
+WEBHOOK_SECRET: str = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_QUEUE_SIZE: int = _env_int("WEBHOOK_QUEUE_SIZE", 1000)
+WEBHOOK_MAX_CONNECTIONS: int = _env_int("WEBHOOK_MAX_CONNECTIONS", 40)
+
+# Параллельная обработка апдейтов и лимиты по стадиям
+UPDATES_CONCURRENCY: int = _env_int("UPDATES_CONCURRENCY", 16)
+UPDATES_MAX_PENDING: int = _env_int("UPDATES_MAX_PENDING", 200)
+# Число процессов-шардов с хендлерами; апдейты получает и раздаёт по chat_id отдельный
+# процесс-поллер. 0 — всё в одном процессе. Лимиты выше и WHISPER_WORKERS — на каждый шард
+SHARD_WORKERS: int = _env_int("SHARD_WORKERS", 0)
+LLM_CONCURRENCY: int = _env_int("LLM_CONCURRENCY", 8)
+MEM_CONCURRENCY: int = _env_int("MEM_CONCURRENCY", 4)
+WHISPER_CONCURRENCY: int = _env_int("WHISPER_CONCURRENCY", 2)
+
+# Справедливое разделение стадий между пользователями (взвешенная справедливая очередь).
+# USER_WEIGHTS — веса вида "alice:3,bob:1" (остальным — 1): при нехватке слотов alice
+# получает втрое больше, чем bob. Тексты, фото и голосовые до INTERACTIVE_VOICE_SECONDS
+# обслуживаются раньше PDF, импорта и длинных голосовых; длинным задачам не достаются
+# последние FAIR_INTERACTIVE_RESERVE слотов стадии, а прождавшие FAIR_MAX_WAIT_SECONDS
+# перестают уступать коротким
+USER_WEIGHTS: dict[str, float] = _env_weights("USER_WEIGHTS")
+INTERACTIVE_VOICE_SECONDS: float = _env_float("INTERACTIVE_VOICE_SECONDS", 60.0)
+FAIR_INTERACTIVE_RESERVE: int = _env_int("FAIR_INTERACTIVE_RESERVE", 1)
+FAIR_MAX_WAIT_SECONDS: float = _env_float("FAIR_MAX_WAIT_SECONDS", 30.0)
+
+# Квоты на пользователя (0 — без лимита): сообщений в минуту (USER_RATE_BURST можно
+# отправить подряд), токенов LLM и минут распознанного аудио в сутки
+USER_RATE_LIMIT: float = _env_float("USER_RATE_LIMIT", 0.0)
+USER_RATE_BURST: int = _env_int("USER_RATE_BURST", 10)
+USER_DAILY_LLM_TOKENS: int = _env_int("USER_DAILY_LLM_TOKENS", 0)
+USER_DAILY_AUDIO_MINUTES: float = _env_float("USER_DAILY_AUDIO_MINUTES", 0.0)
+
+# Склейка быстрых текстовых сообщений одного чата в одну заметку
+# (0 — выключить: каждое сообщение обрабатывается сразу)
+TEXT_DEBOUNCE_SECONDS: float = _env_float("TEXT_DEBOUNCE_SECONDS", 2.0)
+TEXT_BATCH_MAX_MESSAGES: int = _env_int("TEXT_BATCH_MAX_MESSAGES", 10)
+TEXT_BATCH_MAX_CHARS: int = _env_int("TEXT_BATCH_MAX_CHARS", 8000)
+# Сколько ждать остальные фото альбома (media_group_id), прежде чем сохранить его одной заметкой
+PHOTO_ALBUM_WINDOW_SECONDS: float = _env_float("PHOTO_ALBUM_WINDOW_SECONDS", 1.0)
+
+# Автоматически дописывать хэштеги известных тегов, упомянутых в заметке
+AUTO_TAGS_ENABLED: bool = _env_bool("AUTO_TAGS", True)
+
+# Метрики в формате Prometheus (0 — выключить HTTP-эндпоинт)
+METRICS_HOST: str = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT: int = _env_int("METRICS_PORT", 9108)
+
+# Каталог для локального состояния бота (outbox, кэши и т.п.)
+DATA_DIR: Path = Path(os.getenv("BOT_DATA_DIR", "data"))
+
+# Outbox для записи заметок в Mem.ai
+OUTBOX_DB_PATH: Path = Path(os.getenv("OUTBOX_DB_PATH", str(DATA_DIR / "outbox.sqlite3")))
+OUTBOX_CONCURRENCY: int = _env_int("OUTBOX_CONCURRENCY", 4)
+OUTBOX_BATCH_SIZE: int = _env_int("OUTBOX_BATCH_SIZE", 20)
+OUTBOX_MAX_ATTEMPTS: int = _env_int("OUTBOX_MAX_ATTEMPTS", 20)
+OUTBOX_BACKOFF_BASE: float = _env_float("OUTBOX_BACKOFF_BASE", 2.0)
+OUTBOX_BACKOFF_MAX: float = _env_float("OUTBOX_BACKOFF_MAX", 900.0)
+OUTBOX_RETENTION_DAYS: float = _env_float("OUTBOX_RETENTION_DAYS", 30.0)
+
+# Суточный расход квот пользователей (общий для шардов)
+QUOTA_DB_PATH: Path = Path(os.getenv("QUOTA_DB_PATH", str(DATA_DIR / "quotas.sqlite3")))
+
+# Локальный полнотекстовый индекс заметок для /search
+SEARCH_DB_PATH: Path = Path(os.getenv("SEARCH_DB_PATH", str(DATA_DIR / "search.sqlite3")))
+SEARCH_RESULTS: int = _env_int("SEARCH_RESULTS", 5)
+
+# Кэш результатов обработки файлов (расшифровки, текст PDF) по file_unique_id
+ARTIFACT_CACHE_PATH: Path = Path(os.getenv("ARTIFACT_CACHE_PATH", str(DATA_DIR / "artifacts.sqlite3")))
+ARTIFACT_CACHE_MAX_MB: float = _env_float("ARTIFACT_CACHE_MAX_MB", 100.0)
+
+# Пакетный импорт (/import): чекпоинт для продолжения после прерывания,
+# параллельность стадий и размер буфера между ними
+IMPORT_DB_PATH: Path = Path(os.getenv("IMPORT_DB_PATH", str(DATA_DIR / "imports.sqlite3")))
+IMPORT_DOWNLOAD_CONCURRENCY: int = _env_int("IMPORT_DOWNLOAD_CONCURRENCY", 4)
+IMPORT_SUMMARY_CONCURRENCY: int = _env_int("IMPORT_SUMMARY_CONCURRENCY", 2)
+IMPORT_QUEUE_SIZE: int = _env_int("IMPORT_QUEUE_SIZE", 4)
+# Файлы из архива больше этого размера (после распаковки) пропускаются
+IMPORT_MAX_FILE_MB: float = _env_float("IMPORT_MAX_FILE_MB", 50.0)
+
+# Кэш ответов LLM (память + SQLite на диске)
+LLM_CACHE_ENABLED: bool = _env_bool("LLM_CACHE_ENABLED", True)
+LLM_CACHE_PATH: Path = Path(os.getenv("LLM_CACHE_PATH", str(DATA_DIR / "llm_cache.sqlite3")))
+LLM_CACHE_MEMORY_ITEMS: int = _env_int("LLM_CACHE_MEMORY_ITEMS", 256)
+LLM_CACHE_MAX_MB: float = _env_float("LLM_CACHE_MAX_MB", 200.0)
+LLM_CACHE_TTL_DAYS: float = _env_float("LLM_CACHE_TTL_DAYS", 30.0)
+
+# Потоковые ответы LLM (SSE): частичный результат показывается в статусном сообщении
+LLM_STREAMING: bool = _env_bool("LLM_STREAMING", True)
+
+# Скачивание медиа: в память, а большие файлы — во временный каталог
+MEDIA_SPILL_BYTES: int = _env_int("MEDIA_SPILL_BYTES", 8 * 1024 * 1024)
+MEDIA_TMP_DIR: Path = Path(os.getenv("MEDIA_TMP_DIR", os.path.join(tempfile.gettempdir(), "mem-bot")))
+MEDIA_BUFFER_POOL_SIZE: int = _env_int("MEDIA_BUFFER_POOL_SIZE", 4)
+
+# Извлечение текста из PDF (пул процессов)
+PDF_WORKERS: int = _env_int("PDF_WORKERS", 2)
+PDF_TIMEOUT: float = _env_float("PDF_TIMEOUT", 60.0)
+PDF_MAX_PAGES: int = _env_int("PDF_MAX_PAGES", 500)
+PDF_MAX_CHARS: int = _env_int("PDF_MAX_CHARS", 400000)
+
+# Map-reduce суммаризация длинных PDF
+PDF_CHUNK_TOKENS: int = _env_int("PDF_CHUNK_TOKENS", 6000)
+PDF_SUMMARY_CONCURRENCY: int = _env_int("PDF_SUMMARY_CONCURRENCY", 4)
+
+# Распознавание голосовых (Whisper в отдельных процессах)
+# Движок: "openai" (openai-whisper, PyTorch fp32) или "faster" (faster-whisper, квантованный на CPU)
+WHISPER_BACKEND: str = os.getenv("WHISPER_BACKEND", "openai")
+# Тип вычислений для faster-whisper: int8 / int8_float32 / float32
+WHISPER_COMPUTE_TYPE: str = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+WHISPER_MODEL: str = os.getenv("WHISPER_MODEL", "base")
+WHISPER_LANGUAGE: str = os.getenv("WHISPER_LANGUAGE", "ru")
+WHISPER_WORKERS: int = _env_int("WHISPER_WORKERS", 1)
+WHISPER_QUEUE_SIZE: int = _env_int("WHISPER_QUEUE_SIZE", 20)
+# Запускать воркеры Whisper при старте бота (1) или при первом голосовом (0, по умолчанию:
+# если голосовых не бывает, torch/ctranslate2 так и не загружаются)
+WHISPER_PRELOAD: bool = _env_bool("WHISPER_PRELOAD", False)
+# Модели в воркере выгружаются после WHISPER_IDLE_UNLOAD_SECONDS без задач (0 — никогда)
+# и вытесняются по давности использования, чтобы уложиться в WHISPER_MEMORY_BUDGET_MB (0 — без лимита)
+WHISPER_IDLE_UNLOAD_SECONDS: float = _env_float("WHISPER_IDLE_UNLOAD_SECONDS", 900.0)
+WHISPER_MEMORY_BUDGET_MB: int = _env_int("WHISPER_MEMORY_BUDGET_MB", 0)
+# Большая модель, которой перераспознаётся запись, если WHISPER_MODEL не уверена в результате
+# (средний avg_logprob ниже WHISPER_FALLBACK_LOGPROB); пусто — не использовать
+WHISPER_FALLBACK_MODEL: str = os.getenv("WHISPER_FALLBACK_MODEL", "")
+WHISPER_FALLBACK_LOGPROB: float = _env_float("WHISPER_FALLBACK_LOGPROB", -1.0)
+WHISPER_FALLBACK_IDLE_SECONDS: float = _env_float("WHISPER_FALLBACK_IDLE_SECONDS", 120.0)
+# Длинные голосовые режутся по паузам на куски ~VOICE_SEGMENT_SECONDS и распознаются параллельно
+VOICE_SEGMENT_SECONDS: float = _env_float("VOICE_SEGMENT_SECONDS", 60.0)
+VOICE_SPLIT_WINDOW_SECONDS: float = _env_float("VOICE_SPLIT_WINDOW_SECONDS", 10.0)
+# Перед распознаванием вырезается тишина в начале, в конце и паузы длиннее VOICE_MAX_SILENCE_SECONDS
+# (энергетический VAD); VOICE_VAD_MIN_RMS — порог громкости, ниже которого окно — всегда тишина
+VOICE_VAD_ENABLED: bool = _env_bool("VOICE_VAD_ENABLED", True)
+VOICE_MAX_SILENCE_SECONDS: float = _env_float("VOICE_MAX_SILENCE_SECONDS", 1.0)
+VOICE_VAD_MIN_RMS: float = _env_float("VOICE_VAD_MIN_RMS", 0.005)
+
+# Как часто (в секундах) можно редактировать статусное сообщение в Telegram
+PROGRESS_EDIT_INTERVAL: float = _env_float("PROGRESS_EDIT_INTERVAL", 2.0)
+# Для потокового текста LLM: правок много, поэтому интервал длиннее
+STREAM_EDIT_INTERVAL: float = _env_float("STREAM_EDIT_INTERVAL", 3.0)
+
 
 def validate_config() -> None:
     missing: list[str] = []
@@ -29,5 +236,12 @@ def validate_config() -> None:
         raise RuntimeError(
             f"Missing required environment variables: {', '.join(missing)}"
         )
-
-
+    if WHISPER_BACKEND not in ("openai", "faster"):
+        raise RuntimeError(
+            f"WHISPER_BACKEND must be 'openai' or 'faster', got {WHISPER_BACKEND!r}"
+        )
+    if not ALLOWED_USERNAMES:
+        raise RuntimeError("ALLOWED_USERNAMES is empty: nobody could use the bot")
+    bad_weights = [user for user, weight in USER_WEIGHTS.items() if weight <= 0]
+    if bad_weights:
+        raise RuntimeError(f"USER_WEIGHTS must be positive: {', '.join(bad_weights)}")
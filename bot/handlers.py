@@ -1,30 +1,177 @@
 from __future__ import annotations
 
-from typing import Iterable
-
-from telegram import Update
+import asyncio
+import json
+import logging
+import time
+from typing import Awaitable, Callable, ContextManager, Hashable, Iterable
+
+import httpx
+from telegram import Bot, File, Message, Update, User
 from telegram.ext import ContextTypes
 
-from .abacus_client import AbacusClient
-from .mem_client import MemClient
-from .state import USER_PENDING_NOTES, PendingNote
-from .voice_utils import transcribe_audio
-from .pdf_utils import extract_pdf_text
-from .tags import format_tags_help, add_or_update_tag
+from .abacus_client import collect_stream
+from .artifact_cache import PDF_KIND, TRANSCRIPT_KIND, Artifact
+from .concurrency import Job, job_context, whisper_stage
+from .config import (
+    ADMIN_USERNAMES,
+    ALLOWED_USERNAMES,
+    INTERACTIVE_VOICE_SECONDS,
+    LLM_STREAMING,
+    PDF_MAX_CHARS,
+    SEARCH_RESULTS,
+    STREAM_EDIT_INTERVAL,
+    USER_WEIGHTS,
+    VOICE_VAD_ENABLED,
+)
+from .importer import is_importable
+from .media import download_media
+from .metrics import format_stats, stage, timed_handler
+from .audio_utils import SAMPLE_RATE, AudioDecodeError, decode_to_pcm, split_on_silence, trim_silence
+from .transcription import TranscriptionError, TranscriptionQueueFull
+from .pdf_utils import PdfExtractionError
+from .progress import StatusMessage
+from .quotas import AUDIO_SECONDS, LLM_TOKENS, QuotaExceeded, charge
+from .resilience import BackendUnavailable
+from .services import Services
+from .state import OutboxItem
+from .summarize import ChunkCheckpoint, summarize_document
+from .tags import auto_tag, format_tags_help, add_or_update_tag
+
+
+logger = logging.getLogger(__name__)
+
+# Сколько символов частичного результата (расшифровки, ответа LLM) показывать
+# в статусном сообщении: лимит Telegram — 4096 символов
+_PREVIEW_CHARS = 3000
+
+# Ошибки внешних API, после которых пользователю сообщается о сбое, а не молчание
+_BACKEND_ERRORS = (BackendUnavailable, httpx.HTTPError)
+
+# Кому доступен бот: usernames в нижнем регистре и id пользователей строками
+_ALLOWED_USERS = {name.lstrip("@").lower() for name in ALLOWED_USERNAMES}
+_ADMIN_USERS = {name.lstrip("@").lower() for name in ADMIN_USERNAMES}
+
+# Расход квот в /quota: подпись и единица (делитель)
+_QUOTA_LABELS = {LLM_TOKENS: ("LLM, токенов", 1), AUDIO_SECONDS: ("Голосовые, минут", 60)}
+
+
+def create_services() -> Services:
+    """
+    Сервисы бота со склейкой сообщений, обрабатываемой хендлерами этого модуля.
+    """
+    return Services(_process_texts, _process_album)
 
 
-abacus_client = AbacusClient()
-mem_client = MemClient()
+def note_failure_notifier(bot: Bot) -> Callable[[OutboxItem, str], Awaitable[None]]:
+    """
+    Колбэк для NoteOutbox.on_failed: пользователю ответили «записал», а Mem.ai
+    заметку окончательно не принял — сообщаем об этом в чат с началом заметки.
+    """
 
-# Единственный разрешённый username
-ALLOWED_USERNAME = "AlexGorshunov"
+    async def notify(item: OutboxItem, error: str) -> None:
+        await bot.send_message(
+            item.chat_id,
+            _preview(
+                "Не удалось сохранить заметку в Mem.ai, пришли её ещё раз. Начало заметки:",
+                item.content[:500],
+                tail=False,
+            ),
+        )
 
+    return notify
 
-def _is_authorized(update: Update) -> bool:
+
+def _services(context: ContextTypes.DEFAULT_TYPE) -> Services:
+    return context.bot_data["services"]
+
+
+def _is_authorized(update: Update, users: set[str] = _ALLOWED_USERS) -> bool:
     user = update.effective_user
     if not user:
         return False
-    return (user.username or "") == ALLOWED_USERNAME
+    return (user.username or "").lower() in users or str(user.id) in users
+
+
+async def _is_admin(update: Update) -> bool:
+    """
+    Служебные команды — только для ADMIN_USERNAMES; остальным бот отвечает отказом.
+    """
+    assert update.message is not None
+    if not _is_authorized(update):
+        await update.message.reply_text("Ты не мой создатель, я тебя не знаю и не дружу с тобой!")
+        return False
+    if not _is_authorized(update, _ADMIN_USERS):
+        await update.message.reply_text("Эта команда доступна только администратору бота.")
+        return False
+    return True
+
+
+def _user_job(services: Services, user: User, interactive: bool = True) -> ContextManager[Job]:
+    """
+    Работа пользователя: стадии LLM, Whisper и Mem.ai делят слоты между
+    пользователями по USER_WEIGHTS, а расход идёт в его квоты.
+    """
+    weight = USER_WEIGHTS.get((user.username or "").lower(), USER_WEIGHTS.get(str(user.id), 1.0))
+    return job_context(user.id, weight, interactive, meter=services.quotas.charge)
+
+
+async def _admit(update: Update, services: Services) -> bool:
+    """
+    Учитывает сообщение в квоте частоты. При отказе пользователь уже уведомлён.
+    """
+    try:
+        services.quotas.admit(update.effective_user.id)
+    except QuotaExceeded as e:
+        await update.message.reply_text(str(e))
+        return False
+    return True
+
+
+async def _within_quota(update: Update, services: Services, kind: str, amount: float = 0.0) -> bool:
+    """
+    Хватит ли суточной квоты kind на задачу размером amount. При отказе
+    пользователь уже уведомлён.
+    """
+    try:
+        services.quotas.check(update.effective_user.id, kind, amount)
+    except QuotaExceeded as e:
+        await update.message.reply_text(str(e))
+        return False
+    return True
+
+
+def _preview(header: str, text: str, tail: bool = True) -> str:
+    """
+    Статус с частичным результатом, укороченным до _PREVIEW_CHARS:
+    пока результат растёт, показываем его конец, а готовый — начало.
+    """
+    if len(text) > _PREVIEW_CHARS:
+        text = "…" + text[-_PREVIEW_CHARS:] if tail else text[:_PREVIEW_CHARS] + "…"
+    return f"{header}\n\n{text}".strip()
+
+
+def _take_force_flag(context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """
+    Был ли перед этим файлом вызван /force (флаг действует на один файл).
+    """
+    if context.user_data is None:
+        return False
+    return bool(context.user_data.pop("force_reprocess", False))
+
+
+def _repeat_notice(services: Services, cached: Artifact | None, chat_id: int) -> str:
+    # Кэш артефактов общий: если файл раньше присылали из другого чата, об этом молчим
+    if cached is None or cached.outbox_id is None:
+        return ""
+    if not services.note_index.owned_by(cached.outbox_id, chat_id):
+        return ""
+    note_id = services.note_index.note_id(cached.outbox_id)
+    previous = f" (прошлая заметка: {note_id})" if note_id else ""
+    return (
+        f"\n\nЭтот файл уже присылали{previous}, поэтому взял сохранённый результат обработки. "
+        "Чтобы обработать заново, отправь /force и перешли файл ещё раз."
+    )
 
 
 def _parse_tags(text: str) -> list[str]:
@@ -51,7 +198,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "Привет! Я бот, который сохраняет твои мысли в Mem.ai.\n\n"
         "Отправь текст, голосовое, фото или PDF — я сохраню заметку.\n"
         "Теги можешь добавлять прямо в сообщение (например: #petproject #ai).\n"
-        "Команда /tags покажет все известные теги с описанием."
+        "Несколько сообщений подряд я склею в одну заметку, /flush — сохранить сразу.\n"
+        "Команда /tags покажет все известные теги с описанием, /search — найдёт заметку, "
+        "/quota — сколько осталось от дневных лимитов."
     )
 
 
@@ -106,28 +255,310 @@ async def add_tag_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     )
 
 
-async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    /stats — латентность по хендлерам и стадиям, очереди, кэши.
+    """
+    if not await _is_admin(update):
+        return
+
+    assert update.message is not None
+    await update.message.reply_text(format_stats())
+
+
+async def show_quota(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    /quota — расход дневных квот пользователя.
+    """
     if not _is_authorized(update):
         assert update.message is not None
         await update.message.reply_text("Ты не мой создатель, я тебя не знаю и не дружу с тобой!")
         return
 
     assert update.message is not None
-    text = update.message.text or ""
+    lines = ["Расход за сегодня:"]
+    for kind, (used, limit) in _services(context).quotas.usage(update.effective_user.id).items():
+        label, unit = _QUOTA_LABELS[kind]
+        total = f"из {limit / unit:.0f}" if limit > 0 else "(без лимита)"
+        lines.append(f"{label}: {used / unit:.0f} {total}")
+    await update.message.reply_text("\n".join(lines))
+
+
+async def search_notes(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    /search <запрос> — поиск по сохранённым заметкам в локальном индексе.
+    """
+    if not _is_authorized(update):
+        assert update.message is not None
+        await update.message.reply_text("Ты не мой создатель, я тебя не знаю и не дружу с тобой!")
+        return
+
+    assert update.message is not None
+    query = " ".join(context.args or [])
+    if not query:
+        await update.message.reply_text("Использование: /search <запрос>\nПример: /search робот arxiv")
+        return
+
+    with stage("search"):
+        # Только свои заметки: бот общий для нескольких пользователей
+        hits = _services(context).note_index.search(
+            query, update.effective_chat.id, limit=SEARCH_RESULTS
+        )
+    if not hits:
+        await update.message.reply_text("Ничего не нашёл.")
+        return
+
+    lines = [f"Найдено заметок: {len(hits)}"]
+    for hit in hits:
+        date = time.strftime("%Y-%m-%d", time.localtime(hit.created_at))
+        snippet = " ".join(hit.snippet.split())
+        lines.append(f"\n{date} · {hit.source}\n{snippet}")
+    await update.message.reply_text("\n".join(lines))
+
+
+async def reindex_notes(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    /reindex — дособрать поисковый индекс из outbox и пересобрать FTS-таблицу.
+    """
+    if not await _is_admin(update):
+        return
+
+    assert update.message is not None
+    services = _services(context)
+    added = services.note_index.rebuild(services.outbox.store)
+    await update.message.reply_text(
+        f"Индекс пересобран: добавлено заметок {added}, всего в индексе {services.note_index.count()}."
+    )
+
+
+async def force_reprocess(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    /force — следующий голосовой или PDF обработать заново, не беря результат из кэша.
+    """
+    if not _is_authorized(update):
+        assert update.message is not None
+        await update.message.reply_text("Ты не мой создатель, я тебя не знаю и не дружу с тобой!")
+        return
 
-    await update.message.reply_text("Обрабатываю текст через Abacus LLM...")
-    expanded = await abacus_client.expand_text(text)
+    assert update.message is not None
+    context.user_data["force_reprocess"] = True
+    await update.message.reply_text(
+        "Следующее голосовое или PDF обработаю заново, даже если его уже присылали."
+    )
 
-    # Теги ты можешь указывать прямо в сообщении, они останутся в тексте.
-    mem_content = expanded
-    mem_resp = await mem_client.create_note(mem_content)
 
+async def import_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    /import — режим пакетного импорта: PDF и ZIP с PDF, присланные после
+    команды, обрабатываются конвейером. /import done — больше файлов не будет.
+    Прерванный импорт продолжается при следующем /import.
+    """
+    if not _is_authorized(update):
+        assert update.message is not None
+        await update.message.reply_text("Ты не мой создатель, я тебя не знаю и не дружу с тобой!")
+        return
+
+    assert update.message is not None
+    chat_id = update.effective_chat.id
+    importer = _services(context).importer
+    job = importer.get(chat_id)
+    finishing = bool(context.args) and context.args[0].lower() in ("done", "stop")
+
+    if finishing:
+        if job is None:
+            await update.message.reply_text("Импорт не запущен. Начать — /import.")
+            return
+
+        # Итог импорта появится в статусном сообщении импорта
+        if importer.finish(chat_id) is None:
+            await update.message.reply_text("Импорт уже завершается, итог появится в сообщении о прогрессе.")
+        else:
+            await update.message.reply_text("Больше файлов не жду, дообрабатываю присланные — итог будет в сообщении о прогрессе.")
+        return
+
+    if job is not None:
+        await update.message.reply_text(job.progress_text())
+        return
+
+    services = _services(context)
+    if not await _within_quota(update, services, LLM_TOKENS):
+        return
+    status = await StatusMessage.send(update.message, "Готовлю импорт...")
+    # Задачи конвейера наследуют работу пользователя: импорт — длинная задача
+    with _user_job(services, update.effective_user, interactive=False):
+        job, resumed = importer.start(chat_id, context.bot, status)
+    resumed_note = f"\nПродолжаю прерванный импорт: файлов в очереди {resumed}." if resumed else ""
     await update.message.reply_text(
-        "Записал мысль в Mem.ai.\n"
+        "Режим импорта: присылай PDF или ZIP-архивы с PDF, можно много сразу. "
+        "Каждый файл станет отдельной заметкой, прогресс — в сообщении выше.\n"
+        "Когда всё отправишь — /import done." + resumed_note
+    )
+
+
+@timed_handler("text")
+async def _process_texts(services: Services, key: Hashable, messages: list[Message]) -> None:
+    """
+    Одна или несколько подряд идущих текстовых заметок пользователя в чате:
+    одно обращение к LLM и одна заметка в Mem.ai.
+    """
+    message = messages[-1]
+    chat_id = message.chat_id
+    text = "\n".join(m.text or "" for m in messages)
+
+    with stage("text_note"), _user_job(services, message.from_user):
+        status = None
+        try:
+            services.quotas.check(message.from_user.id, LLM_TOKENS)
+            if LLM_STREAMING:
+                status = await StatusMessage.send(
+                    message, "Обрабатываю текст через Abacus LLM...", STREAM_EDIT_INTERVAL
+                )
+                expanded = await collect_stream(
+                    services.abacus.expand_text_stream(text),
+                    lambda partial: status.set(_preview("Обрабатываю текст через Abacus LLM...", partial)),
+                )
+                await status.finish(_preview("Готово:", expanded, tail=False))
+            else:
+                await message.reply_text("Обрабатываю текст через Abacus LLM...")
+                expanded = await services.abacus.expand_text(text)
+        except QuotaExceeded as e:
+            # Квота LLM кончилась, но мысль всё равно сохраняется
+            expanded = text
+            await message.reply_text(f"{e} Сохраняю текст без обработки.")
+        except _BACKEND_ERRORS as e:
+            # Мысль не должна потеряться: сохраняем исходный текст без обработки
+            logger.warning("Abacus недоступен, текст сохраняется как есть: %s", e)
+            expanded = text
+            notice = "Abacus LLM сейчас недоступен, сохраняю текст без обработки."
+            if status is not None:
+                await status.finish(notice)
+            else:
+                await message.reply_text(notice)
+
+        # Теги ты можешь указывать прямо в сообщении, они останутся в тексте.
+        mem_content = auto_tag(expanded)
+        services.outbox.enqueue(mem_content, source="text", chat_id=chat_id)
+
+    merged = f" (объединено сообщений: {len(messages)})" if len(messages) > 1 else ""
+    await message.reply_text(
+        f"Записал мысль в Mem.ai{merged}.\n"
         "Теги можно указывать прямо в тексте сообщения (например: #project, #idea)."
     )
 
 
+def _text_key(update: Update) -> tuple[int, int]:
+    # В групповом чате мысли разных пользователей не склеиваются
+    return update.effective_chat.id, update.effective_user.id
+
+
+async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # Время обработки пишет _process_texts: здесь сообщение только попадает в буфер
+    if not _is_authorized(update):
+        assert update.message is not None
+        await update.message.reply_text("Ты не мой создатель, я тебя не знаю и не дружу с тобой!")
+        return
+
+    assert update.message is not None
+    services = _services(context)
+    if not await _admit(update, services):
+        return
+
+    key = _text_key(update)
+    if services.text_coalescer.enabled:
+        # Ждём, не допишет ли пользователь мысль следующими сообщениями
+        services.text_coalescer.add(key, update.message)
+        return
+
+    await _process_texts(services, key, [update.message])
+
+
+async def wait_pending_texts(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Выполняется перед любым апдейтом, кроме текста: накопленные тексты чата
+    обрабатываются сразу и раньше него, чтобы ответы шли в порядке сообщений.
+    """
+    if update.effective_chat is None:
+        return
+    chat_id = update.effective_chat.id
+    await _services(context).text_coalescer.drain(lambda key: key[0] == chat_id)
+
+
+async def flush_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    /flush — сразу обработать накопленные текстовые сообщения, не дожидаясь паузы.
+    """
+    if not _is_authorized(update):
+        assert update.message is not None
+        await update.message.reply_text("Ты не мой создатель, я тебя не знаю и не дружу с тобой!")
+        return
+
+    assert update.message is not None
+    key = _text_key(update)
+    if not await _services(context).text_coalescer.drain(lambda pending: pending == key):
+        await update.message.reply_text("Нет накопленных сообщений.")
+
+
+async def _transcribe_voice(services: Services, file: File, status: StatusMessage) -> str | None:
+    """
+    Скачивает и распознаёт голосовое, показывая прогресс в status.
+    Возвращает None, если распознать не удалось (пользователь уже уведомлён).
+    """
+
+    def on_queued(position: int) -> None:
+        if position:
+            status.set(f"Преобразую голос в текст... (перед тобой в очереди: {position})")
+        else:
+            status.set("Преобразую голос в текст...")
+
+    try:
+        async with download_media(file, suffix=".ogg") as media:
+            with stage("audio_decode"):
+                audio = await decode_to_pcm(media.source)
+    except AudioDecodeError as e:
+        await status.finish(f"Не удалось прочитать аудио: {e}")
+        return None
+
+    if VOICE_VAD_ENABLED:
+        with stage("vad"):
+            audio = trim_silence(audio)
+        if not len(audio):
+            await status.finish("В голосовом не нашлось речи, заметку не создаю.")
+            return None
+
+    segments = split_on_silence(audio)
+    parts: list[str | None] = [None] * len(segments)
+
+    def on_segment(index: int, text: str) -> None:
+        parts[index] = text
+        ready = 0
+        while ready < len(parts) and parts[ready] is not None:
+            ready += 1
+        # Показываем готовое начало расшифровки (в пределах лимита длины сообщения)
+        preview = " ".join(p for p in parts[:ready] if p)
+        status.set(_preview(f"Преобразую голос в текст ({ready} из {len(parts)})...", preview))
+
+    try:
+        with stage("whisper"):
+            if len(segments) == 1:
+                transcript = await services.transcription.transcribe(audio, on_queued=on_queued)
+            else:
+                texts = await services.transcription.transcribe_segments(
+                    segments, on_segment=on_segment, on_queued=on_queued
+                )
+                transcript = " ".join(t for t in texts if t)
+    except TranscriptionQueueFull:
+        await status.finish("Сейчас слишком много голосовых в очереди, попробуй чуть позже.")
+        return None
+    except TranscriptionError as e:
+        await status.finish(f"Не удалось распознать голосовое: {e}")
+        return None
+
+    # В квоту идёт то, что распознавал Whisper: запись после вырезания тишины
+    charge(AUDIO_SECONDS, len(audio) / SAMPLE_RATE)
+    return transcript
+
+
+@timed_handler("voice")
 async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not _is_authorized(update):
         assert update.message is not None
@@ -141,24 +572,68 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         await update.message.reply_text("Не удалось получить голосовое сообщение.")
         return
 
-    file = await voice.get_file()
-    file_path = f"/tmp/{voice.file_unique_id}.ogg"
-    await file.download_to_drive(file_path)
-
-    await update.message.reply_text("Преобразую голос в текст...")
-    transcript = await transcribe_audio(file_path)
+    services = _services(context)
+    if not await _admit(update, services):
+        return
+    force = _take_force_flag(context)
+    cached = None if force else services.artifacts.get(voice.file_unique_id, TRANSCRIPT_KIND)
+    if cached is not None:
+        # Это голосовое уже распознавалось: не скачиваем и не гоняем Whisper
+        transcript = cached.value
+    else:
+        duration = voice.duration or 0
+        if not await _within_quota(update, services, AUDIO_SECONDS, duration):
+            return
+        file = await voice.get_file()
+
+        status = await StatusMessage.send(update.message, "Преобразую голос в текст...")
+        # Тяжёлая стадия: ограничиваем отдельно, чтобы не мешать текстовым заметкам;
+        # короткие голосовые пропускаются вперёд длинных
+        interactive = duration <= INTERACTIVE_VOICE_SECONDS
+        with _user_job(services, update.effective_user, interactive):
+            async with whisper_stage.slot(max(duration, 1)):
+                transcript = await _transcribe_voice(services, file, status)
+        if transcript is None:
+            return
+        if transcript:
+            services.artifacts.put(voice.file_unique_id, TRANSCRIPT_KIND, transcript)
+
+    if not transcript:
+        transcript = "[Не удалось распознать речь]"
 
     # При желании можно также прогнать transcript через Abacus; пока отправим как есть
     # Теги при желании можно проговаривать/обозначать в конце, но они просто попадут в текст.
-    mem_content = transcript
-    mem_resp = await mem_client.create_note(mem_content)
+    mem_content = auto_tag(transcript)
+    item = services.outbox.enqueue(mem_content, source="voice", chat_id=update.effective_chat.id)
+    services.artifacts.set_outbox_id(voice.file_unique_id, TRANSCRIPT_KIND, item.id)
 
     await update.message.reply_text(
         "Голосовое (текст) сохранено в Mem.ai.\n"
         "Если хочешь теги, просто включай их в содержание (например: #meeting, #voice)."
+        + _repeat_notice(services, cached, update.effective_chat.id)
+    )
+
+
+async def _process_album(services: Services, media_group_id: Hashable, messages: list[Message]) -> None:
+    """
+    Все фото альбома — одной заметкой; ссылки на файлы запрашиваются параллельно.
+    """
+    messages.sort(key=lambda m: m.message_id)
+    files = await asyncio.gather(*(m.photo[-1].get_file() for m in messages))
+    captions = [m.caption for m in messages if m.caption]
+
+    lines = [f"Фото: {file.file_path}" for file in files]
+    # Подпись альбома обычно приходит только с первым фото
+    mem_content = ("\n".join(lines) + "\n\n" + "\n".join(captions)).strip()
+    services.outbox.enqueue(mem_content, source="photo", chat_id=messages[0].chat_id)
+
+    await messages[0].reply_text(
+        f"Альбом ({len(messages)} фото) сохранён в Mem.ai одной заметкой.\n"
+        "Можешь добавлять теги прямо в подпись к альбому."
     )
 
 
+@timed_handler("photo")
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not _is_authorized(update):
         assert update.message is not None
@@ -171,6 +646,13 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         await update.message.reply_text("Не удалось получить фото.")
         return
 
+    services = _services(context)
+    if not await _admit(update, services):
+        return
+    if update.message.media_group_id and services.album_coalescer.enabled:
+        services.album_coalescer.add(update.message.media_group_id, update.message)
+        return
+
     photo = update.message.photo[-1]
     file = await photo.get_file()
     file_url = file.file_path  # Телеграмовская ссылка на файл
@@ -178,7 +660,7 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
     # Теги можешь указать прямо в caption.
     mem_content = f"Фото: {file_url}\n\n{caption}".strip()
-    mem_resp = await mem_client.create_note(mem_content)
+    services.outbox.enqueue(mem_content, source="photo", chat_id=update.effective_chat.id)
 
     await update.message.reply_text(
         "Фото сохранено в Mem.ai.\n"
@@ -186,6 +668,7 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     )
 
 
+@timed_handler("document")
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Обработка PDF: скачиваем, вытаскиваем текст, просим LLM перевести и объяснить,
@@ -203,29 +686,122 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await update.message.reply_text("Не удалось получить документ.")
         return
 
+    services = _services(context)
+    if not await _admit(update, services):
+        return
+    job = services.importer.get(update.effective_chat.id)
+    if job is not None and not job.closed:
+        # В режиме импорта файлы не обрабатываются по одному: их забирает конвейер
+        if not is_importable(doc):
+            await update.message.reply_text("В импорт принимаю только PDF и ZIP-архивы с PDF.")
+        elif not job.add_document(doc):
+            await update.message.reply_text(f"«{doc.file_name}» уже импортировался, пропускаю.")
+        return
+
+    if doc.file_name and doc.file_name.lower().endswith(".zip"):
+        await update.message.reply_text("ZIP-архивы принимаю в режиме пакетного импорта: /import.")
+        return
+
     if not (doc.mime_type == "application/pdf" or doc.file_name.lower().endswith(".pdf")):
         await update.message.reply_text("Сейчас я поддерживаю только PDF-документы.")
         return
 
-    file = await doc.get_file()
-    file_path = f"/tmp/{doc.file_unique_id}.pdf"
-    await file.download_to_drive(file_path)
-
-    await update.message.reply_text("Читаю PDF и отправляю в LLM для перевода и объяснения сути...")
-    raw_text = extract_pdf_text(file_path)
+    if not await _within_quota(update, services, LLM_TOKENS):
+        return
 
-    summarized = await abacus_client.summarize_pdf(raw_text, target_lang="ru")
+    force = _take_force_flag(context)
+    cached = None if force else services.artifacts.get(doc.file_unique_id, PDF_KIND)
+    if cached is not None:
+        # Этот PDF уже читали: берём извлечённый текст, не скачивая файл
+        status = await StatusMessage.send(update.message, "Этот PDF уже читал, беру сохранённый текст...")
+        pages = json.loads(cached.value)
+    else:
+        file = await doc.get_file()
+
+        status = await StatusMessage.send(update.message, "Читаю PDF...")
+
+        def on_progress(done: int, total: int, chars: int) -> None:
+            status.set(f"Читаю PDF: страница {done} из {total}...")
+
+        try:
+            async with download_media(file, suffix=".pdf") as media:
+                with stage("pdf_extract"):
+                    extraction = await services.pdf_extractor.extract(
+                        media.source, max_chars=PDF_MAX_CHARS, on_progress=on_progress
+                    )
+        except PdfExtractionError as e:
+            await status.finish(f"Не получилось прочитать PDF: {e}")
+            return
+        pages = extraction.pages
+        services.artifacts.put(doc.file_unique_id, PDF_KIND, json.dumps(pages, ensure_ascii=False))
+
+    await status.update("Отправляю PDF в LLM для перевода и объяснения сути...")
+
+    def on_summary_progress(done: int, total: int) -> None:
+        status.set(f"Конспектирую PDF по частям: {done} из {total}...")
+
+    def on_partial(text: str) -> None:
+        # Итоговая заметка генерируется потоково: правок много, поэтому реже
+        status.min_interval = STREAM_EDIT_INTERVAL
+        status.set(_preview("Пишу заметку по PDF...", text))
+
+    # Конспект PDF — длинная задача: уступает стадию LLM текстовым заметкам
+    with stage("pdf_summarize"), _user_job(services, update.effective_user, interactive=False):
+        try:
+            summarized = await summarize_document(
+                services.abacus,
+                pages,
+                target_lang="ru",
+                on_progress=on_summary_progress,
+                on_partial=on_partial if LLM_STREAMING else None,
+                # /force — пересчитать и конспект, а не только извлечение текста
+                use_cache=not force,
+                checkpoint=ChunkCheckpoint(services.artifacts, doc.file_unique_id, "ru"),
+            )
+        except _BACKEND_ERRORS as e:
+            # Текст PDF уже в кэше артефактов: повторная отправка не будет его извлекать
+            logger.warning("Не удалось законспектировать PDF: %s", e)
+            await status.finish(
+                "Abacus LLM сейчас недоступен, заметка не создана. "
+                "Пришли PDF ещё раз чуть позже."
+            )
+            return
+    if LLM_STREAMING:
+        await status.finish(_preview("Готово:", summarized, tail=False))
 
     # В итоговой заметке можешь сразу добавить теги в тексте, если нужно.
-    mem_content = summarized
-    mem_resp = await mem_client.create_note(mem_content)
+    mem_content = auto_tag(summarized)
+    item = services.outbox.enqueue(mem_content, source="pdf", chat_id=update.effective_chat.id)
+    services.artifacts.set_outbox_id(doc.file_unique_id, PDF_KIND, item.id)
 
     await update.message.reply_text(
         "Создал заметку по PDF в Mem.ai.\n"
         "Теги можешь включать прямо в текст PDF (или добавить в следующем документе/сообщении)."
+        + _repeat_notice(services, cached, update.effective_chat.id)
     )
 
 
+async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Необработанная ошибка хендлера: пишем в лог и, если это сбой внешнего API,
+    сообщаем пользователю, а не оставляем его без ответа.
+    """
+    error = context.error
+    logger.error("Ошибка при обработке апдейта", exc_info=error)
+    if not isinstance(update, Update) or update.effective_message is None:
+        return
+    if isinstance(error, BackendUnavailable):
+        text = f"Сервис {error.backend} временно недоступен, попробуй через {error.retry_after:.0f} с."
+    elif isinstance(error, httpx.HTTPError):
+        text = "Внешний сервис ответил ошибкой, попробуй ещё раз чуть позже."
+    else:
+        return
+    try:
+        await update.effective_message.reply_text(text)
+    except Exception:
+        logger.exception("Не удалось сообщить пользователю об ошибке")
+
+
 async def handle_tags(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Функция больше не используется: теги указываются прямо в сообщении.
     return
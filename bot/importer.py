@@ -0,0 +1,487 @@
+from __future__ import annotations
+
+import asyncio
+import io
+import json
+import logging
+import time
+import zipfile
+from dataclasses import dataclass
+from pathlib import Path, PurePosixPath
+from typing import Awaitable, Callable, Iterable
+
+from telegram import Bot, Document
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from .abacus_client import AbacusClient
+from .artifact_cache import ArtifactCache
+from .config import (
+    IMPORT_DB_PATH,
+    IMPORT_DOWNLOAD_CONCURRENCY,
+    IMPORT_MAX_FILE_MB,
+    IMPORT_QUEUE_SIZE,
+    IMPORT_SUMMARY_CONCURRENCY,
+    PDF_MAX_CHARS,
+    PDF_WORKERS,
+)
+from .metrics import stage
+from .outbox import NoteOutbox
+from .pdf_utils import PdfExtractor
+from .progress import StatusMessage
+from .resilience import is_retryable
+from .sqlite_store import SQLiteStore
+from .state import STATUS_FAILED, STATUS_PENDING
+from .summarize import ChunkCheckpoint, summarize_document
+from .tags import auto_tag
+
+logger = logging.getLogger(__name__)
+
+STATUS_DONE = "done"
+
+KIND_PDF = "pdf"
+KIND_ZIP = "zip"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS import_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    file_unique_id TEXT NOT NULL,
+    member TEXT NOT NULL DEFAULT '',
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    outbox_id INTEGER,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    UNIQUE (chat_id, file_unique_id, member)
+);
+CREATE INDEX IF NOT EXISTS import_items_pending ON import_items (chat_id, status);
+"""
+
+_ITEM_COLUMNS = "id, chat_id, kind, file_id, file_unique_id, member, name"
+
+
+@dataclass
+class ImportItem:
+    id: int
+    chat_id: int
+    kind: str
+    file_id: str
+    file_unique_id: str
+    # Путь PDF внутри архива; пустая строка — сам присланный документ
+    member: str
+    name: str
+
+    @property
+    def artifact_key(self) -> str:
+        return f"{self.file_unique_id}/{self.member}" if self.member else self.file_unique_id
+
+
+class ImportCheckpoint(SQLiteStore):
+    """
+    Чекпоинт пакетного импорта (SQLite): какие файлы чата уже превращены
+    в заметки, а какие ещё нет.
+
+    Записи хранят file_id Telegram, поэтому прерванный импорт (рестарт,
+    недоступный бэкенд) продолжается без повторной отправки файлов.
+    """
+
+    SCHEMA = _SCHEMA
+
+    def __init__(self, path: str | Path = IMPORT_DB_PATH) -> None:
+        super().__init__(path)
+
+    def add(
+        self,
+        chat_id: int,
+        kind: str,
+        file_id: str,
+        file_unique_id: str,
+        name: str,
+        member: str = "",
+    ) -> ImportItem | None:
+        """
+        Добавляет файл в импорт. None — этот файл в чате уже импортировался.
+        """
+        now = time.time()
+        cur = self._conn.execute(
+            "INSERT OR IGNORE INTO import_items (chat_id, kind, file_id, file_unique_id, member,"
+            " name, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (chat_id, kind, file_id, file_unique_id, member, name, STATUS_PENDING, now, now),
+        )
+        if not cur.rowcount:
+            return None
+        return ImportItem(int(cur.lastrowid), chat_id, kind, file_id, file_unique_id, member, name)
+
+    def pending(self, chat_id: int) -> list[ImportItem]:
+        rows = self._conn.execute(
+            f"SELECT {_ITEM_COLUMNS} FROM import_items WHERE chat_id = ? AND status = ? ORDER BY id",
+            (chat_id, STATUS_PENDING),
+        ).fetchall()
+        return [ImportItem(*row) for row in rows]
+
+    def mark_done(self, item_id: int, outbox_id: int | None = None) -> None:
+        self._conn.execute(
+            "UPDATE import_items SET status = ?, outbox_id = ?, error = NULL, updated_at = ?"
+            " WHERE id = ?",
+            (STATUS_DONE, outbox_id, time.time(), item_id),
+        )
+
+    def mark_failed(self, item_id: int, error: str) -> None:
+        self._conn.execute(
+            "UPDATE import_items SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+            (STATUS_FAILED, error, time.time(), item_id),
+        )
+
+
+def _list_archive(data: bytes, max_bytes: int) -> tuple[list[str], int]:
+    """
+    PDF внутри ZIP (без служебных каталогов macOS) и число пропущенных из-за размера.
+    """
+    members: list[str] = []
+    skipped = 0
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        for info in archive.infolist():
+            name = info.filename
+            if info.is_dir() or name.startswith("__MACOSX/") or not name.lower().endswith(".pdf"):
+                continue
+            if info.file_size > max_bytes:
+                skipped += 1
+                continue
+            members.append(name)
+    return members, skipped
+
+
+def _read_member(data: bytes, member: str) -> bytes:
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        return archive.read(member)
+
+
+def _is_transient(exc: BaseException) -> bool:
+    # BadRequest (например, «file is too big») — подкласс NetworkError, но повтор не поможет
+    if isinstance(exc, BadRequest):
+        return False
+    return is_retryable(exc) or isinstance(exc, (NetworkError, RetryAfter))
+
+
+class ImportJob:
+    """
+    Импорт пачки PDF (и PDF из ZIP-архивов) одного чата конвейером из стадий,
+    работающих одновременно: скачивание → извлечение текста в пуле процессов →
+    конспект в LLM (с ограничением параллельности) → заметка в outbox, который
+    сам отправляет заметки в Mem.ai пачками.
+
+    Между стадиями — ограниченные очереди, поэтому в памяти одновременно
+    лишь несколько документов. Результат каждого файла фиксируется в
+    чекпоинте; файлы, упавшие на временной ошибке, остаются в нём
+    ожидающими и доделываются следующим /import.
+    """
+
+    def __init__(
+        self,
+        chat_id: int,
+        bot: Bot,
+        checkpoint: ImportCheckpoint,
+        *,
+        abacus: AbacusClient,
+        extractor: PdfExtractor,
+        outbox: NoteOutbox,
+        artifacts: ArtifactCache,
+        pdf_kind: str,
+        status: StatusMessage | None = None,
+    ) -> None:
+        self.chat_id = chat_id
+        self.bot = bot
+        self.checkpoint = checkpoint
+        self.abacus = abacus
+        self.extractor = extractor
+        self.outbox = outbox
+        self.artifacts = artifacts
+        self.pdf_kind = pdf_kind
+        self.status = status
+        self.closed = False
+
+        self.total = 0
+        self.downloaded = 0
+        self.extracted = 0
+        self.saved = 0
+        self.failed = 0
+        self.deferred = 0
+        self.skipped = 0
+
+        # Элементы очередей — аргументы обработчика стадии, первый всегда ImportItem
+        self._downloads: asyncio.Queue[tuple[ImportItem]] = asyncio.Queue()
+        self._extracts: asyncio.Queue[tuple[ImportItem, bytes]] = asyncio.Queue(IMPORT_QUEUE_SIZE)
+        self._summaries: asyncio.Queue[tuple[ImportItem, list[str]]] = asyncio.Queue(IMPORT_QUEUE_SIZE)
+        # Архив скачивается один раз на всё время импорта, а не на каждый PDF в нём
+        self._archives: dict[str, bytes] = {}
+        self._archive_locks: dict[str, asyncio.Lock] = {}
+        self._workers: list[asyncio.Task] = []
+
+    @property
+    def queued(self) -> dict[str, int]:
+        return {
+            "download": self._downloads.qsize(),
+            "extract": self._extracts.qsize(),
+            "summarize": self._summaries.qsize(),
+        }
+
+    def start(self, items: Iterable[ImportItem] = ()) -> None:
+        for item in items:
+            self._enqueue(item)
+        stages: list[tuple[asyncio.Queue, Callable[..., Awaitable[None]], int]] = [
+            (self._downloads, self._download, IMPORT_DOWNLOAD_CONCURRENCY),
+            (self._extracts, self._extract, PDF_WORKERS),
+            (self._summaries, self._summarize, IMPORT_SUMMARY_CONCURRENCY),
+        ]
+        for queue, handler, workers in stages:
+            for _ in range(max(1, workers)):
+                self._workers.append(asyncio.create_task(self._worker(queue, handler)))
+
+    def add_document(self, document: Document) -> bool:
+        """
+        Добавляет присланный PDF или ZIP. False — этот файл уже импортировался.
+        """
+        name = document.file_name or document.file_unique_id
+        kind = KIND_ZIP if _is_zip(document) else KIND_PDF
+        item = self.checkpoint.add(
+            self.chat_id, kind, document.file_id, document.file_unique_id, name
+        )
+        if item is None:
+            self.skipped += 1
+            self._progress()
+            return False
+        self._enqueue(item)
+        return True
+
+    async def close(self) -> None:
+        """
+        Больше файлов не будет: дожидается конца конвейера и показывает итог.
+        """
+        self.closed = True
+        try:
+            # Архивы раскрываются на стадии скачивания, поэтому очереди ждём по порядку
+            await self._downloads.join()
+            await self._extracts.join()
+            await self._summaries.join()
+        finally:
+            await self.cancel()
+        if self.status is not None:
+            await self.status.finish(self.progress_text(final=True))
+
+    async def cancel(self) -> None:
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        self._archives.clear()
+
+    def progress_text(self, final: bool = False) -> str:
+        head = "Импорт завершён" if final else "Импорт идёт"
+        lines = [
+            f"{head}: файлов PDF {self.total}",
+            f"скачано {self.downloaded}, текст извлечён {self.extracted}, сохранено заметок {self.saved}",
+        ]
+        if self.failed:
+            lines.append(f"не удалось обработать: {self.failed}")
+        if self.deferred:
+            lines.append(f"отложено из-за недоступности сервисов: {self.deferred} (повторю при следующем /import)")
+        if self.skipped:
+            lines.append(f"пропущено (уже импортированы или слишком большие): {self.skipped}")
+        return "\n".join(lines)
+
+    def _progress(self) -> None:
+        if self.status is not None:
+            self.status.set(self.progress_text())
+
+    def _enqueue(self, item: ImportItem) -> None:
+        if item.kind == KIND_PDF:
+            self.total += 1
+        self._downloads.put_nowait((item,))
+        self._progress()
+
+    async def _worker(self, queue: asyncio.Queue, handler: Callable[..., Awaitable[None]]) -> None:
+        while True:
+            entry = await queue.get()
+            item = entry[0]
+            try:
+                await handler(*entry)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                if _is_transient(e):
+                    # Остаётся в чекпоинте ожидающим: доделаем при следующем /import
+                    logger.warning("Импорт: %s отложен: %s", item.name, error)
+                    self.deferred += 1
+                else:
+                    logger.error("Импорт: %s не обработан: %s", item.name, error)
+                    self.checkpoint.mark_failed(item.id, error)
+                    self.failed += 1
+                self._progress()
+            finally:
+                queue.task_done()
+
+    async def _archive(self, item: ImportItem) -> bytes:
+        lock = self._archive_locks.setdefault(item.file_unique_id, asyncio.Lock())
+        async with lock:
+            data = self._archives.get(item.file_unique_id)
+            if data is None:
+                data = await self._fetch(item.file_id)
+                self._archives[item.file_unique_id] = data
+        return data
+
+    async def _fetch(self, file_id: str) -> bytes:
+        file = await self.bot.get_file(file_id)
+        with stage("telegram_download"):
+            return bytes(await file.download_as_bytearray())
+
+    async def _download(self, item: ImportItem) -> None:
+        if item.kind == KIND_ZIP:
+            await self._expand(item)
+            return
+
+        cached = self.artifacts.get(item.artifact_key, self.pdf_kind)
+        if cached is not None:
+            # Текст этого PDF уже извлекали: сразу на конспект
+            self.downloaded += 1
+            self.extracted += 1
+            self._progress()
+            await self._summaries.put((item, json.loads(cached.value)))
+            return
+
+        if item.member:
+            archive = await self._archive(item)
+            data = await asyncio.to_thread(_read_member, archive, item.member)
+        else:
+            data = await self._fetch(item.file_id)
+        self.downloaded += 1
+        self._progress()
+        await self._extracts.put((item, data))
+
+    async def _expand(self, item: ImportItem) -> None:
+        archive = await self._archive(item)
+        members, too_big = await asyncio.to_thread(
+            _list_archive, archive, int(IMPORT_MAX_FILE_MB * 1024 * 1024)
+        )
+        self.skipped += too_big
+        for member in members:
+            child = self.checkpoint.add(
+                self.chat_id,
+                KIND_PDF,
+                item.file_id,
+                item.file_unique_id,
+                PurePosixPath(member).name,
+                member=member,
+            )
+            if child is None:
+                # Уже в чекпоинте: либо готов, либо ждёт в этом же импорте
+                continue
+            self._enqueue(child)
+        # Содержимое архива теперь в чекпоинте по отдельным PDF
+        self.checkpoint.mark_done(item.id)
+
+    async def _extract(self, item: ImportItem, data: bytes) -> None:
+        with stage("pdf_extract"):
+            extraction = await self.extractor.extract(data, max_chars=PDF_MAX_CHARS)
+        pages = extraction.pages
+        self.artifacts.put(item.artifact_key, self.pdf_kind, json.dumps(pages, ensure_ascii=False))
+        self.extracted += 1
+        self._progress()
+        await self._summaries.put((item, pages))
+
+    async def _summarize(self, item: ImportItem, pages: list[str]) -> None:
+        if not any(page.strip() for page in pages):
+            self.checkpoint.mark_failed(item.id, "в PDF нет текста")
+            self.failed += 1
+            self._progress()
+            return
+        with stage("pdf_summarize"):
+            summary = await summarize_document(
+                self.abacus,
+                pages,
+                target_lang="ru",
+                checkpoint=ChunkCheckpoint(self.artifacts, item.artifact_key, "ru"),
+            )
+        content = auto_tag(f"{item.name}\n\n{summary}")
+        note = self.outbox.enqueue(content, source="import", chat_id=self.chat_id)
+        self.artifacts.set_outbox_id(item.artifact_key, self.pdf_kind, note.id)
+        self.checkpoint.mark_done(item.id, note.id)
+        self.saved += 1
+        self._progress()
+
+
+def _is_zip(document: Document) -> bool:
+    name = (document.file_name or "").lower()
+    return document.mime_type in ("application/zip", "application/x-zip-compressed") or name.endswith(".zip")
+
+
+def is_importable(document: Document) -> bool:
+    name = (document.file_name or "").lower()
+    return _is_zip(document) or document.mime_type == "application/pdf" or name.endswith(".pdf")
+
+
+class ImportManager:
+    """
+    Импорты по чатам: в чате одновременно идёт не больше одного.
+    """
+
+    def __init__(self, checkpoint: ImportCheckpoint, **services) -> None:
+        self.checkpoint = checkpoint
+        self._services = services
+        self.jobs: dict[int, ImportJob] = {}
+        self._closing: set[asyncio.Task] = set()
+
+    def get(self, chat_id: int) -> ImportJob | None:
+        return self.jobs.get(chat_id)
+
+    def start(self, chat_id: int, bot: Bot, status: StatusMessage | None = None) -> tuple[ImportJob, int]:
+        """
+        Запускает импорт чата; ожидающие файлы из чекпоинта (прерванный импорт)
+        сразу ставятся в работу. Возвращает задание и число таких файлов.
+        """
+        pending = self.checkpoint.pending(chat_id)
+        job = ImportJob(chat_id, bot, self.checkpoint, status=status, **self._services)
+        job.start(pending)
+        self.jobs[chat_id] = job
+        return job, len(pending)
+
+    def finish(
+        self, chat_id: int, on_done: Callable[[ImportJob], Awaitable[None]] | None = None
+    ) -> ImportJob | None:
+        """
+        Закрывает приём файлов; дожидается конвейера в фоне и вызывает on_done.
+        Итог импорта пишется в статусное сообщение задачи (см. ImportJob.close).
+        """
+        job = self.jobs.get(chat_id)
+        if job is None or job.closed:
+            return None
+
+        async def complete() -> None:
+            try:
+                await job.close()
+                if on_done is not None:
+                    await on_done(job)
+            except Exception:
+                logger.exception("Ошибка при завершении импорта в чате %s", chat_id)
+            finally:
+                self.jobs.pop(chat_id, None)
+
+        task = asyncio.create_task(complete())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+        return job
+
+    async def stop(self) -> None:
+        """
+        Останавливает все импорты. Необработанные файлы остаются в чекпоинте.
+        """
+        for task in list(self._closing):
+            task.cancel()
+        for job in list(self.jobs.values()):
+            await job.cancel()
+        await asyncio.gather(*self._closing, return_exceptions=True)
+        self.jobs.clear()
+        self.checkpoint.close()
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from .config import (
+    LLM_CACHE_MAX_MB,
+    LLM_CACHE_MEMORY_ITEMS,
+    LLM_CACHE_PATH,
+    LLM_CACHE_TTL_DAYS,
+)
+from .sqlite_store import BoundedStore
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed_at);
+"""
+
+
+class LLMCache(BoundedStore):
+    """
+    Кэш ответов LLM, адресуемый по содержимому запроса (модель + сообщения).
+
+    Два уровня: LRU в памяти и SQLite на диске. Диск ограничен по суммарному
+    размеру (вытесняются давно не читанные записи), обе ступени — по TTL.
+    """
+
+    SCHEMA = _SCHEMA
+    TABLE = "llm_cache"
+
+    def __init__(
+        self,
+        path: str | Path = LLM_CACHE_PATH,
+        memory_items: int = LLM_CACHE_MEMORY_ITEMS,
+        max_bytes: int = int(LLM_CACHE_MAX_MB * 1024 * 1024),
+        ttl: float = LLM_CACHE_TTL_DAYS * 86400,
+    ) -> None:
+        super().__init__(path, max_bytes)
+        self.memory_items = memory_items
+        self.ttl = ttl
+        self._memory: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, messages: list[dict]) -> str:
+        raw = json.dumps([model, messages], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+
+        entry = self._memory.get(key)
+        if entry is not None:
+            value, created_at = entry
+            if now - created_at <= self.ttl:
+                self._memory.move_to_end(key)
+                self.hits_memory += 1
+                return value
+            del self._memory[key]
+
+        row = self._conn.execute(
+            "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None:
+            value, created_at = row
+            if now - created_at <= self.ttl:
+                self._conn.execute(
+                    "UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key)
+                )
+                self._remember(key, value, created_at)
+                self.hits_disk += 1
+                return value
+            self._delete(key)
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value: str) -> None:
+        now = time.time()
+        self._remember(key, value, now)
+
+        size = len(value.encode("utf-8"))
+        db = self._conn
+        old = db.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        db.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, value, size, created_at, accessed_at)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (key, value, size, now, now),
+        )
+        self._grew(size - (old[0] if old else 0), size)
+
+    def _remember(self, key: str, value: str, created_at: float) -> None:
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _delete(self, key: str) -> None:
+        row = self._conn.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            self._disk_bytes -= row[0]
+
+    def _evict(self) -> None:
+        self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl,))
+        super()._evict()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "memory_items": len(self._memory),
+            "disk_bytes": self._disk_bytes,
+        }
@@ -1,17 +1,38 @@
 from __future__ import annotations
 
+import time
+
+# Время импорта модулей бота попадает в отчёт о запуске
+_IMPORT_STARTED = time.perf_counter()
+
+import asyncio
 import logging
+import signal
+from typing import Iterable
 
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
     CommandHandler,
     MessageHandler,
     filters,
 )
 
-from .config import TELEGRAM_BOT_TOKEN, validate_config
+from .config import OUTBOX_DB_PATH, SHARD_WORKERS, TELEGRAM_BOT_TOKEN, WEBHOOK_URL, validate_config
 from . import handlers
+from .concurrency import PerChatUpdateProcessor, llm_stage, mem_stage, whisper_stage
+from .mem_client import MemClient
+from .metrics import Gauge, MetricsServer
+from .media import cleanup_tmp_dir
+from .outbox import NoteOutbox
+from .resilience import CircuitBreaker
+from .search_index import NoteIndex
+from .services import Services
+from .sharding import ShardedUpdateProcessor
+from .state import OutboxStore
+from .webhook import WebhookServer
 
+_IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -19,18 +40,198 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+metrics_server = MetricsServer()
 
-def main() -> None:
-    validate_config()
+_BREAKER_STATES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
 
-    if not TELEGRAM_BOT_TOKEN:
-        raise RuntimeError("TELEGRAM_BOT_TOKEN is not set")
 
-    application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
+def _sum_counts(counts: Iterable[dict[str, int]]) -> dict[tuple[str], int]:
+    total: dict[tuple[str], int] = {}
+    for item in counts:
+        for key, value in item.items():
+            total[(key,)] = total.get((key,), 0) + value
+    return total
+
+
+def _register_gauges(application: Application, services: Services) -> None:
+    processor = application.update_processor
+    stages = (llm_stage, mem_stage, whisper_stage)
+    cache = services.abacus.cache
+
+    Gauge(
+        "bot_updates_pending", "Апдейты в обработке или в очереди.", [],
+        lambda: {(): getattr(processor, "pending", 0)},
+    )
+    Gauge(
+        "bot_stage_active", "Занятые слоты по стадиям.", ["stage"],
+        lambda: {(s.name,): s.active for s in stages},
+    )
+    Gauge(
+        "bot_stage_waiting", "Ожидающие слота по стадиям.", ["stage"],
+        lambda: {(s.name,): s.waiting for s in stages},
+    )
+    Gauge(
+        "bot_outbox_items", "Заметки в outbox по статусу.", ["status"],
+        lambda: {(k,): v for k, v in services.outbox.store.count_by_status().items()},
+    )
+    Gauge(
+        "bot_messages_buffered", "Сообщения, ожидающие склейки (тексты, фото альбомов).", ["kind"],
+        lambda: {
+            ("text",): services.text_coalescer.pending,
+            ("album",): services.album_coalescer.pending,
+        },
+    )
+    Gauge(
+        "bot_import_queue", "Файлы импорта, ожидающие стадии.", ["stage"],
+        lambda: _sum_counts(job.queued for job in services.importer.jobs.values()),
+    )
+    Gauge(
+        "bot_transcription_jobs", "Задачи в очереди Whisper.", [],
+        lambda: {(): services.transcription.pending},
+    )
+    Gauge(
+        "bot_whisper_resident_bytes", "Память под модели Whisper по воркерам.", ["worker"],
+        lambda: {(str(k),): v for k, v in services.transcription.resident_bytes.items()},
+    )
+    Gauge(
+        "bot_artifact_cache", "Кэш расшифровок и текста PDF по file_unique_id.", ["kind"],
+        lambda: {(k,): v for k, v in services.artifacts.stats().items()},
+    )
+    backends = (services.abacus.backend, services.mem.backend)
+    Gauge(
+        "bot_backend_breaker_state",
+        "Предохранитель бэкенда: 0 — замкнут, 1 — пробный запрос, 2 — разомкнут.", ["backend"],
+        lambda: {(b.name,): _BREAKER_STATES[b.breaker.state] for b in backends},
+    )
+    Gauge(
+        "bot_backend_limiter", "Клиентский лимит частоты запросов к бэкендам.", ["backend", "kind"],
+        lambda: {(b.name, k): v for b in backends for k, v in b.stats().items()},
+    )
+    if cache is not None:
+        Gauge(
+            "bot_llm_cache", "Статистика кэша ответов LLM.", ["kind"],
+            lambda: {(k,): v for k, v in cache.stats().items()},
+        )
+
+
+async def start_services(application: Application, outbox_sender: bool = True) -> Services:
+    """
+    Создаёт и запускает сервисы хендлеров (см. Services.start), регистрирует
+    их метрики и пишет в лог, сколько занял запуск.
+    """
+    started = time.perf_counter()
+    services = handlers.create_services()
+    application.bot_data["services"] = services
+    if outbox_sender:
+        services.outbox.on_failed = handlers.note_failure_notifier(application.bot)
+    timings = {"imports": _IMPORT_SECONDS, **await services.start(outbox_sender)}
+
+    _register_gauges(application, services)
+    timings["total"] = _IMPORT_SECONDS + time.perf_counter() - started
+    Gauge(
+        "bot_startup_seconds", "Длительность этапов запуска бота.", ["phase"],
+        lambda: {(k,): v for k, v in timings.items()},
+    )
+    logger.info(
+        "Бот готов за %.2f с (%s)",
+        timings["total"],
+        ", ".join(f"{k} {v:.2f} с" for k, v in timings.items() if k != "total"),
+    )
+    return services
+
+
+async def stop_services(application: Application) -> None:
+    services: Services | None = application.bot_data.get("services")
+    if services is not None:
+        await services.stop()
+
+
+async def _post_init(application: Application) -> None:
+    # Временные файлы от прошлого запуска (если процесс упал посреди обработки)
+    cleanup_tmp_dir()
+    await start_services(application)
+    await metrics_server.start()
+
+
+async def _post_shutdown(application: Application) -> None:
+    await metrics_server.stop()
+    await stop_services(application)
+
 
+async def _post_init_poller(application: Application) -> None:
+    cleanup_tmp_dir()
+    # Заметки шардов отправляет в Mem.ai один outbox — в поллере
+    mem = MemClient()
+    outbox = NoteOutbox(OutboxStore(OUTBOX_DB_PATH), mem, index=NoteIndex())
+    outbox.on_failed = handlers.note_failure_notifier(application.bot)
+    application.bot_data["outbox"] = outbox
+    await mem.open()
+    await outbox.start()
+
+    processor: ShardedUpdateProcessor = application.update_processor
+    processor.on_outbox = outbox.wakeup
+    await processor.start(application.bot)
+
+    Gauge(
+        "bot_shard_pending", "Апдейты, переданные шарду и ещё не обработанные.", ["shard"],
+        lambda: {(str(k),): v for k, v in processor.pending_by_shard().items()},
+    )
+    Gauge(
+        "bot_outbox_items", "Заметки в outbox по статусу.", ["status"],
+        lambda: {(k,): v for k, v in outbox.store.count_by_status().items()},
+    )
+    await metrics_server.start()
+
+
+async def _post_stop_poller(application: Application) -> None:
+    # Bot поллера ещё работает: шарды дорабатывают апдейты и отвечают через него
+    await application.update_processor.stop()
+
+
+async def _post_shutdown_poller(application: Application) -> None:
+    # Если до post_stop не дошло (ошибка запуска), шарды всё равно нужно остановить
+    await application.update_processor.stop()
+    await metrics_server.stop()
+    outbox: NoteOutbox | None = application.bot_data.get("outbox")
+    if outbox is not None:
+        await outbox.stop()
+        await outbox.mem_client.aclose()
+
+
+def build_application(token: str, builder: ApplicationBuilder | None = None) -> Application:
+    """
+    Собирает Application со всеми хендлерами. builder позволяет заранее
+    настроить, например, base_url Bot API (используется в бенчмарке).
+    """
+    application = (
+        (builder or ApplicationBuilder())
+        .token(token)
+        # Апдейты разных чатов обрабатываются параллельно, одного чата — по порядку
+        .concurrent_updates(PerChatUpdateProcessor())
+        .post_init(_post_init)
+        .post_shutdown(_post_shutdown)
+        .build()
+    )
+
+    # Перед не-текстовыми апдейтами дообрабатываем накопленный текст чата (кроме /flush:
+    # он делает это сам и отвечает, если нечего отправлять)
+    application.add_handler(
+        MessageHandler(
+            ~(filters.TEXT & ~filters.COMMAND) & ~filters.Regex(r"^/flush(@\w+)?(\s|$)"),
+            handlers.wait_pending_texts,
+        ),
+        group=-1,
+    )
     application.add_handler(CommandHandler("start", handlers.start))
     application.add_handler(CommandHandler("tags", handlers.show_tags))
     application.add_handler(CommandHandler("addtag", handlers.add_tag_command))
+    application.add_handler(CommandHandler("stats", handlers.show_stats))
+    application.add_handler(CommandHandler("quota", handlers.show_quota))
+    application.add_handler(CommandHandler("flush", handlers.flush_text))
+    application.add_handler(CommandHandler("search", handlers.search_notes))
+    application.add_handler(CommandHandler("reindex", handlers.reindex_notes))
+    application.add_handler(CommandHandler("force", handlers.force_reprocess))
+    application.add_handler(CommandHandler("import", handlers.import_command))
 
     # Фото
     application.add_handler(
@@ -45,10 +246,10 @@ def main() -> None:
         )
     )
 
-    # Документы (PDF)
+    # Документы (PDF; ZIP — для пакетного импорта)
     application.add_handler(
         MessageHandler(
-            filters.Document.PDF & ~filters.COMMAND,
+            (filters.Document.PDF | filters.Document.ZIP) & ~filters.COMMAND,
             handlers.handle_document,
         )
     )
@@ -58,8 +259,80 @@ def main() -> None:
         MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.handle_text)
     )
 
-    logger.info("Starting Telegram → Abacus → Mem bot (long polling)...")
-    application.run_polling()
+    application.add_error_handler(handlers.error_handler)
+
+    return application
+
+
+def build_sharded_application(
+    token: str, builder: ApplicationBuilder | None = None, workers: int = SHARD_WORKERS
+) -> Application:
+    """
+    Собирает Application процесса-поллера: хендлеров в нём нет, апдейты
+    обрабатывают workers процессов-шардов (см. ShardedUpdateProcessor).
+    """
+    return (
+        (builder or ApplicationBuilder())
+        .token(token)
+        .concurrent_updates(ShardedUpdateProcessor(workers))
+        .post_init(_post_init_poller)
+        .post_stop(_post_stop_poller)
+        .post_shutdown(_post_shutdown_poller)
+        .build()
+    )
+
+
+async def run_webhook(application: Application) -> None:
+    """
+    Жизненный цикл бота в режиме webhook (аналог run_polling): запуск
+    приложения и HTTP-сервера, регистрация webhook, ожидание SIGINT/SIGTERM.
+    """
+    server = WebhookServer(application)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await application.initialize()
+    try:
+        await application.post_init(application)
+        await application.start()
+        await server.start()
+        Gauge(
+            "bot_webhook_queue", "Апдейты webhook, ожидающие передачи в обработку.", [],
+            lambda: {(): server.pending},
+        )
+        await server.set_webhook()
+        await stop.wait()
+    finally:
+        # Webhook не удаляем: пока бот перезапускается, Telegram копит апдейты у себя
+        await server.stop()
+        if application.running:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        await application.post_shutdown(application)
+
+
+def main() -> None:
+    validate_config()
+
+    if not TELEGRAM_BOT_TOKEN:
+        raise RuntimeError("TELEGRAM_BOT_TOKEN is not set")
+
+    if SHARD_WORKERS > 0:
+        logger.info("Апдейты обрабатывают %s процессов-шардов", SHARD_WORKERS)
+        application = build_sharded_application(TELEGRAM_BOT_TOKEN)
+    else:
+        application = build_application(TELEGRAM_BOT_TOKEN)
+
+    if WEBHOOK_URL:
+        logger.info("Starting Telegram → Abacus → Mem bot (webhook)...")
+        asyncio.run(run_webhook(application))
+    else:
+        logger.info("Starting Telegram → Abacus → Mem bot (long polling)...")
+        application.run_polling()
 
 
 if __name__ == "__main__":
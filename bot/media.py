@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import io
+import logging
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator
+
+from telegram import File
+
+from .config import MEDIA_BUFFER_POOL_SIZE, MEDIA_SPILL_BYTES, MEDIA_TMP_DIR
+from .metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# Переиспользуемые буферы для скачивания: не выделяем память заново на каждое сообщение
+_buffer_pool: list[io.BytesIO] = []
+
+
+def _take_buffer() -> io.BytesIO:
+    return _buffer_pool.pop() if _buffer_pool else io.BytesIO()
+
+
+def _return_buffer(buffer: io.BytesIO) -> None:
+    buffer.seek(0)
+    buffer.truncate()
+    if len(_buffer_pool) < MEDIA_BUFFER_POOL_SIZE:
+        _buffer_pool.append(buffer)
+
+
+class DownloadedMedia:
+    """
+    Скачанный из Telegram файл: в памяти или, если он большой, во временном файле.
+
+    source — то, что можно отдать дальше (в ffmpeg через stdin или в извлечение
+    текста из PDF): memoryview на буфер либо путь к временному файлу.
+    """
+
+    def __init__(self, buffer: io.BytesIO | None = None, path: Path | None = None) -> None:
+        self._buffer = buffer
+        self._view = buffer.getbuffer() if buffer is not None else None
+        self.path = path
+
+    @property
+    def source(self) -> memoryview | str:
+        if self._view is not None:
+            return self._view
+        assert self.path is not None
+        return str(self.path)
+
+    @property
+    def size(self) -> int:
+        if self._view is not None:
+            return self._view.nbytes
+        return self.path.stat().st_size if self.path is not None else 0
+
+    def close(self) -> None:
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._buffer is not None:
+            _return_buffer(self._buffer)
+            self._buffer = None
+        if self.path is not None:
+            try:
+                self.path.unlink()
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+
+@asynccontextmanager
+async def download_media(
+    file: File, suffix: str = "", spill_threshold: int = MEDIA_SPILL_BYTES
+) -> AsyncIterator[DownloadedMedia]:
+    """
+    Скачивает файл Telegram в память. Файлы больше spill_threshold пишутся
+    во временный файл в MEDIA_TMP_DIR, который гарантированно удаляется
+    при выходе из контекста.
+    """
+    if file.file_size is not None and file.file_size > spill_threshold:
+        MEDIA_TMP_DIR.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(suffix=suffix, dir=MEDIA_TMP_DIR)
+        os.close(fd)
+        media = DownloadedMedia(path=Path(tmp_name))
+        try:
+            with stage("telegram_download"):
+                await file.download_to_drive(tmp_name)
+            yield media
+        finally:
+            media.close()
+        return
+
+    buffer = _take_buffer()
+    try:
+        with stage("telegram_download"):
+            await file.download_to_memory(out=buffer)
+    except BaseException:
+        _return_buffer(buffer)
+        raise
+    media = DownloadedMedia(buffer=buffer)
+    try:
+        yield media
+    finally:
+        media.close()
+
+
+def cleanup_tmp_dir() -> None:
+    """
+    Удаляет временные файлы, оставшиеся после аварийного завершения процесса.
+    """
+    if not MEDIA_TMP_DIR.exists():
+        return
+    for path in MEDIA_TMP_DIR.iterdir():
+        try:
+            path.unlink()
+        except OSError as e:
+            logger.warning("Не удалось удалить временный файл %s: %s", path, e)
@@ -2,7 +2,11 @@ from __future__ import annotations
 
 import httpx
 
-from .config import MEM_API_KEY, MEM_API_BASE_URL
+from .concurrency import mem_stage
+from .config import MEM_API_KEY, MEM_API_BASE_URL, MEM_RATE_BURST, MEM_RATE_LIMIT
+from .http_client import build_async_client
+from .metrics import stage
+from .resilience import ResilientBackend
 
 
 class MemClient:
@@ -13,6 +17,9 @@ class MemClient:
         if not self.api_key:
             raise RuntimeError("MEM_API_KEY is not set")
 
+        self._http: httpx.AsyncClient | None = None
+        self.backend = ResilientBackend("mem", MEM_RATE_LIMIT, MEM_RATE_BURST)
+
     @property
     def _headers(self) -> dict[str, str]:
         return {
@@ -20,33 +27,59 @@ class MemClient:
             "Content-Type": "application/json",
         }
 
-    async def create_note(self, content: str) -> dict:
+    @property
+    def http(self) -> httpx.AsyncClient:
+        """
+        Общий пул соединений к Mem.ai. Обычно открывается в post_init приложения,
+        но при прямом использовании клиента создаётся лениво.
+        """
+        if self._http is None or self._http.is_closed:
+            self._http = build_async_client(self.base_url, headers=self._headers)
+        return self._http
+
+    async def open(self) -> None:
+        _ = self.http
+
+    async def aclose(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    async def create_note(self, content: str, idempotency_key: str | None = None) -> dict:
         """
         Создаёт заметку в Mem.ai (v2 /notes).
         Возвращает JSON ответа (где есть id заметки).
+        idempotency_key позволяет безопасно повторять запрос после сбоя.
         """
-        url = f"{self.base_url}/notes"
         payload = {
             "content": content,
         }
+        headers = {"Idempotency-Key": idempotency_key} if idempotency_key else None
 
-        async with httpx.AsyncClient(timeout=60) as client:
-            resp = await client.post(url, headers=self._headers, json=payload)
-            resp.raise_for_status()
-            return resp.json()
+        async with mem_stage.slot():
+            with stage("mem"):
+                resp = await self.backend.call(
+                    lambda: self.http.post("/notes", json=payload, headers=headers),
+                    # Без ключа идемпотентности повтор может создать дубликат
+                    idempotent=idempotency_key is not None,
+                )
+        resp.raise_for_status()
+        return resp.json()
 
     async def update_note_content(self, note_id: str, content: str) -> dict:
         """
         Обновляет содержимое заметки, чтобы в конец дописать теги.
         """
-        url = f"{self.base_url}/notes/{note_id}"
         payload = {
             "content": content,
         }
 
-        async with httpx.AsyncClient(timeout=60) as client:
-            resp = await client.patch(url, headers=self._headers, json=payload)
-            resp.raise_for_status()
-            return resp.json()
+        async with mem_stage.slot():
+            with stage("mem"):
+                resp = await self.backend.call(
+                    lambda: self.http.patch(f"/notes/{note_id}", json=payload)
+                )
+        resp.raise_for_status()
+        return resp.json()
 
 
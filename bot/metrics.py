@@ -0,0 +1,273 @@
+from __future__ import annotations
+
+import functools
+import logging
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Iterable, TypeVar
+
+from .config import METRICS_HOST, METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+_F = TypeVar("_F", bound=Callable[..., Awaitable[Any]])
+
+# Границы корзин гистограмм латентности (секунды): от быстрых HTTP-запросов до долгих PDF
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{v}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()) -> None:
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.values: dict[tuple[str, ...], float] = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class _Series:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size: int) -> None:
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labels: Iterable[str] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = buckets
+        self.series: dict[tuple[str, ...], _Series] = {}
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = _Series(len(self.buckets) + 1)
+        series.counts[bisect_left(self.buckets, value)] += 1
+        series.sum += value
+        series.count += 1
+
+    def quantile(self, q: float, *labels: str) -> float | None:
+        """
+        Оценка квантиля по корзинам (линейная интерполяция внутри корзины).
+        """
+        series = self.series.get(labels)
+        if series is None or series.count == 0:
+            return None
+        rank = q * series.count
+        seen = 0
+        for i, count in enumerate(series.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series.counts):
+                cumulative += count
+                bucket_labels = _format_labels((*self.labels, "le"), (*labels, str(bound)))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            suffix = _format_labels(self.labels, labels)
+            lines.append(f"{self.name}_sum{suffix} {series.sum}")
+            lines.append(f"{self.name}_count{suffix} {series.count}")
+        return lines
+
+
+class Gauge:
+    """
+    Gauge, значение которого считывается колбэком в момент сбора метрик
+    (глубина очередей и т.п.), поэтому на горячем пути ничего не стоит.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labels: Iterable[str],
+        collect: Callable[[], dict[tuple[str, ...], float]],
+    ) -> None:
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.collect = collect
+        REGISTRY.append(self)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.collect()
+        except Exception as e:
+            logger.warning("Не удалось собрать метрику %s: %s", self.name, e)
+            return lines
+        for labels, value in values.items():
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value}")
+        return lines
+
+
+REGISTRY: list[Counter | Histogram | Gauge] = []
+
+STAGE_SECONDS = Histogram(
+    "bot_stage_duration_seconds", "Длительность стадий обработки сообщения.", ["stage"]
+)
+STAGE_ERRORS = Counter("bot_stage_errors_total", "Ошибки по стадиям обработки.", ["stage"])
+HANDLER_SECONDS = Histogram(
+    "bot_handler_duration_seconds", "Полное время обработки сообщения хендлером.", ["handler"]
+)
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Необработанные ошибки в хендлерах.", ["handler"])
+HTTP_REQUESTS = Counter(
+    "bot_http_requests_total", "HTTP-запросы к внешним API по статусу ответа.", ["backend", "status"]
+)
+RETRIES = Counter("bot_retries_total", "Повторные попытки запросов к внешним API.", ["backend"])
+
+
+class _StageTimer:
+    __slots__ = ("name", "_start")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __enter__(self) -> "_StageTimer":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type: type | None, *exc_info: object) -> None:
+        STAGE_SECONDS.observe(time.perf_counter() - self._start, self.name)
+        if exc_type is not None and not issubclass(exc_type, GeneratorExit):
+            STAGE_ERRORS.inc(self.name)
+
+
+def stage(name: str) -> _StageTimer:
+    """
+    Замер стадии: with stage("pdf_extract"): ...
+    Время пишется в STAGE_SECONDS, исключение — в STAGE_ERRORS.
+    """
+    return _StageTimer(name)
+
+
+def timed_handler(name: str) -> Callable[[_F], _F]:
+    """
+    Декоратор хендлера: полное время обработки и счётчик ошибок.
+    """
+
+    def decorator(func: _F) -> _F:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(name)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - start, name)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
+
+
+def render_prometheus() -> str:
+    lines: list[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def format_stats() -> str:
+    """
+    Короткая сводка для команды /stats.
+    """
+    lines = ["Обработка сообщений (количество, p50 / p95):"]
+    for labels, series in sorted(HANDLER_SECONDS.series.items()):
+        p50 = HANDLER_SECONDS.quantile(0.5, *labels) or 0
+        p95 = HANDLER_SECONDS.quantile(0.95, *labels) or 0
+        errors = int(HANDLER_ERRORS.values.get(labels, 0))
+        lines.append(f"- {labels[0]}: {series.count}, {p50:.2f} / {p95:.2f} с, ошибок: {errors}")
+
+    lines.append("")
+    lines.append("Стадии (количество, p50 / p95):")
+    for labels, series in sorted(STAGE_SECONDS.series.items()):
+        p50 = STAGE_SECONDS.quantile(0.5, *labels) or 0
+        p95 = STAGE_SECONDS.quantile(0.95, *labels) or 0
+        errors = int(STAGE_ERRORS.values.get(labels, 0))
+        lines.append(f"- {labels[0]}: {series.count}, {p50:.2f} / {p95:.2f} с, ошибок: {errors}")
+
+    gauges = [m for m in REGISTRY if isinstance(m, Gauge)]
+    if gauges:
+        lines.append("")
+        lines.append("Очереди и кэши:")
+        for gauge in gauges:
+            try:
+                values = gauge.collect()
+            except Exception:
+                continue
+            for labels, value in values.items():
+                suffix = f" ({', '.join(labels)})" if labels else ""
+                lines.append(f"- {gauge.name}{suffix}: {value:g}")
+
+    retries = sum(RETRIES.values.values())
+    lines.append("")
+    lines.append(f"Повторных попыток запросов: {int(retries)}")
+    return "\n".join(lines)
+
+
+class MetricsServer:
+    """
+    Локальный HTTP-эндпоинт /metrics в формате Prometheus (на aiohttp).
+    """
+
+    def __init__(self, host: str = METRICS_HOST, port: int = METRICS_PORT) -> None:
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def start(self) -> None:
+        if not self.port:
+            return
+        from aiohttp import web
+
+        async def metrics(request: web.Request) -> web.Response:
+            return web.Response(text=render_prometheus(), content_type="text/plain", charset="utf-8")
+
+        app = web.Application()
+        app.router.add_get("/metrics", metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info("Метрики доступны на http://%s:%s/metrics", self.host, self.port)
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
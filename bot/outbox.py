@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable
+
+import httpx
+
+from .concurrency import job_context
+from .config import (
+    OUTBOX_BACKOFF_BASE,
+    OUTBOX_BACKOFF_MAX,
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_CONCURRENCY,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_RETENTION_DAYS,
+)
+from .mem_client import MemClient
+from .metrics import RETRIES
+from .resilience import BackendUnavailable, is_retryable, retry_after
+from .search_index import NoteIndex
+from .state import OutboxItem, OutboxStore
+
+logger = logging.getLogger(__name__)
+
+
+class NoteOutbox:
+    """
+    Фоновая отправка заметок из OutboxStore в Mem.ai.
+
+    Ограничивает число одновременных запросов, повторяет временные ошибки
+    с экспоненциальной задержкой и передаёт Mem.ai ключ идемпотентности,
+    чтобы повтор после обрыва соединения не создавал дубликат.
+
+    Если передан index, каждая заметка сразу попадает в локальный
+    поисковый индекс, а после отправки туда дописывается её id в Mem.ai.
+    """
+
+    def __init__(
+        self,
+        store: OutboxStore,
+        mem_client: MemClient,
+        concurrency: int = OUTBOX_CONCURRENCY,
+        batch_size: int = OUTBOX_BATCH_SIZE,
+        index: NoteIndex | None = None,
+    ) -> None:
+        self.store = store
+        self.mem_client = mem_client
+        self.index = index
+        self.batch_size = batch_size
+        self._slots = asyncio.Semaphore(concurrency)
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._inflight: set[asyncio.Task] = set()
+        # Вызывается после каждой записи в очередь (шард будит outbox поллера)
+        self.on_enqueue: Callable[[], None] | None = None
+        # on_failed(запись, ошибка) — заметка не отправлена окончательно: пользователю
+        # уже ответили, что она записана, поэтому его нужно предупредить
+        self.on_failed: Callable[[OutboxItem, str], Awaitable[None]] | None = None
+
+    def enqueue(
+        self,
+        content: str,
+        *,
+        source: str,
+        chat_id: int | None = None,
+    ) -> OutboxItem:
+        item = self.store.enqueue(content, source=source, chat_id=chat_id)
+        self.wakeup()
+        if self.on_enqueue is not None:
+            self.on_enqueue()
+        if self.index is not None:
+            try:
+                self.index.add(item)
+            except Exception as e:
+                # Заметка уже в очереди; индекс можно будет дособрать через /reindex
+                logger.warning("Не удалось добавить заметку %s в индекс: %s", item.id, e)
+        return item
+
+    def wakeup(self) -> None:
+        """
+        В очереди появились заметки (в том числе записанные другим процессом).
+        """
+        self._wakeup.set()
+
+    async def start(self) -> None:
+        restored = self.store.reset_inflight()
+        if restored:
+            logger.info("Outbox: возвращено в очередь %s незавершённых заметок", restored)
+        pruned = self.store.prune_sent(time.time() - OUTBOX_RETENTION_DAYS * 86400)
+        if pruned:
+            logger.info("Outbox: удалено %s старых отправленных записей", pruned)
+        self._task = asyncio.create_task(self._run(), name="note-outbox")
+
+    async def stop(self) -> None:
+        tasks = [t for t in (self._task, *self._inflight) if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        # Прерванные отправки останутся в статусе sending и вернутся в очередь при старте
+        self.store.close()
+        if self.index is not None:
+            self.index.close()
+
+    async def _wait_for_work(self) -> None:
+        next_due = self.store.next_due_at()
+        timeout = None if next_due is None else max(0.0, next_due - time.time())
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                items = self.store.claim_due(self.batch_size)
+            except Exception:
+                logger.exception("Outbox: не удалось прочитать очередь")
+                await asyncio.sleep(OUTBOX_BACKOFF_BASE)
+                continue
+
+            if not items:
+                await self._wait_for_work()
+                continue
+
+            for item in items:
+                await self._slots.acquire()
+                task = asyncio.create_task(self._send(item))
+                self._inflight.add(task)
+                task.add_done_callback(self._inflight.discard)
+
+    async def _report_failed(self, item: OutboxItem, error: str) -> None:
+        if self.on_failed is None or item.chat_id is None:
+            return
+        try:
+            await self.on_failed(item, error)
+        except Exception as e:
+            logger.warning("Outbox: не удалось сообщить о неотправленной заметке %s: %s", item.id, e)
+
+    async def _send(self, item: OutboxItem) -> None:
+        try:
+            # Стадия Mem.ai делится между чатами поровну
+            with job_context(item.chat_id):
+                resp = await self.mem_client.create_note(
+                    item.content, idempotency_key=item.idempotency_key
+                )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Пока предохранитель Mem.ai разомкнут, запрос не уходит — это не попытка,
+            # иначе после долгого сбоя заметка не переживёт первую же настоящую ошибку
+            attempted = not isinstance(e, BackendUnavailable)
+            attempts = item.attempts + attempted
+            error = f"{type(e).__name__}: {e}"
+            exhausted = attempted and attempts >= OUTBOX_MAX_ATTEMPTS
+            if not is_retryable(e) or exhausted:
+                logger.error("Outbox: заметка %s не отправлена окончательно: %s", item.id, error)
+                self.store.mark_failed(item.id, error)
+                await self._report_failed(item, error)
+            else:
+                delay = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * 2 ** max(0, attempts - 1))
+                delay *= random.uniform(0.5, 1.0)
+                if isinstance(e, BackendUnavailable):
+                    delay = max(delay, e.retry_after)
+                elif isinstance(e, httpx.HTTPStatusError):
+                    delay = max(delay, retry_after(e.response.headers) or 0.0)
+                logger.warning(
+                    "Outbox: ошибка отправки %s (попытка %s), повтор через %.1f с: %s",
+                    item.id, attempts, delay, error,
+                )
+                RETRIES.inc("mem")
+                self.store.mark_retry(item.id, error, delay, attempted=attempted)
+                self._wakeup.set()
+        else:
+            note_id = resp.get("id") if isinstance(resp, dict) else None
+            self.store.mark_sent(item.id, note_id)
+            if self.index is not None:
+                try:
+                    self.index.set_note_id(item.id, note_id)
+                except Exception as e:
+                    logger.warning("Не удалось обновить индекс для %s: %s", item.id, e)
+        finally:
+            self._slots.release()
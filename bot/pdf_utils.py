@@ -1,26 +1,254 @@
 from __future__ import annotations
 
+import asyncio
+import io
+import logging
+import multiprocessing
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import TYPE_CHECKING, Callable
 
-from PyPDF2 import PdfReader
+from .config import PDF_MAX_PAGES, PDF_TIMEOUT, PDF_WORKERS
 
+if TYPE_CHECKING:
+    from PyPDF2 import PdfReader
 
-def extract_pdf_text(path: str | Path, max_chars: int | None = 20000) -> str:
+logger = logging.getLogger(__name__)
+
+PdfSource = str | Path | bytes | memoryview
+# (страниц прочитано, всего страниц, символов извлечено)
+ProgressCallback = Callable[[int, int, int], None]
+
+
+class PdfExtractionError(RuntimeError):
+    pass
+
+
+@dataclass
+class PdfExtraction:
+    pages: list[str] = field(default_factory=list)
+    page_count: int = 0
+    pages_read: int = 0
+    chars: int = 0
+    # Причина, по которой чтение остановлено раньше конца документа: chars/pages/timeout
+    truncated_by: str | None = None
+
+    @property
+    def text(self) -> str:
+        return "\n\n".join(self.pages)
+
+
+def _open_reader(source: PdfSource) -> PdfReader:
+    # PyPDF2 нужен только воркерам пула: основной процесс его не импортирует
+    from PyPDF2 import PdfReader
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        stream = io.BytesIO(source)
+    else:
+        stream = str(Path(source))
+    reader = PdfReader(stream)
+    if reader.is_encrypted:
+        # Многие PDF «зашифрованы» пустым паролем только ради запрета печати
+        reader.decrypt("")
+    return reader
+
+
+def extract_pdf_pages(
+    source: PdfSource,
+    max_chars: int | None = None,
+    max_pages: int | None = None,
+    deadline: float | None = None,
+    progress: ProgressCallback | None = None,
+) -> PdfExtraction:
     """
-    Извлекает текст из PDF. Чтобы не слать в LLM слишком большие документы,
-    можно ограничить длину max_chars.
+    Постранично извлекает текст из PDF (путь или байты), ведя счётчик символов.
+
+    Останавливается при достижении max_chars, max_pages или deadline
+    (time.monotonic()); причина сохраняется в truncated_by.
     """
-    p = Path(path)
-    reader = PdfReader(str(p))
-    chunks: list[str] = []
+    reader = _open_reader(source)
+    result = PdfExtraction(page_count=len(reader.pages))
+
     for page in reader.pages:
+        if max_pages is not None and result.pages_read >= max_pages:
+            result.truncated_by = "pages"
+            break
+        if deadline is not None and time.monotonic() >= deadline:
+            result.truncated_by = "timeout"
+            break
+
         text = page.extract_text() or ""
-        if not text:
-            continue
-        chunks.append(text)
-        joined = "\n\n".join(chunks)
-        if max_chars is not None and len(joined) >= max_chars:
-            return joined[:max_chars]
-    return "\n\n".join(chunks)
+        result.pages_read += 1
+        if text:
+            # +2 — разделитель "\n\n" между страницами в итоговом тексте
+            separator = 2 if result.pages else 0
+            if max_chars is not None and result.chars + separator + len(text) >= max_chars:
+                text = text[: max(0, max_chars - result.chars - separator)]
+                result.pages.append(text)
+                result.chars += separator + len(text)
+                result.truncated_by = "chars"
+                break
+            result.pages.append(text)
+            result.chars += separator + len(text)
+
+        if progress is not None:
+            progress(result.pages_read, result.page_count, result.chars)
+
+    return result
+
+
+def extract_pdf_text(path: PdfSource, max_chars: int | None = 20000) -> str:
+    """
+    Извлекает текст из PDF. Чтобы не слать в LLM слишком большие документы,
+    можно ограничить длину max_chars.
+    """
+    return extract_pdf_pages(path, max_chars=max_chars).text
+
+
+# --- Выполнение в пуле процессов ---
+
+_progress_queue = None
+
+
+def _init_worker(progress_queue) -> None:
+    global _progress_queue
+    _progress_queue = progress_queue
+
+
+def _extract_in_worker(
+    job_id: str,
+    source: PdfSource,
+    max_chars: int | None,
+    max_pages: int | None,
+    time_limit: float | None,
+) -> PdfExtraction:
+    deadline = time.monotonic() + time_limit if time_limit is not None else None
+
+    def report(done: int, total: int, chars: int) -> None:
+        if _progress_queue is not None:
+            _progress_queue.put((job_id, done, total, chars))
+
+    return extract_pdf_pages(source, max_chars, max_pages, deadline, report)
+
+
+class PdfExtractor:
+    """
+    Извлечение текста из PDF в пуле процессов, чтобы разбор большого
+    документа не блокировал event loop бота.
+
+    У каждого документа есть лимит времени: по его истечении воркер
+    возвращает уже прочитанные страницы, а если воркер завис на одной
+    странице — пул пересоздаётся.
+    """
+
+    # Сколько ждать сверх лимита времени, прежде чем считать воркер зависшим
+    HARD_TIMEOUT_GRACE = 10.0
+
+    def __init__(
+        self,
+        workers: int = PDF_WORKERS,
+        timeout: float = PDF_TIMEOUT,
+        max_pages: int | None = PDF_MAX_PAGES,
+    ) -> None:
+        self.workers = workers
+        self.timeout = timeout
+        self.max_pages = max_pages
+        self._ctx = multiprocessing.get_context("spawn")
+        self._pool: ProcessPoolExecutor | None = None
+        self._progress_queue = None
+        self._progress_thread: threading.Thread | None = None
+        self._callbacks: dict[str, tuple[asyncio.AbstractEventLoop, ProgressCallback]] = {}
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            if self._progress_queue is None:
+                self._progress_queue = self._ctx.Queue()
+                self._progress_thread = threading.Thread(
+                    target=self._pump_progress, name="pdf-progress", daemon=True
+                )
+                self._progress_thread.start()
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=self._ctx,
+                initializer=_init_worker,
+                initargs=(self._progress_queue,),
+            )
+        return self._pool
+
+    def _pump_progress(self) -> None:
+        while True:
+            msg = self._progress_queue.get()
+            if msg is None:
+                return
+            job_id, done, total, chars = msg
+            entry = self._callbacks.get(job_id)
+            if entry is not None:
+                loop, callback = entry
+                loop.call_soon_threadsafe(callback, done, total, chars)
+
+    def _kill_pool(self) -> None:
+        pool, self._pool = self._pool, None
+        if pool is None:
+            return
+        # У ProcessPoolExecutor нет штатного способа прервать выполняющуюся задачу
+        for process in list(getattr(pool, "_processes", {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    async def extract(
+        self,
+        source: PdfSource,
+        *,
+        max_chars: int | None = None,
+        on_progress: ProgressCallback | None = None,
+    ) -> PdfExtraction:
+        loop = asyncio.get_running_loop()
+        job_id = uuid.uuid4().hex
+        if isinstance(source, memoryview):
+            # memoryview нельзя передать в другой процесс
+            source = source.tobytes()
+        if on_progress is not None:
+            self._callbacks[job_id] = (loop, on_progress)
 
+        try:
+            for attempt in range(2):
+                pool = self._get_pool()
+                future = pool.submit(
+                    _extract_in_worker, job_id, source, max_chars, self.max_pages, self.timeout
+                )
+                try:
+                    return await asyncio.wait_for(
+                        asyncio.wrap_future(future),
+                        timeout=self.timeout + self.HARD_TIMEOUT_GRACE,
+                    )
+                except asyncio.TimeoutError:
+                    logger.error("PDF-воркер завис дольше %.0f с, пересоздаю пул", self.timeout)
+                    # Соседняя задача могла уже пересоздать пул: новый не трогаем
+                    if self._pool is pool:
+                        self._kill_pool()
+                    raise PdfExtractionError("превышено время обработки PDF")
+                except BrokenProcessPool:
+                    # Пул мог быть пересоздан из-за зависшего соседнего документа:
+                    # убиваем только тот, в который ставили задачу, а не уже новый
+                    if self._pool is pool:
+                        self._kill_pool()
+                    if attempt:
+                        raise PdfExtractionError("процесс обработки PDF аварийно завершился")
+                except PdfExtractionError:
+                    raise
+                except Exception as e:
+                    raise PdfExtractionError(f"не удалось прочитать PDF: {e}") from e
+        finally:
+            self._callbacks.pop(job_id, None)
+        raise PdfExtractionError("не удалось прочитать PDF")
 
+    def shutdown(self) -> None:
+        self._kill_pool()
+        if self._progress_queue is not None:
+            self._progress_queue.put(None)
+            self._progress_queue = None
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from .config import PROGRESS_EDIT_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+class StatusMessage:
+    """
+    Статусное сообщение, которое обновляется по ходу долгой обработки.
+
+    Telegram ограничивает частоту редактирования, поэтому промежуточные
+    обновления склеиваются: отправляется только последний текст и не чаще,
+    чем раз в min_interval секунд. set() можно вызывать синхронно из колбэков.
+    После finish() статус больше не меняется: запоздавшие set() игнорируются.
+    """
+
+    def __init__(self, message: Message, min_interval: float = PROGRESS_EDIT_INTERVAL) -> None:
+        self.message = message
+        self.min_interval = min_interval
+        self._shown = message.text or ""
+        self._wanted = self._shown
+        self._last_edit = time.monotonic()
+        self._flush_task: asyncio.Task | None = None
+        self._final = False
+
+    @classmethod
+    async def send(
+        cls, reply_to: Message, text: str, min_interval: float = PROGRESS_EDIT_INTERVAL
+    ) -> "StatusMessage":
+        message = await reply_to.reply_text(text)
+        return cls(message, min_interval)
+
+    def set(self, text: str) -> None:
+        if self._final:
+            return
+        self._wanted = text
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._delayed_flush())
+
+    async def update(self, text: str) -> None:
+        """
+        Немедленно показать text (промежуточный этап).
+        """
+        if self._final:
+            return
+        self._wanted = text
+        await self._cancel_flush()
+        await self._edit()
+
+    async def finish(self, text: str) -> None:
+        """
+        Показать итоговый статус; дальнейшие set() и update() игнорируются.
+        """
+        if self._final:
+            return
+        self._final = True
+        self._wanted = text
+        await self._cancel_flush()
+        await self._edit()
+
+    async def _cancel_flush(self) -> None:
+        task = self._flush_task
+        if task is None or task.done():
+            return
+        task.cancel()
+        # Дожидаемся отмены, чтобы отложенная правка не перезаписала новый текст
+        try:
+            await task
+        except asyncio.CancelledError:
+            # Отменили не только правку, но и нас самих
+            if asyncio.current_task().cancelling():
+                raise
+
+    async def _delayed_flush(self) -> None:
+        # Текст мог смениться, пока шла правка: досылаем последний
+        while self._wanted != self._shown:
+            delay = self._last_edit + self.min_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                await self._edit()
+            except TelegramError as e:
+                # Фоновая задача: ошибку некому поймать, а статус — не главное
+                logger.warning("Не удалось обновить статус: %s", e)
+                return
+
+    async def _edit(self) -> None:
+        text = self._wanted
+        if text == self._shown:
+            return
+        try:
+            await self.message.edit_text(text)
+        except RetryAfter as e:
+            # Не спорим с лимитами Telegram: отложим обновление
+            await asyncio.sleep(float(e.retry_after))
+            await self._edit()
+            return
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                logger.warning("Не удалось обновить статус: %s", e)
+        self._shown = text
+        self._last_edit = time.monotonic()
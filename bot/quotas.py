@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import time
+from pathlib import Path
+from typing import Hashable
+
+from .concurrency import current_job
+from .config import (
+    QUOTA_DB_PATH,
+    USER_DAILY_AUDIO_MINUTES,
+    USER_DAILY_LLM_TOKENS,
+    USER_RATE_BURST,
+    USER_RATE_LIMIT,
+)
+from .metrics import Counter
+from .sqlite_store import SQLiteStore
+
+# Виды расхода, на которые есть суточные квоты
+LLM_TOKENS = "llm_tokens"
+AUDIO_SECONDS = "audio_seconds"
+# Частота сообщений (квота в минуту, а не в сутки)
+RATE = "rate"
+
+QUOTA_REJECTED = Counter(
+    "bot_quota_rejected_total", "Сообщения, отклонённые по квотам пользователей.", ["kind"]
+)
+USAGE = Counter("bot_usage_total", "Расход ресурсов, учитываемый в квотах.", ["kind"])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    user TEXT NOT NULL,
+    day TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    amount REAL NOT NULL,
+    PRIMARY KEY (user, day, kind)
+);
+"""
+
+
+def charge(kind: str, amount: float) -> None:
+    """
+    Записывает расход на пользователя текущей задачи (см. job_context);
+    вне задачи пользователя ничего не делает.
+    """
+    job = current_job()
+    if job is not None:
+        job.charge(kind, amount)
+
+
+def _today(now: float) -> str:
+    return time.strftime("%Y-%m-%d", time.localtime(now))
+
+
+def _seconds_to_midnight(now: float) -> float:
+    tm = time.localtime(now)
+    midnight = time.mktime((tm.tm_year, tm.tm_mon, tm.tm_mday + 1, 0, 0, 0, 0, 0, -1))
+    return max(0.0, midnight - now)
+
+
+class QuotaExceeded(Exception):
+    """
+    Квота пользователя исчерпана: сообщение не обрабатывается.
+    """
+
+    def __init__(self, kind: str, retry_after: float) -> None:
+        if kind == RATE:
+            text = f"Слишком много сообщений подряд, отправь это через {retry_after:.0f} с."
+        elif kind == AUDIO_SECONDS:
+            text = f"Дневной лимит распознавания голосовых исчерпан, он обновится через {retry_after / 3600:.1f} ч."
+        else:
+            text = f"Дневной лимит обработки в LLM исчерпан, он обновится через {retry_after / 3600:.1f} ч."
+        super().__init__(text)
+        self.kind = kind
+        self.retry_after = retry_after
+
+
+class UsageStore(SQLiteStore):
+    """
+    Суточный расход пользователей (SQLite): переживает рестарт и общий
+    для всех шардов.
+    """
+
+    SCHEMA = _SCHEMA
+
+    def __init__(self, path: str | Path = QUOTA_DB_PATH) -> None:
+        super().__init__(path)
+
+    def add(self, user: str, day: str, kind: str, amount: float) -> None:
+        self._conn.execute(
+            "INSERT INTO usage (user, day, kind, amount) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT (user, day, kind) DO UPDATE SET amount = amount + excluded.amount",
+            (user, day, kind, amount),
+        )
+
+    def get(self, user: str, day: str) -> dict[str, float]:
+        rows = self._conn.execute(
+            "SELECT kind, amount FROM usage WHERE user = ? AND day = ?", (user, day)
+        ).fetchall()
+        return {kind: amount for kind, amount in rows}
+
+    def prune(self, before_day: str) -> int:
+        cur = self._conn.execute("DELETE FROM usage WHERE day < ?", (before_day,))
+        return cur.rowcount
+
+
+class UserQuotas:
+    """
+    Квоты пользователей: частота сообщений (token bucket в памяти процесса —
+    чат пользователя всегда попадает в один шард) и суточный расход токенов
+    LLM и секунд распознанного аудио. Лимит 0 — без ограничения.
+
+    Расход записывается по факту (charge), поэтому задача, начатая до
+    исчерпания квоты, доделывается, а следующая уже отклоняется.
+    """
+
+    def __init__(
+        self,
+        store: UsageStore | None = None,
+        rate_per_minute: float = USER_RATE_LIMIT,
+        burst: int = USER_RATE_BURST,
+        daily: dict[str, float] | None = None,
+    ) -> None:
+        self.store = store or UsageStore()
+        self.rate = rate_per_minute / 60
+        self.burst = max(1, burst)
+        self.daily = daily if daily is not None else {
+            LLM_TOKENS: USER_DAILY_LLM_TOKENS,
+            AUDIO_SECONDS: USER_DAILY_AUDIO_MINUTES * 60,
+        }
+        # user -> (токены, время обновления); пользователей ограничивает ALLOWED_USERNAMES
+        self._buckets: dict[Hashable, tuple[float, float]] = {}
+        self._pruned_day = ""
+
+    def admit(self, user: Hashable) -> None:
+        """
+        Учитывает сообщение пользователя; QuotaExceeded — если он пишет чаще USER_RATE_LIMIT.
+        """
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(user, (float(self.burst), now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            QUOTA_REJECTED.inc(RATE)
+            raise QuotaExceeded(RATE, (1 - tokens) / self.rate)
+        self._buckets[user] = (tokens - 1, now)
+
+    def check(self, user: Hashable, kind: str, amount: float = 0.0) -> None:
+        """
+        QuotaExceeded, если расход kind за сутки вместе с amount превысит лимит.
+        """
+        limit = self.daily.get(kind, 0)
+        if limit <= 0:
+            return
+        now = time.time()
+        used = self.store.get(str(user), _today(now)).get(kind, 0.0)
+        if used >= limit or used + amount > limit:
+            QUOTA_REJECTED.inc(kind)
+            raise QuotaExceeded(kind, _seconds_to_midnight(now))
+
+    def charge(self, user: Hashable, kind: str, amount: float) -> None:
+        USAGE.inc(kind, amount=amount)
+        day = _today(time.time())
+        if day != self._pruned_day:
+            self._pruned_day = day
+            self.store.prune(day)
+        self.store.add(str(user), day, kind, amount)
+
+    def usage(self, user: Hashable) -> dict[str, tuple[float, float]]:
+        """
+        Расход за сегодня и лимит по каждому виду квоты.
+        """
+        used = self.store.get(str(user), _today(time.time()))
+        return {kind: (used.get(kind, 0.0), limit) for kind, limit in self.daily.items()}
+
+    def close(self) -> None:
+        self.store.close()
@@ -0,0 +1,319 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import re
+import time
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable
+
+import httpx
+
+from .config import (
+    BACKEND_MAX_RETRIES,
+    BACKEND_RETRY_BASE,
+    BACKEND_RETRY_MAX,
+    BREAKER_FAILURE_THRESHOLD,
+    BREAKER_RESET_SECONDS,
+)
+from .metrics import HTTP_REQUESTS, RETRIES, Counter
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMITED = Counter(
+    "bot_rate_limited_total", "Ответы 429 от внешних API.", ["backend"]
+)
+BREAKER_OPENED = Counter(
+    "bot_breaker_opened_total", "Сколько раз размыкался предохранитель бэкенда.", ["backend"]
+)
+
+# Ответы 4xx, которые имеет смысл повторить; остальные 4xx считаем окончательными
+_RETRYABLE_STATUS = {408, 409, 425, 429}
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+class BackendUnavailable(Exception):
+    """
+    Бэкенд считается недоступным (предохранитель разомкнут): запрос не отправлялся.
+    """
+
+    def __init__(self, backend: str, retry_after: float) -> None:
+        super().__init__(f"{backend} недоступен, повтор через {retry_after:.0f} с")
+        self.backend = backend
+        self.retry_after = retry_after
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """
+    Временная ошибка внешнего API, после которой запрос стоит повторить позже.
+    """
+    if isinstance(exc, BackendUnavailable):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return status >= 500 or status in _RETRYABLE_STATUS
+    return isinstance(exc, (httpx.TransportError, asyncio.TimeoutError))
+
+
+def _parse_seconds(value: str) -> float | None:
+    """
+    Секунды из заголовка: число, HTTP-дата или длительность вида "1m30s" / "250ms".
+    Большие числа считаются unix-временем.
+    """
+    value = value.strip()
+    try:
+        number = float(value)
+    except ValueError:
+        pass
+    else:
+        return max(0.0, number - time.time()) if number > 1e9 else max(0.0, number)
+
+    parts = _DURATION_RE.findall(value)
+    if parts and "".join(n + u for n, u in parts) == value:
+        return sum(float(n) * _DURATION_UNITS[u] for n, u in parts)
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after(headers: httpx.Headers) -> float | None:
+    value = headers.get("retry-after")
+    return _parse_seconds(value) if value else None
+
+
+def _rate_limit_pause(headers: httpx.Headers) -> float | None:
+    """
+    Если заголовки лимитов (OpenAI-стиль x-ratelimit-* или RateLimit-*) говорят,
+    что запросы кончились, — через сколько секунд лимит обновится.
+    """
+    for suffix in ("-requests", ""):
+        remaining = headers.get(f"x-ratelimit-remaining{suffix}")
+        reset = headers.get(f"x-ratelimit-reset{suffix}")
+        if remaining is not None:
+            break
+    else:
+        remaining = headers.get("ratelimit-remaining")
+        reset = headers.get("ratelimit-reset")
+    if remaining is None or reset is None:
+        return None
+    try:
+        if float(remaining) > 0:
+            return None
+    except ValueError:
+        return None
+    return _parse_seconds(reset)
+
+
+class TokenBucket:
+    """
+    Клиентский лимит частоты запросов (token bucket) с подстройкой под сервер.
+
+    На 429 скорость уменьшается вдвое (но не ниже 10% от исходной), а новые
+    запросы не отправляются до истечения Retry-After; успешные ответы
+    постепенно возвращают исходную скорость. rate <= 0 отключает лимит.
+    """
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        if self.max_rate <= 0:
+            return
+        # Lock — очередь FIFO: ждущие получают токены по порядку
+        async with self._lock:
+            waited = False
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                delay = self._paused_until - now
+                if delay <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    delay = (1 - self.tokens) / self.rate
+                if not waited:
+                    waited = True
+                    self.waits += 1
+                self.wait_seconds += delay
+                await asyncio.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def on_throttled(self, pause: float | None) -> None:
+        if self.max_rate > 0:
+            self.rate = max(self.max_rate * 0.1, self.rate / 2)
+        if pause:
+            self.pause(pause)
+
+    def on_success(self, headers: httpx.Headers) -> None:
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+        pause = _rate_limit_pause(headers)
+        if pause:
+            self.pause(pause)
+
+
+class CircuitBreaker:
+    """
+    Предохранитель: после threshold ошибок подряд (5xx, таймауты, обрывы)
+    запросы к бэкенду не отправляются reset_timeout секунд и сразу падают
+    с BackendUnavailable. Затем пропускается один пробный запрос: успех
+    замыкает предохранитель, ошибка снова размыкает.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        threshold: int = BREAKER_FAILURE_THRESHOLD,
+        reset_timeout: float = BREAKER_RESET_SECONDS,
+    ) -> None:
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def check(self) -> None:
+        if self.state == self.CLOSED:
+            return
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            remaining = self._opened_at + self.reset_timeout - now
+            if remaining > 0:
+                raise BackendUnavailable(self.name, remaining)
+            self.state = self.HALF_OPEN
+        if self._probing:
+            raise BackendUnavailable(self.name, self.reset_timeout)
+        self._probing = True
+
+    def success(self) -> None:
+        if self.state != self.CLOSED:
+            logger.info("%s снова доступен", self.name)
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            if self.state != self.OPEN:
+                logger.warning(
+                    "%s: %s ошибок подряд, запросы приостановлены на %.0f с",
+                    self.name, self.failures, self.reset_timeout,
+                )
+                BREAKER_OPENED.inc(self.name)
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """
+        Пробный запрос завершился без ответа о здоровье бэкенда (отмена, 429).
+        """
+        self._probing = False
+
+
+class ResilientBackend:
+    """
+    Лимит частоты, повторы с джиттером и предохранитель для одного бэкенда.
+
+    Повторяются только идемпотентные запросы: 5xx, обрывы соединения и 429
+    (с ожиданием Retry-After, если оно не дольше BACKEND_RETRY_MAX).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        burst: int,
+        max_retries: int = BACKEND_MAX_RETRIES,
+    ) -> None:
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(name)
+        self.max_retries = max_retries
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        delay = min(BACKEND_RETRY_MAX, BACKEND_RETRY_BASE * 2**attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def call(
+        self, send: Callable[[], Awaitable[httpx.Response]], idempotent: bool = True
+    ) -> httpx.Response:
+        """
+        Выполняет send() с лимитами и повторами. Возвращает последний ответ
+        (в том числе ошибочный — raise_for_status остаётся за вызывающим).
+        """
+        attempt = 0
+        while True:
+            self.breaker.check()
+            try:
+                await self.bucket.acquire()
+                resp = await send()
+            except httpx.TransportError:
+                self.breaker.failure()
+                if not idempotent or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+            except BaseException:
+                self.breaker.release()
+                raise
+            else:
+                status = resp.status_code
+                HTTP_REQUESTS.inc(self.name, str(status))
+                if status == 429:
+                    RATE_LIMITED.inc(self.name)
+                    self.breaker.release()
+                    pause = retry_after(resp.headers)
+                    self.bucket.on_throttled(pause)
+                    delay = pause if pause is not None else self._backoff(attempt)
+                    if attempt >= self.max_retries or delay > BACKEND_RETRY_MAX:
+                        return resp
+                elif status >= 500:
+                    self.breaker.failure()
+                    if not idempotent or attempt >= self.max_retries:
+                        return resp
+                    delay = self._backoff(attempt)
+                else:
+                    self.breaker.success()
+                    self.bucket.on_success(resp.headers)
+                    return resp
+                await resp.aclose()
+
+            attempt += 1
+            RETRIES.inc(self.name)
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "rate": self.bucket.rate,
+            "tokens": self.bucket.tokens,
+            "waits": self.bucket.waits,
+            "wait_seconds": self.bucket.wait_seconds,
+            "failures": self.breaker.failures,
+        }
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import logging
+import re
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from .config import SEARCH_DB_PATH
+from .sqlite_store import SQLiteStore
+from .state import OutboxItem, OutboxStore
+
+logger = logging.getLogger(__name__)
+
+_HASHTAG_RE = re.compile(r"#(\w+)")
+_QUERY_TOKEN_RE = re.compile(r"\w+")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS notes (
+    id INTEGER PRIMARY KEY,
+    note_id TEXT,
+    source TEXT NOT NULL,
+    chat_id INTEGER,
+    tags TEXT NOT NULL DEFAULT '',
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+    content, tags,
+    content='notes', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS notes_ai AFTER INSERT ON notes BEGIN
+    INSERT INTO notes_fts (rowid, content, tags) VALUES (new.id, new.content, new.tags);
+END;
+CREATE TRIGGER IF NOT EXISTS notes_ad AFTER DELETE ON notes BEGIN
+    INSERT INTO notes_fts (notes_fts, rowid, content, tags)
+    VALUES ('delete', old.id, old.content, old.tags);
+END;
+CREATE TRIGGER IF NOT EXISTS notes_au AFTER UPDATE OF content, tags ON notes BEGIN
+    INSERT INTO notes_fts (notes_fts, rowid, content, tags)
+    VALUES ('delete', old.id, old.content, old.tags);
+    INSERT INTO notes_fts (rowid, content, tags) VALUES (new.id, new.content, new.tags);
+END;
+"""
+
+
+@dataclass
+class SearchHit:
+    id: int
+    note_id: str | None
+    source: str
+    created_at: float
+    snippet: str
+
+
+def extract_hashtags(content: str) -> list[str]:
+    return list(dict.fromkeys(tag.lower() for tag in _HASHTAG_RE.findall(content)))
+
+
+def _fts_query(query: str) -> str:
+    """
+    Запрос пользователя → запрос FTS5: каждое слово в кавычках (никакого
+    синтаксиса FTS от пользователя) и с поиском по префиксу, чтобы «робот»
+    находил «роботы» и «роботами».
+    """
+    tokens = _QUERY_TOKEN_RE.findall(query)
+    return " ".join(f'"{token}"*' for token in tokens)
+
+
+class NoteIndex(SQLiteStore):
+    """
+    Локальный полнотекстовый индекс заметок (SQLite FTS5).
+
+    Заметка попадает в индекс сразу при постановке в outbox, а id заметки
+    в Mem.ai дописывается после отправки. Поиск не обращается к внешним API.
+    Id записи в индексе совпадает с id записи в outbox.
+    """
+
+    SCHEMA = _SCHEMA
+
+    def __init__(self, path: str | Path = SEARCH_DB_PATH) -> None:
+        super().__init__(path)
+
+    def add(self, item: OutboxItem, note_id: str | None = None) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO notes (id, note_id, source, chat_id, tags, content, created_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                item.id,
+                note_id,
+                item.source,
+                item.chat_id,
+                " ".join(extract_hashtags(item.content)),
+                item.content,
+                item.created_at,
+            ),
+        )
+
+    def set_note_id(self, item_id: int, note_id: str | None) -> None:
+        self._conn.execute("UPDATE notes SET note_id = ? WHERE id = ?", (note_id, item_id))
+
+    def note_id(self, item_id: int) -> str | None:
+        row = self._conn.execute("SELECT note_id FROM notes WHERE id = ?", (item_id,)).fetchone()
+        return row[0] if row else None
+
+    def owned_by(self, item_id: int, chat_id: int) -> bool:
+        row = self._conn.execute(
+            "SELECT 1 FROM notes WHERE id = ? AND chat_id = ?", (item_id, chat_id)
+        ).fetchone()
+        return row is not None
+
+    def count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+
+    def search(self, query: str, chat_id: int, limit: int = 5) -> list[SearchHit]:
+        """
+        Лучшие совпадения по BM25 среди заметок чата chat_id; совпадение
+        в тегах весит больше, чем в тексте.
+        """
+        fts_query = _fts_query(query)
+        if not fts_query:
+            return []
+        rows = self._conn.execute(
+            "SELECT n.id, n.note_id, n.source, n.created_at,"
+            " snippet(notes_fts, 0, '«', '»', '…', 16)"
+            " FROM notes_fts JOIN notes n ON n.id = notes_fts.rowid"
+            " WHERE notes_fts MATCH ? AND n.chat_id = ?"
+            " ORDER BY bm25(notes_fts, 1.0, 5.0) LIMIT ?",
+            (fts_query, chat_id, limit),
+        ).fetchall()
+        return [SearchHit(*row) for row in rows]
+
+    def rebuild(self, store: OutboxStore) -> int:
+        """
+        Дополняет индекс заметками из outbox, которых в нём нет (например,
+        сохранёнными до появления индекса), и пересобирает FTS-таблицу.
+        Outbox хранит отправленные заметки OUTBOX_RETENTION_DAYS, более
+        старые остаются в индексе как были. Возвращает число добавленных.
+        """
+        start = time.perf_counter()
+        db = self._conn
+        known = {row[0] for row in db.execute("SELECT id FROM notes")}
+        added = 0
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for item, note_id in store.iter_items():
+                if item.id in known:
+                    continue
+                self.add(item, note_id)
+                added += 1
+            db.execute("INSERT INTO notes_fts (notes_fts) VALUES ('rebuild')")
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        logger.info(
+            "Индекс заметок пересобран за %.2f с, добавлено %s", time.perf_counter() - start, added
+        )
+        return added
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import functools
+import logging
+import time
+from typing import Awaitable, Callable, Hashable
+
+from telegram import Message
+
+from .abacus_client import AbacusClient
+from .artifact_cache import PDF_KIND, ArtifactCache
+from .coalesce import MessageCoalescer
+from .config import (
+    IMPORT_DB_PATH,
+    LLM_CACHE_ENABLED,
+    OUTBOX_DB_PATH,
+    PHOTO_ALBUM_WINDOW_SECONDS,
+    WHISPER_PRELOAD,
+)
+from .importer import ImportCheckpoint, ImportManager
+from .llm_cache import LLMCache
+from .mem_client import MemClient
+from .outbox import NoteOutbox
+from .pdf_utils import PdfExtractor
+from .quotas import UserQuotas
+from .search_index import NoteIndex
+from .state import OutboxStore
+from .transcription import TranscriptionService
+
+logger = logging.getLogger(__name__)
+
+# Обработчик пачки сообщений, которому нужны сервисы: (services, ключ, сообщения)
+ProcessWithServices = Callable[["Services", Hashable, list[Message]], Awaitable[None]]
+
+
+class Services:
+    """
+    Клиенты и фоновые сервисы бота. Создаются при старте приложения
+    (а не при импорте модулей) и доступны хендлерам через
+    context.bot_data["services"].
+
+    Создание дешёвое: соединения, базы и процессы появляются в start()
+    или при первом обращении.
+    """
+
+    def __init__(self, process_texts: ProcessWithServices, process_album: ProcessWithServices) -> None:
+        self.abacus = AbacusClient(cache=LLMCache() if LLM_CACHE_ENABLED else None)
+        self.mem = MemClient()
+        self.note_index = NoteIndex()
+        self.outbox = NoteOutbox(OutboxStore(OUTBOX_DB_PATH), self.mem, index=self.note_index)
+        self.pdf_extractor = PdfExtractor()
+        self.transcription = TranscriptionService()
+        self.artifacts = ArtifactCache()
+        self.quotas = UserQuotas()
+        self.importer = ImportManager(
+            ImportCheckpoint(IMPORT_DB_PATH),
+            abacus=self.abacus,
+            extractor=self.pdf_extractor,
+            outbox=self.outbox,
+            artifacts=self.artifacts,
+            pdf_kind=PDF_KIND,
+        )
+        # Быстрые сообщения подряд склеиваются в одну заметку (TEXT_DEBOUNCE_SECONDS)
+        self.text_coalescer = MessageCoalescer(functools.partial(process_texts, self))
+        # Фото одного альбома приходят отдельными апдейтами почти одновременно
+        self.album_coalescer = MessageCoalescer(
+            functools.partial(process_album, self),
+            debounce=PHOTO_ALBUM_WINDOW_SECONDS,
+            # Больше 10 фото в альбоме Telegram не бывает
+            max_messages=10,
+        )
+
+    async def start(self, outbox_sender: bool = True) -> dict[str, float]:
+        """
+        Запускает сервисы; возвращает длительность каждого шага в секундах.
+
+        outbox_sender=False — заметки только пишутся в outbox, а отправляет
+        их в Mem.ai другой процесс (поллер при SHARD_WORKERS).
+        """
+        timings: dict[str, float] = {}
+
+        async def step(name: str, action: Awaitable[None]) -> None:
+            started = time.perf_counter()
+            await action
+            timings[name] = time.perf_counter() - started
+
+        # Один долгоживущий пул соединений на бэкенд вместо нового клиента на каждый запрос
+        await step("abacus", self.abacus.open())
+        await step("mem", self.mem.open())
+        if outbox_sender:
+            # Фоновая отправка заметок из локального outbox
+            await step("outbox", self.outbox.start())
+        if WHISPER_PRELOAD:
+            # Воркеры Whisper загружают модель сразу, а не при первом голосовом
+            await step("whisper", self.transcription.start())
+        return timings
+
+    async def stop(self) -> None:
+        # Накопленные тексты и альбомы обрабатываются до остановки outbox
+        await self.text_coalescer.stop()
+        await self.album_coalescer.stop()
+        # Импорт прерывается, недоделанные файлы остаются в чекпоинте до следующего /import
+        await self.importer.stop()
+        await self.outbox.stop()
+        self.pdf_extractor.shutdown()
+        await self.transcription.stop()
+        await self.abacus.aclose()
+        await self.mem.aclose()
+        self.artifacts.close()
+        self.quotas.close()
@@ -0,0 +1,471 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+from urllib.parse import unquote
+
+from telegram import Bot, Update
+from telegram.error import NetworkError, TelegramError, TimedOut
+from telegram.ext import BaseUpdateProcessor
+from telegram.request import BaseRequest, RequestData
+
+from .config import METRICS_PORT, SHARD_WORKERS, UPDATES_MAX_PENDING
+from .metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+SHARD_RESTARTS = Counter(
+    "bot_shard_restarts_total", "Перезапуски процессов-шардов после падения.", ["shard"]
+)
+
+_MONITOR_INTERVAL = 1.0
+# Пауза перед перезапуском шарда растёт при падениях подряд, но не дольше этого
+_MAX_RESTART_DELAY = 60.0
+# Сколько раз апдейт пересылается заново, если шард упал во время его обработки
+_MAX_DELIVERY_ATTEMPTS = 2
+# Сколько ждать, пока шард доработает принятые апдейты при остановке
+_STOP_TIMEOUT = 60.0
+# Таймауты Bot API, которые вызывающий не задавал явно
+_DEFAULT_TIMEOUT = "default"
+_ERRORS: dict[str, type[NetworkError]] = {"TimedOut": TimedOut, "NetworkError": NetworkError}
+
+
+class _ForwardedRequestData:
+    """
+    Тело запроса к Bot API, полученное от шарда: HTTPXRequest.do_request
+    читает из RequestData только эти два поля.
+    """
+
+    def __init__(self, json_parameters: dict[str, str], multipart_data: dict) -> None:
+        self.json_parameters = json_parameters
+        self.multipart_data = multipart_data
+
+
+class RemoteRequest(BaseRequest):
+    """
+    Запросы к Bot API из процесса-шарда: вместо HTTP уходят по IPC в
+    процесс-поллер, который выполняет их своим соединением с Telegram и
+    возвращает статус и тело ответа. Разбор ответа и ошибок остаётся за
+    BaseRequest, поэтому Bot в шарде работает как обычно.
+    """
+
+    def __init__(self, shard: int, send: Callable[[tuple], None]) -> None:
+        self.shard = shard
+        self._send = send
+        self._ids = itertools.count()
+        self._waiting: dict[int, asyncio.Future] = {}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    @property
+    def read_timeout(self) -> float | None:
+        return None
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: RequestData | None = None,
+        read_timeout=BaseRequest.DEFAULT_NONE,
+        write_timeout=BaseRequest.DEFAULT_NONE,
+        connect_timeout=BaseRequest.DEFAULT_NONE,
+        pool_timeout=BaseRequest.DEFAULT_NONE,
+    ) -> tuple[int, bytes]:
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[request_id] = future
+        timeouts = tuple(
+            _DEFAULT_TIMEOUT if t is BaseRequest.DEFAULT_NONE else t
+            for t in (read_timeout, write_timeout, connect_timeout, pool_timeout)
+        )
+        body = None
+        if request_data is not None:
+            body = (request_data.json_parameters, request_data.multipart_data)
+        self._send(("request", self.shard, (request_id, url, method, body, timeouts)))
+        try:
+            return await future
+        finally:
+            self._waiting.pop(request_id, None)
+
+    def on_response(self, request_id: int, response: tuple) -> None:
+        future = self._waiting.get(request_id)
+        if future is None or future.done():
+            return
+        kind, *value = response
+        if kind == "ok":
+            future.set_result(tuple(value))
+        else:
+            name, message = value
+            future.set_exception(_ERRORS.get(name, NetworkError)(message))
+
+
+async def _run_shard(shard: int, conn, base_url: str, base_file_url: str) -> None:
+    from telegram.ext import ApplicationBuilder
+
+    from .config import TELEGRAM_BOT_TOKEN
+    from .main import build_application, start_services, stop_services
+    from .metrics import MetricsServer
+
+    loop = asyncio.get_running_loop()
+    # В conn пишет только поток event loop, читает только pump
+    request = RemoteRequest(shard, conn.send)
+    builder = (
+        ApplicationBuilder()
+        .base_url(base_url)
+        .base_file_url(base_file_url)
+        .request(request)
+        .get_updates_request(request)
+        .updater(None)
+    )
+    application = build_application(TELEGRAM_BOT_TOKEN, builder)
+    # У каждого шарда свой эндпоинт метрик: METRICS_PORT + 1 + номер шарда
+    metrics = MetricsServer(port=METRICS_PORT + 1 + shard if METRICS_PORT else 0)
+    # Апдейты копятся здесь, пока приложение запускается (ответы на запросы идут сразу)
+    updates: asyncio.Queue[tuple[int, dict] | None] = asyncio.Queue()
+    tasks: set[asyncio.Task] = set()
+
+    async def process(update_id: int, data: dict) -> None:
+        try:
+            update = Update.de_json(data, application.bot)
+            await application.update_processor.process_update(
+                update, application.process_update(update)
+            )
+        finally:
+            conn.send(("done", shard, update_id))
+
+    def on_message(msg: tuple | None) -> None:
+        if msg is None:
+            updates.put_nowait(None)
+            return
+        kind, key, value = msg
+        if kind == "update":
+            updates.put_nowait((key, value))
+        else:
+            request.on_response(key, value)
+
+    def pump() -> None:
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                # Поллер завершился, не остановив шард: завершаемся сами
+                msg = None
+            loop.call_soon_threadsafe(on_message, msg)
+            if msg is None:
+                return
+
+    threading.Thread(target=pump, name=f"shard-{shard}-inbox", daemon=True).start()
+
+    await application.initialize()
+    services = await start_services(application, outbox_sender=False)
+    # Заметки отправляет в Mem.ai поллер: шард только будит его outbox
+    services.outbox.on_enqueue = lambda: conn.send(("outbox", shard, None))
+    await metrics.start()
+    await application.start()
+    conn.send(("ready", shard, multiprocessing.current_process().pid))
+    try:
+        # Задачи создаются в порядке поступления: PerChatUpdateProcessor сохранит порядок чата
+        while (item := await updates.get()) is not None:
+            task = application.create_task(process(*item))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        await application.stop()
+        # Накопленные тексты ещё обрабатываются: поллер продолжает отвечать на запросы
+        await stop_services(application)
+        await metrics.stop()
+        await application.shutdown()
+
+
+def _shard_entry(shard: int, conn, base_url: str, base_file_url: str) -> None:
+    # Своя группа процессов: если шард убит, поллер завершит и его воркеры Whisper/PDF,
+    # а Ctrl+C в терминале получает только поллер, который останавливает шарды сам
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+    asyncio.run(_run_shard(shard, conn, base_url, base_file_url))
+
+
+@dataclass
+class _Delivery:
+    data: dict
+    done: asyncio.Future
+    attempts: int = 1
+
+
+@dataclass
+class _Shard:
+    index: int
+    # Конец канала со стороны поллера; у каждого запуска шарда свой
+    conn: Any = None
+    process: multiprocessing.process.BaseProcess | None = None
+    ready: bool = False
+    failures: int = 0
+    restart_at: float = 0.0
+    # update_id -> апдейт, отправленный в шард и ещё не обработанный
+    inflight: dict[int, _Delivery] = field(default_factory=dict)
+
+
+class ShardedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Процесс-поллер: получает апдейты (getUpdates или webhook) и раздаёт их
+    N процессам-шардам, в которых работают хендлеры, Whisper и разбор PDF.
+    Так тяжёлая обработка использует несколько ядер, а не одно под GIL.
+
+    Все апдейты одного чата идут в один шард (chat_id % N) по порядку, а
+    внутри шарда PerChatUpdateProcessor сохраняет очерёдность. Запросы
+    шардов к Bot API выполняет поллер (см. RemoteRequest), так что с
+    Telegram общается один процесс. IPC — свой канал (multiprocessing.Pipe)
+    на каждый шард, без внешнего брокера: падение одного шарда не может
+    оставить захваченной блокировку общей очереди.
+
+    Упавший шард перезапускается (с растущей паузой при падениях подряд),
+    а апдейты, которые он не успел обработать, пересылаются ему заново.
+    """
+
+    def __init__(self, workers: int = SHARD_WORKERS, max_pending: int = UPDATES_MAX_PENDING) -> None:
+        self.max_pending = max_pending * workers
+        super().__init__(max_concurrent_updates=self.max_pending + workers)
+        self.workers = workers
+        self._ctx = multiprocessing.get_context("spawn")
+        self._shards: list[_Shard] = []
+        self._bot: Bot | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._monitor: asyncio.Task | None = None
+        self._requests: set[asyncio.Task] = set()
+        self.on_outbox: Callable[[], None] | None = None
+        self.rejected = 0
+
+    @property
+    def pending(self) -> int:
+        return sum(len(shard.inflight) for shard in self._shards)
+
+    def pending_by_shard(self) -> dict[int, int]:
+        return {shard.index: len(shard.inflight) for shard in self._shards}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def start(self, bot: Bot) -> None:
+        self._bot = bot
+        self._loop = asyncio.get_running_loop()
+        for index in range(self.workers):
+            shard = _Shard(index)
+            self._shards.append(shard)
+            self._spawn(shard)
+        self._monitor = asyncio.create_task(self._watch_shards(), name="shard-monitor")
+
+    async def stop(self) -> None:
+        """
+        Останавливает шарды, дав им доработать принятые апдейты. Bot поллера
+        должен быть ещё доступен: шарды отвечают пользователям через него.
+        """
+        if not self._shards:
+            return
+        if self._monitor is not None:
+            self._monitor.cancel()
+            self._monitor = None
+        for shard in self._shards:
+            self._send(shard, None)
+        for shard in self._shards:
+            if shard.process is None:
+                continue
+            await asyncio.to_thread(shard.process.join, _STOP_TIMEOUT)
+            if shard.process.is_alive():
+                logger.warning("Шард #%s не остановился за %.0f с", shard.index, _STOP_TIMEOUT)
+                shard.process.terminate()
+            for delivery in shard.inflight.values():
+                if not delivery.done.done():
+                    delivery.done.set_result(None)
+            shard.inflight.clear()
+        if self._requests:
+            await asyncio.gather(*self._requests, return_exceptions=True)
+        for shard in self._shards:
+            if shard.conn is not None:
+                shard.conn.close()
+        self._shards.clear()
+
+    @staticmethod
+    def _send(shard: _Shard, msg: tuple | None, conn=None) -> None:
+        conn = conn or shard.conn
+        if conn is None or conn is not shard.conn:
+            # Ответ адресован уже перезапущенному процессу шарда
+            return
+        try:
+            conn.send(msg)
+        except OSError:
+            # Шард упал: монитор перезапустит его и перешлёт необработанные апдейты
+            pass
+
+    def _spawn(self, shard: _Shard) -> None:
+        bot = self._bot
+        # Шард строит Bot с теми же адресами Bot API, токен добавляется к ним сам
+        base_url = bot.base_url.removesuffix(bot.token)
+        base_file_url = bot.base_file_url.removesuffix(bot.token)
+        if shard.conn is not None:
+            shard.conn.close()
+        shard.conn, child_conn = self._ctx.Pipe()
+        # Не демон: шард сам запускает процессы (Whisper, разбор PDF)
+        shard.process = self._ctx.Process(
+            target=_shard_entry,
+            args=(shard.index, child_conn, base_url, base_file_url),
+            name=f"shard-{shard.index}",
+        )
+        shard.process.start()
+        child_conn.close()
+        shard.ready = False
+        threading.Thread(
+            target=self._pump, args=(shard.conn,), name=f"shard-{shard.index}-results", daemon=True
+        ).start()
+        logger.info("Запущен шард #%s (pid %s)", shard.index, shard.process.pid)
+        # Апдейты, не обработанные упавшим процессом, — новому
+        for update_id, delivery in shard.inflight.items():
+            self._send(shard, ("update", update_id, delivery.data))
+
+    async def _watch_shards(self) -> None:
+        while True:
+            await asyncio.sleep(_MONITOR_INTERVAL)
+            now = self._loop.time()
+            for shard in self._shards:
+                if shard.process is not None and shard.process.is_alive():
+                    continue
+                if shard.process is not None:
+                    logger.error(
+                        "Шард #%s завершился (код %s), перезапускаю",
+                        shard.index, shard.process.exitcode,
+                    )
+                    SHARD_RESTARTS.inc(str(shard.index))
+                    self._kill_group(shard.process.pid)
+                    shard.failures = 0 if shard.ready else shard.failures + 1
+                    shard.restart_at = now + min(_MAX_RESTART_DELAY, 2 ** shard.failures - 1)
+                    shard.process = None
+                    self._drop_poisoned(shard)
+                if now >= shard.restart_at:
+                    self._spawn(shard)
+
+    @staticmethod
+    def _kill_group(pid: int) -> None:
+        # Дочерние процессы упавшего шарда остались бы сиротами
+        if hasattr(os, "killpg"):
+            try:
+                os.killpg(pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+
+    def _drop_poisoned(self, shard: _Shard) -> None:
+        for update_id, delivery in list(shard.inflight.items()):
+            delivery.attempts += 1
+            if delivery.attempts > _MAX_DELIVERY_ATTEMPTS:
+                logger.error("Апдейт %s уронил шард #%s, больше не пересылаю", update_id, shard.index)
+                del shard.inflight[update_id]
+                if not delivery.done.done():
+                    delivery.done.set_result(None)
+
+    def _pump(self, conn) -> None:
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                # Шард завершился (или канал закрыт при перезапуске)
+                return
+            self._loop.call_soon_threadsafe(self._on_result, conn, msg)
+
+    def _on_result(self, conn, msg: tuple) -> None:
+        kind, index, value = msg
+        if index >= len(self._shards) or self._shards[index].conn is not conn:
+            # Сообщение от процесса, который уже заменён новым
+            return
+        shard = self._shards[index]
+        if kind == "ready":
+            shard.ready = True
+            logger.info("Шард #%s готов (pid %s)", index, value)
+        elif kind == "done":
+            delivery = shard.inflight.pop(value, None)
+            if delivery is not None and not delivery.done.done():
+                delivery.done.set_result(None)
+        elif kind == "request":
+            task = asyncio.create_task(self._forward(shard, conn, *value))
+            self._requests.add(task)
+            task.add_done_callback(self._requests.discard)
+        elif kind == "outbox" and self.on_outbox is not None:
+            self.on_outbox()
+
+    async def _forward(
+        self,
+        shard: _Shard,
+        conn,
+        request_id: int,
+        url: str,
+        method: str,
+        body: tuple[dict, dict] | None,
+        timeouts: tuple,
+    ) -> None:
+        bot = self._bot
+        try:
+            if not unquote(url).startswith((bot.base_url, bot.base_file_url)):
+                raise NetworkError(f"шард запросил чужой адрес: {url}")
+            status, content = await bot.request.do_request(
+                url,
+                method,
+                _ForwardedRequestData(*body) if body is not None else None,
+                *(BaseRequest.DEFAULT_NONE if t == _DEFAULT_TIMEOUT else t for t in timeouts),
+            )
+            response = ("ok", status, content)
+        except TelegramError as e:
+            response = ("error", type(e).__name__, e.message)
+        except Exception as e:
+            response = ("error", "NetworkError", f"{type(e).__name__}: {e}")
+        self._send(shard, ("response", request_id, response), conn)
+
+    @staticmethod
+    def shard_key(update: object) -> int:
+        if isinstance(update, Update):
+            if update.effective_chat is not None:
+                return update.effective_chat.id
+            if update.effective_user is not None:
+                return update.effective_user.id
+        return 0
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        # Хендлеры поллера не нужны: апдейт целиком обрабатывает шард
+        if asyncio.iscoroutine(coroutine):
+            coroutine.close()
+        if not isinstance(update, Update):
+            return
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            if update.effective_message is not None:
+                try:
+                    await update.effective_message.reply_text(
+                        "Бот сейчас перегружен, отправь это сообщение чуть позже."
+                    )
+                except Exception as e:
+                    logger.warning("Не удалось отправить уведомление о загрузке: %s", e)
+            return
+
+        shard = self._shards[self.shard_key(update) % self.workers]
+        delivery = _Delivery(update.to_dict(), asyncio.get_running_loop().create_future())
+        shard.inflight[update.update_id] = delivery
+        if shard.process is not None:
+            self._send(shard, ("update", update.update_id, delivery.data))
+        # Ждём обработки: так поллер (и очередь webhook) не берёт больше, чем успевают шарды
+        await delivery.done
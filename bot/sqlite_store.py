@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import sqlite3
+from pathlib import Path
+
+
+class SQLiteStore:
+    """
+    База SQLite с ленивым подключением: WAL, автокоммит и схема из SCHEMA,
+    которая создаётся при первом обращении.
+    """
+
+    SCHEMA = ""
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self._db: sqlite3.Connection | None = None
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(str(self.path), isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(self.SCHEMA)
+            self._db = db
+            self._opened(db)
+        return self._db
+
+    def _opened(self, db: sqlite3.Connection) -> None:
+        """
+        Вызывается один раз после открытия базы и создания схемы.
+        """
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+class BoundedStore(SQLiteStore):
+    """
+    SQLiteStore, в котором суммарный размер записей таблицы TABLE (колонки
+    size и accessed_at) ограничен max_bytes: при превышении вытесняются
+    давно не читанные записи.
+
+    В один файл пишут все шарды, поэтому счётчик размера в процессе видит
+    только свои записи. Перед вытеснением и после каждых max_bytes / 10
+    своих записей размер пересчитывается по базе.
+    """
+
+    TABLE = ""
+
+    def __init__(self, path: str | Path, max_bytes: int) -> None:
+        super().__init__(path)
+        self.max_bytes = max_bytes
+        self._disk_bytes = 0
+        # Записано с последнего пересчёта размера по базе
+        self._unsynced = 0
+
+    def _opened(self, db: sqlite3.Connection) -> None:
+        self._disk_bytes = table_bytes(db, self.TABLE)
+
+    def _grew(self, delta: int, written: int) -> None:
+        self._disk_bytes += delta
+        self._unsynced += written
+        if self._disk_bytes > self.max_bytes or self._unsynced >= self.max_bytes // 10:
+            self._evict()
+
+    def _evict(self) -> None:
+        self._unsynced = 0
+        self._disk_bytes = evict_lru(self._conn, self.TABLE, self.max_bytes)
+
+
+def table_bytes(db: sqlite3.Connection, table: str) -> int:
+    return db.execute(f"SELECT COALESCE(SUM(size), 0) FROM {table}").fetchone()[0]
+
+
+def evict_lru(db: sqlite3.Connection, table: str, max_bytes: int) -> int:
+    """
+    Вытесняет из table (колонки size и accessed_at) давно не читанные
+    записи, если их суммарный размер по базе больше max_bytes, и
+    возвращает размер оставшихся, байт.
+    """
+    total = table_bytes(db, table)
+    if total <= max_bytes:
+        return total
+    # Освобождаем с запасом (до 90% лимита), чтобы не вытеснять на каждой записи
+    target = int(max_bytes * 0.9)
+    total = 0
+    cutoff = None
+    for size, accessed_at in db.execute(f"SELECT size, accessed_at FROM {table} ORDER BY accessed_at DESC"):
+        total += size
+        if total > target:
+            cutoff = accessed_at
+            break
+    if cutoff is not None:
+        db.execute(f"DELETE FROM {table} WHERE accessed_at <= ?", (cutoff,))
+    return table_bytes(db, table)
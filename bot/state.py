@@ -1,15 +1,175 @@
 from __future__ import annotations
 
+import time
+import uuid
 from dataclasses import dataclass
+from typing import Iterator
+
+from .sqlite_store import SQLiteStore
+
+
+STATUS_PENDING = "pending"
+STATUS_SENDING = "sending"
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
 
 
 @dataclass
-class PendingNote:
-    note_id: str
-    original_content: str
+class OutboxItem:
+    id: int
+    idempotency_key: str
+    content: str
+    source: str
+    chat_id: int | None
+    attempts: int
+    created_at: float
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    content TEXT NOT NULL,
+    source TEXT NOT NULL,
+    chat_id INTEGER,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    note_id TEXT,
+    created_at REAL NOT NULL,
+    sent_at REAL
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+"""
+
+_ITEM_COLUMNS = "id, idempotency_key, content, source, chat_id, attempts, created_at"
+
+
+class OutboxStore(SQLiteStore):
+    """
+    Персистентная очередь заметок для Mem.ai (SQLite).
+
+    Хендлеры кладут сюда заметки и сразу отвечают пользователю, а фоновый
+    воркер (см. outbox.py) забирает их и отправляет. Отправленные записи
+    хранятся ещё OUTBOX_RETENTION_DAYS, поэтому переживают рестарт.
+    """
+
+    SCHEMA = _SCHEMA
+
+    def enqueue(
+        self,
+        content: str,
+        *,
+        source: str,
+        chat_id: int | None = None,
+    ) -> OutboxItem:
+        now = time.time()
+        key = uuid.uuid4().hex
+        cur = self._conn.execute(
+            "INSERT INTO outbox (idempotency_key, content, source, chat_id,"
+            " status, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, content, source, chat_id, STATUS_PENDING, now, now),
+        )
+        return OutboxItem(
+            id=int(cur.lastrowid),
+            idempotency_key=key,
+            content=content,
+            source=source,
+            chat_id=chat_id,
+            attempts=0,
+            created_at=now,
+        )
+
+    def claim_due(self, limit: int, now: float | None = None) -> list[OutboxItem]:
+        """
+        Забирает до limit готовых к отправке записей и помечает их как отправляемые.
+
+        Записи разных чатов чередуются (первая каждого чата, затем вторая и т.д.),
+        поэтому сотни заметок импорта одного пользователя не задерживают
+        заметку другого на несколько пачек.
+        """
+        now = time.time() if now is None else now
+        db = self._conn
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            rows = db.execute(
+                f"SELECT {_ITEM_COLUMNS} FROM ("
+                f" SELECT {_ITEM_COLUMNS}, next_attempt_at,"
+                "  ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY next_attempt_at, id) AS turn"
+                "  FROM outbox WHERE status = ? AND next_attempt_at <= ?"
+                ") ORDER BY turn, next_attempt_at, id LIMIT ?",
+                (STATUS_PENDING, now, limit),
+            ).fetchall()
+            db.executemany(
+                "UPDATE outbox SET status = ? WHERE id = ?",
+                [(STATUS_SENDING, row[0]) for row in rows],
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return [OutboxItem(*row) for row in rows]
+
+    def mark_sent(self, item_id: int, note_id: str | None) -> None:
+        self._conn.execute(
+            "UPDATE outbox SET status = ?, note_id = ?, sent_at = ?, last_error = NULL"
+            " WHERE id = ?",
+            (STATUS_SENT, note_id, time.time(), item_id),
+        )
+
+    def mark_retry(self, item_id: int, error: str, delay: float, attempted: bool = True) -> None:
+        """
+        attempted=False — запрос не отправлялся (предохранитель разомкнут),
+        и счётчик попыток не растёт.
+        """
+        self._conn.execute(
+            "UPDATE outbox SET status = ?, attempts = attempts + ?,"
+            " next_attempt_at = ?, last_error = ? WHERE id = ?",
+            (STATUS_PENDING, int(attempted), time.time() + delay, error, item_id),
+        )
+
+    def mark_failed(self, item_id: int, error: str) -> None:
+        self._conn.execute(
+            "UPDATE outbox SET status = ?, attempts = attempts + 1, last_error = ?"
+            " WHERE id = ?",
+            (STATUS_FAILED, error, item_id),
+        )
+
+    def reset_inflight(self) -> int:
+        """
+        Возвращает в очередь записи, отправка которых прервалась (падение, рестарт).
+        """
+        cur = self._conn.execute(
+            "UPDATE outbox SET status = ? WHERE status = ?",
+            (STATUS_PENDING, STATUS_SENDING),
+        )
+        return cur.rowcount
 
+    def next_due_at(self) -> float | None:
+        row = self._conn.execute(
+            "SELECT MIN(next_attempt_at) FROM outbox WHERE status = ?",
+            (STATUS_PENDING,),
+        ).fetchone()
+        return row[0] if row else None
 
-# Простейшее in‑memory состояние: user_id -> PendingNote
-USER_PENDING_NOTES: dict[int, PendingNote] = {}
+    def count_by_status(self) -> dict[str, int]:
+        rows = self._conn.execute(
+            "SELECT status, COUNT(*) FROM outbox GROUP BY status"
+        ).fetchall()
+        return {status: count for status, count in rows}
 
+    def iter_items(self) -> Iterator[tuple[OutboxItem, str | None]]:
+        """
+        Все записи outbox (с id заметки в Mem.ai, если уже отправлены) — для пересборки индекса.
+        """
+        cursor = self._conn.execute(f"SELECT {_ITEM_COLUMNS}, note_id FROM outbox ORDER BY id")
+        for row in cursor:
+            yield OutboxItem(*row[:-1]), row[-1]
 
+    def prune_sent(self, older_than: float) -> int:
+        cur = self._conn.execute(
+            "DELETE FROM outbox WHERE status = ? AND sent_at < ?",
+            (STATUS_SENT, older_than),
+        )
+        return cur.rowcount
@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import re
+from typing import TYPE_CHECKING, Callable
+
+from .abacus_client import CHARS_PER_TOKEN, AbacusClient, collect_stream
+from .config import ABACUS_MODEL, PDF_CHUNK_TOKENS, PDF_SUMMARY_CONCURRENCY
+
+if TYPE_CHECKING:
+    from .artifact_cache import ArtifactCache
+
+# (готово частей, всего частей)
+SummaryProgress = Callable[[int, int], None]
+
+# Строки, похожие на заголовки разделов: «1.2 Методы», «Глава 3», «ABSTRACT»
+_SECTION_RE = re.compile(
+    r"\n(?=(?:\d+(?:\.\d+)*\.?\s+\S|(?:глава|раздел|chapter|section)\s+\d|[A-ZА-ЯЁ][A-ZА-ЯЁ \-]{3,}\n))",
+    re.IGNORECASE,
+)
+
+
+def _split_oversized(text: str, max_chars: int) -> list[str]:
+    """
+    Делит слишком длинную страницу: сначала по заголовкам разделов,
+    затем по абзацам, и только в крайнем случае — по длине.
+    """
+    pieces: list[str] = []
+    for pattern in (_SECTION_RE, re.compile(r"\n\s*\n"), re.compile(r"\n")):
+        parts = [p for p in pattern.split(text) if p.strip()]
+        if len(parts) > 1:
+            for part in parts:
+                if len(part) > max_chars:
+                    pieces.extend(_split_oversized(part, max_chars))
+                else:
+                    pieces.append(part)
+            return pieces
+    return [text[i : i + max_chars] for i in range(0, len(text), max_chars)]
+
+
+def split_into_chunks(pages: list[str], max_tokens: int = PDF_CHUNK_TOKENS) -> list[str]:
+    """
+    Собирает страницы в части, каждая из которых укладывается в max_tokens.
+    Границы частей проходят по границам страниц (или разделов внутри страницы).
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    chunks: list[str] = []
+    current: list[str] = []
+    current_len = 0
+
+    for page in pages:
+        units = _split_oversized(page, max_chars) if len(page) > max_chars else [page]
+        for unit in units:
+            if current and current_len + len(unit) + 2 > max_chars:
+                chunks.append("\n\n".join(current))
+                current, current_len = [], 0
+            current.append(unit)
+            current_len += len(unit) + 2
+
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+class ChunkCheckpoint:
+    """
+    Готовые конспекты частей одного документа в кэше артефактов.
+
+    Не зависит от LLMCache: если одна часть упала, повторная попытка
+    (в том числе с /force) не пересчитывает уже законспектированные.
+    После успешной суммаризации запись удаляется, поэтому следующий
+    /force считает документ заново.
+    """
+
+    def __init__(self, artifacts: ArtifactCache, doc_key: str, target_lang: str) -> None:
+        self.artifacts = artifacts
+        self.doc_key = doc_key
+        self.kind = f"pdf_chunks:{ABACUS_MODEL}:{PDF_CHUNK_TOKENS}:{target_lang}"
+        artifact = artifacts.get(doc_key, self.kind)
+        # sha1 текста части -> конспект
+        self._done: dict[str, str] = json.loads(artifact.value) if artifact else {}
+
+    @staticmethod
+    def _key(chunk: str) -> str:
+        return hashlib.sha1(chunk.encode("utf-8")).hexdigest()
+
+    def get(self, chunk: str) -> str | None:
+        return self._done.get(self._key(chunk))
+
+    def put(self, chunk: str, summary: str) -> None:
+        self._done[self._key(chunk)] = summary
+        self.artifacts.put(self.doc_key, self.kind, json.dumps(self._done, ensure_ascii=False))
+
+    def clear(self) -> None:
+        self._done.clear()
+        self.artifacts.delete(self.doc_key, self.kind)
+
+
+def _group_by_budget(items: list[str], max_chars: int) -> list[list[str]]:
+    groups: list[list[str]] = []
+    current: list[str] = []
+    current_len = 0
+    for item in items:
+        if current and current_len + len(item) > max_chars:
+            groups.append(current)
+            current, current_len = [], 0
+        current.append(item)
+        current_len += len(item)
+    if current:
+        groups.append(current)
+    return groups
+
+
+async def summarize_document(
+    client: AbacusClient,
+    pages: list[str],
+    target_lang: str = "ru",
+    *,
+    max_tokens: int = PDF_CHUNK_TOKENS,
+    concurrency: int = PDF_SUMMARY_CONCURRENCY,
+    on_progress: SummaryProgress | None = None,
+    on_partial: Callable[[str], None] | None = None,
+    use_cache: bool = True,
+    checkpoint: ChunkCheckpoint | None = None,
+) -> str:
+    """
+    Иерархическая (map-reduce) суммаризация длинного документа.
+
+    Короткий документ уходит в LLM одним запросом. Длинный делится на части
+    по бюджету токенов, части конспектируются параллельно (не более
+    concurrency запросов одновременно), а конспекты сводятся в одну заметку;
+    если и они не помещаются в бюджет, сведение повторяется уровнем выше.
+
+    Готовые конспекты частей сохраняются в checkpoint (если передан),
+    поэтому повторная попытка после сбоя не пересчитывает уже обработанные
+    части — даже без LLMCache и с use_cache=False.
+
+    Если передан on_partial, итоговый запрос выполняется потоково
+    и on_partial получает накопленный текст итоговой заметки.
+    """
+    chunks = split_into_chunks(pages, max_tokens)
+    if len(chunks) <= 1:
+        text = chunks[0] if chunks else ""
+        if on_partial is not None:
+            return await collect_stream(
+                client.summarize_pdf_stream(text, target_lang=target_lang, use_cache=use_cache),
+                on_partial,
+            )
+        return await client.summarize_pdf(text, target_lang=target_lang, use_cache=use_cache)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    done = 0
+
+    async def run(part: int, chunk: str) -> str:
+        nonlocal done
+        summary = checkpoint.get(chunk) if checkpoint is not None else None
+        if summary is None:
+            async with semaphore:
+                summary = await client.summarize_pdf_chunk(
+                    chunk, part, len(chunks), target_lang=target_lang, use_cache=use_cache
+                )
+            if checkpoint is not None:
+                checkpoint.put(chunk, summary)
+        done += 1
+        if on_progress is not None:
+            on_progress(done, len(chunks))
+        return summary
+
+    summaries = list(
+        await asyncio.gather(*(run(i, chunk) for i, chunk in enumerate(chunks, start=1)))
+    )
+
+    # Если конспекты всё ещё не помещаются в бюджет, сводим их группами ещё раз
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    while sum(len(s) for s in summaries) > max_chars:
+        groups = _group_by_budget(summaries, max_chars)
+        if len(groups) >= len(summaries):
+            break
+
+        async def merge(group: list[str]) -> str:
+            async with semaphore:
+                return await client.merge_summaries(
+                    group, target_lang=target_lang, use_cache=use_cache
+                )
+
+        summaries = list(await asyncio.gather(*(merge(group) for group in groups)))
+
+    if on_partial is not None:
+        result = await collect_stream(
+            client.merge_summaries_stream(summaries, target_lang=target_lang, use_cache=use_cache),
+            on_partial,
+        )
+    else:
+        result = await client.merge_summaries(summaries, target_lang=target_lang, use_cache=use_cache)
+    if checkpoint is not None:
+        checkpoint.clear()
+    return result
@@ -1,8 +1,23 @@
 from __future__ import annotations
 
 import json
+import logging
+import os
+import tempfile
+import threading
+from collections import deque
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Iterator
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - не POSIX
+    fcntl = None  # type: ignore[assignment]
+
+from .config import AUTO_TAGS_ENABLED
+
+logger = logging.getLogger(__name__)
 
 
 # Базовые (вшитые) теги
@@ -20,22 +35,183 @@ BUILTIN_TAGS: Dict[str, str] = {
 _TAGS_FILE = Path(__file__).with_name("tags_store.json")
 
 
-def _load_user_tags() -> Dict[str, str]:
-    if not _TAGS_FILE.exists():
-        return {}
-    try:
-        data = json.loads(_TAGS_FILE.read_text(encoding="utf-8"))
-        if not isinstance(data, dict):
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+class TagMatcher:
+    """
+    Поиск всех известных тегов в тексте за один проход (алгоритм Ахо — Корасик).
+
+    Время поиска линейно по длине текста и не зависит от числа тегов.
+    Совпадение засчитывается только целым словом: тег "ai" не найдётся в "again".
+    """
+
+    def __init__(self, names: list[str]) -> None:
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list[str]] = [[]]
+        for name in names:
+            self._add(name)
+        self._build()
+
+    def _add(self, name: str) -> None:
+        state = 0
+        for ch in name.lower():
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        if name:
+            self._out[state].append(name)
+
+    def _build(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                # У детей корня суффиксная ссылка всегда ведёт в корень
+                self._fail[nxt] = 0 if target == nxt else target
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find(self, text: str) -> list[str]:
+        """
+        Теги, встречающиеся в text целым словом, в порядке первого появления.
+        """
+        found: dict[str, None] = {}
+        goto, fail, out = self._goto, self._fail, self._out
+        lowered = text.lower()
+        size = len(lowered)
+        state = 0
+        for end, ch in enumerate(lowered):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if not out[state]:
+                continue
+            if end + 1 < size and _is_word_char(lowered[end + 1]):
+                continue
+            for name in out[state]:
+                start = end + 1 - len(name)
+                if start == 0 or not _is_word_char(lowered[start - 1]):
+                    found.setdefault(name, None)
+        return list(found)
+
+
+class TagRegistry:
+    """
+    Встроенные и пользовательские теги с кэшем в памяти.
+
+    Файл перечитывается только при изменении mtime/размера, запись идёт
+    через временный файл и rename под блокировкой (потоковой и fcntl
+    между процессами), поэтому одновременные /addtag не теряют изменения.
+    """
+
+    def __init__(self, path: Path = _TAGS_FILE) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._signature: tuple[int, int] | None = None
+        self._tags: Dict[str, str] = {}
+        self._matcher: TagMatcher | None = None
+        self._loaded = False
+
+    def _stat_signature(self) -> tuple[int, int] | None:
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _read_user_tags(self) -> Dict[str, str]:
+        if not self.path.exists():
+            return {}
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            if not isinstance(data, dict):
+                return {}
+            # Принудительно приводим ключи/значения к str
+            return {str(k): str(v) for k, v in data.items()}
+        except Exception as e:
+            # В случае любой ошибки просто игнорируем пользовательский файл
+            logger.warning("Не удалось прочитать %s: %s", self.path, e)
             return {}
-        # Принудительно приводим ключи/значения к str
-        return {str(k): str(v) for k, v in data.items()}
-    except Exception:
-        # В случае любой ошибки просто игнорируем пользовательский файл
-        return {}
 
+    def _apply(self, user_tags: Dict[str, str], signature: tuple[int, int] | None) -> None:
+        tags = dict(BUILTIN_TAGS)
+        tags.update(user_tags)
+        # Сортировка по имени тега для красивого вывода
+        self._tags = dict(sorted(tags.items(), key=lambda item: item[0]))
+        self._signature = signature
+        self._matcher = None
+        self._loaded = True
+
+    def _refresh(self) -> None:
+        signature = self._stat_signature()
+        if self._loaded and signature == self._signature:
+            return
+        with self._lock:
+            signature = self._stat_signature()
+            if not self._loaded or signature != self._signature:
+                self._apply(self._read_user_tags(), signature)
+
+    def all(self) -> Dict[str, str]:
+        self._refresh()
+        return self._tags
+
+    def matcher(self) -> TagMatcher:
+        self._refresh()
+        matcher = self._matcher
+        if matcher is None:
+            matcher = self._matcher = TagMatcher(list(self._tags))
+        return matcher
 
-def _save_user_tags(tags: Dict[str, str]) -> None:
-    _TAGS_FILE.write_text(json.dumps(tags, ensure_ascii=False, indent=2), encoding="utf-8")
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            lock_path = self.path.with_name(self.path.name + ".lock")
+            with open(lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def set(self, name: str, description: str) -> None:
+        with self._file_lock():
+            # Читаем свежую версию под блокировкой: файл мог изменить другой процесс
+            user_tags = self._read_user_tags()
+            user_tags[name] = description
+            fd, tmp_name = tempfile.mkstemp(
+                prefix=self.path.name + ".", suffix=".tmp", dir=self.path.parent
+            )
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as tmp:
+                    json.dump(user_tags, tmp, ensure_ascii=False, indent=2)
+                    tmp.flush()
+                    os.fsync(tmp.fileno())
+                os.replace(tmp_name, self.path)
+            except BaseException:
+                try:
+                    os.unlink(tmp_name)
+                except FileNotFoundError:
+                    pass
+                raise
+            self._apply(user_tags, self._stat_signature())
+
+
+registry = TagRegistry()
 
 
 def get_all_tags() -> Dict[str, str]:
@@ -43,10 +219,7 @@ def get_all_tags() -> Dict[str, str]:
     Объединённый словарь встроенных и пользовательских тегов.
     Пользовательские теги могут переопределять встроенные описания.
     """
-    tags = dict(BUILTIN_TAGS)
-    tags.update(_load_user_tags())
-    # Сортировка по имени тега для красивого вывода
-    return dict(sorted(tags.items(), key=lambda item: item[0]))
+    return dict(registry.all())
 
 
 def add_or_update_tag(name: str, description: str) -> None:
@@ -57,9 +230,28 @@ def add_or_update_tag(name: str, description: str) -> None:
     if not name:
         return
 
-    user_tags = _load_user_tags()
-    user_tags[name] = description.strip()
-    _save_user_tags(user_tags)
+    registry.set(name, description.strip())
+
+
+def find_tags(text: str) -> list[str]:
+    """
+    Известные теги, которые встречаются в тексте словом или хэштегом.
+    """
+    return registry.matcher().find(text)
+
+
+def auto_tag(text: str) -> str:
+    """
+    Дописывает в конец заметки хэштеги известных тегов, упомянутых в тексте,
+    если их там ещё нет в виде #тега.
+    """
+    if not AUTO_TAGS_ENABLED or not text:
+        return text
+    lowered = text.lower()
+    missing = [name for name in find_tags(text) if f"#{name.lower()}" not in lowered]
+    if not missing:
+        return text
+    return text.rstrip() + "\n\n" + " ".join(f"#{name}" for name in missing)
 
 
 def format_tags_help() -> str:
@@ -68,5 +260,3 @@ def format_tags_help() -> str:
     for tag, desc in tags.items():
         lines.append(f"- #{tag} — {desc}")
     return "\n".join(lines)
-
-
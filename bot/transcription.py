@@ -0,0 +1,331 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable
+
+from .config import WHISPER_QUEUE_SIZE, WHISPER_WORKERS
+from .metrics import Counter
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+WHISPER_MODEL_EVENTS = Counter(
+    "bot_whisper_model_events_total",
+    "Загрузки, выгрузки и вытеснения моделей Whisper, перераспознавания большой моделью.",
+    ["event", "model"],
+)
+
+# Сколько задач стоит перед текущей (0 — уже распознаётся)
+QueueCallback = Callable[[int], None]
+# (номер куска записи, распознанный текст)
+SegmentCallback = Callable[[int, str], None]
+
+_MONITOR_INTERVAL = 5.0
+# Сколько раз подряд воркер может упасть, не успев загрузить модель, до отказа от перезапусков
+_MAX_STARTUP_FAILURES = 3
+# Сколько задача может не назначаться воркеру при свободном воркере, прежде чем считаться потерянной
+_LOST_JOB_SECONDS = 15.0
+
+
+class TranscriptionError(RuntimeError):
+    pass
+
+
+class TranscriptionQueueFull(TranscriptionError):
+    pass
+
+
+@dataclass
+class _Job:
+    future: asyncio.Future
+    on_queued: QueueCallback | None
+    worker_id: int | None = None
+    last_position: int | None = None
+    # С какого момента задача ждёт в очереди, хотя есть свободный воркер
+    stalled_since: float | None = None
+
+
+def _worker_entry(*args) -> None:
+    # whisper/torch импортируются только в процессе-воркере, не в основном процессе бота
+    from .voice_utils import worker_main
+
+    worker_main(*args)
+
+
+class TranscriptionService:
+    """
+    Пул процессов для Whisper: у каждого воркера своя модель, загруженная
+    при старте бота (или при первой задаче, если сервис не запущен заранее).
+    Задачи идут через общую очередь, число принятых заявок (записей)
+    ограничено queue_size, а вызывающий получает свою позицию в очереди.
+    """
+
+    def __init__(self, workers: int = WHISPER_WORKERS, queue_size: int = WHISPER_QUEUE_SIZE) -> None:
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self._ctx = multiprocessing.get_context("spawn")
+        self._jobs_q = None
+        self._results_q = None
+        self._processes: dict[int, multiprocessing.process.BaseProcess] = {}
+        self._ready: set[int] = set()
+        self._startup_failures: dict[int, int] = {}
+        # Память под модели Whisper в каждом воркере, байт
+        self.resident_bytes: dict[int, int] = {}
+        # Порядок вставки = порядок постановки в очередь
+        self._jobs: OrderedDict[str, _Job] = OrderedDict()
+        # Заявки (записи) в работе: длинная запись — одна заявка на все куски
+        self._requests = 0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._pump: threading.Thread | None = None
+        self._monitor: asyncio.Task | None = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._jobs)
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._jobs_q = self._ctx.Queue()
+        self._results_q = self._ctx.Queue()
+        self._pump = threading.Thread(target=self._pump_results, name="whisper-results", daemon=True)
+        self._pump.start()
+        for worker_id in range(self.workers):
+            self._spawn(worker_id)
+        self._monitor = asyncio.create_task(self._watch_workers(), name="whisper-monitor")
+
+    @property
+    def started(self) -> bool:
+        return self._jobs_q is not None
+
+    async def stop(self) -> None:
+        if not self.started:
+            return
+        if self._monitor is not None:
+            self._monitor.cancel()
+            self._monitor = None
+        # Не ждём, пока невостребованные задачи (аудио) будут дописаны в очередь
+        self._jobs_q.cancel_join_thread()
+        for _ in self._processes:
+            self._jobs_q.put(None)
+        for process in self._processes.values():
+            await asyncio.to_thread(process.join, 5)
+            if process.is_alive():
+                process.terminate()
+        self._processes.clear()
+        for job in self._jobs.values():
+            if not job.future.done():
+                job.future.set_exception(TranscriptionError("сервис транскрибации остановлен"))
+        self._jobs.clear()
+        if self._results_q is not None:
+            self._results_q.put(None)
+
+    def _spawn(self, worker_id: int) -> None:
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+        process = self._ctx.Process(
+            target=_worker_entry,
+            args=(worker_id, threads, self._jobs_q, self._results_q),
+            name=f"whisper-{worker_id}",
+            daemon=True,
+        )
+        process.start()
+        self._processes[worker_id] = process
+        self._ready.discard(worker_id)
+        self.resident_bytes[worker_id] = 0
+        logger.info("Запущен воркер Whisper #%s (pid %s)", worker_id, process.pid)
+
+    async def _watch_workers(self) -> None:
+        while True:
+            await asyncio.sleep(_MONITOR_INTERVAL)
+            for worker_id, process in list(self._processes.items()):
+                if process.is_alive():
+                    continue
+                for job in self._jobs.values():
+                    if job.worker_id == worker_id and not job.future.done():
+                        job.future.set_exception(TranscriptionError("воркер транскрибации упал"))
+
+                if worker_id in self._ready:
+                    self._startup_failures[worker_id] = 0
+                else:
+                    self._startup_failures[worker_id] = self._startup_failures.get(worker_id, 0) + 1
+                if self._startup_failures[worker_id] >= _MAX_STARTUP_FAILURES:
+                    logger.error(
+                        "Воркер Whisper #%s не смог запуститься %s раз подряд, больше не перезапускаю",
+                        worker_id, _MAX_STARTUP_FAILURES,
+                    )
+                    del self._processes[worker_id]
+                    self._ready.discard(worker_id)
+                    self.resident_bytes.pop(worker_id, None)
+                    continue
+
+                logger.error(
+                    "Воркер Whisper #%s завершился (код %s), перезапускаю",
+                    worker_id, process.exitcode,
+                )
+                self._spawn(worker_id)
+
+            if not self._processes:
+                for job in self._jobs.values():
+                    if not job.future.done():
+                        job.future.set_exception(TranscriptionError("Whisper недоступен"))
+            self._fail_lost_jobs()
+
+    def _fail_lost_jobs(self) -> None:
+        """
+        Воркер может упасть, уже взяв задачу из очереди, но до того, как его
+        ("started", …) дошло до нас: задача так и висела бы «в очереди». Пока
+        есть свободный готовый воркер, очередь пуста, поэтому задача, которую
+        всё это время никто не взял, потеряна.
+        """
+        busy = {job.worker_id for job in self._jobs.values() if job.worker_id is not None}
+        idle = bool(self._ready - busy)
+        now = time.monotonic()
+        for job in self._jobs.values():
+            if job.worker_id is not None or job.future.done() or not idle:
+                job.stalled_since = None
+            elif job.stalled_since is None:
+                job.stalled_since = now
+            elif now - job.stalled_since >= _LOST_JOB_SECONDS:
+                job.future.set_exception(TranscriptionError("воркер транскрибации упал"))
+
+    def _pump_results(self) -> None:
+        while True:
+            msg = self._results_q.get()
+            if msg is None:
+                return
+            self._loop.call_soon_threadsafe(self._on_result, msg)
+
+    def _on_result(self, msg: tuple) -> None:
+        kind, key, value = msg
+        if kind == "ready":
+            self._ready.add(key)
+            logger.info("Воркер Whisper #%s готов (pid %s)", key, value)
+            return
+        if kind == "model":
+            event, model, resident = value
+            WHISPER_MODEL_EVENTS.inc(event, model)
+            if key in self._processes:
+                self.resident_bytes[key] = resident
+            return
+        if kind == "started":
+            job = self._jobs.get(value)
+            if job is not None:
+                job.worker_id = key
+            self._report_positions()
+            return
+
+        job = self._jobs.pop(key, None)
+        if job is None or job.future.done():
+            return
+        if kind == "done":
+            job.future.set_result(value)
+        else:
+            job.future.set_exception(TranscriptionError(value))
+
+    def _report_positions(self) -> None:
+        busy = sum(1 for j in self._jobs.values() if j.worker_id is not None)
+        free = max(0, len(self._ready) - busy)
+        position = 0
+        for job in self._jobs.values():
+            if job.worker_id is not None:
+                current = 0
+            else:
+                position += 1
+                # Задачу вот-вот заберёт свободный воркер — не сообщаем о мнимой очереди
+                if position <= free:
+                    continue
+                current = position - free
+            if job.on_queued is not None and current != job.last_position:
+                job.last_position = current
+                job.on_queued(current)
+
+    def _submit(self, audio: str | np.ndarray, on_queued: QueueCallback | None) -> str:
+        job_id = uuid.uuid4().hex
+        job = _Job(future=asyncio.get_running_loop().create_future(), on_queued=on_queued)
+        self._jobs[job_id] = job
+        self._jobs_q.put((job_id, audio))
+        return job_id
+
+    async def _check_admission(self) -> None:
+        if not self.started:
+            await self.start()
+        if not self._processes:
+            raise TranscriptionError("Whisper недоступен")
+        if self._requests >= self.queue_size:
+            raise TranscriptionQueueFull("очередь на распознавание переполнена")
+        self._requests += 1
+
+    async def _wait(self, job_id: str) -> str:
+        try:
+            return await self._jobs[job_id].future
+        finally:
+            self._jobs.pop(job_id, None)
+
+    async def transcribe(
+        self, audio: str | np.ndarray, on_queued: QueueCallback | None = None
+    ) -> str:
+        """
+        Поставить аудио (путь к файлу или PCM 16 кГц) в очередь и дождаться текста.
+        """
+        await self._check_admission()
+        try:
+            job_id = self._submit(audio, on_queued)
+            self._report_positions()
+            return await self._wait(job_id)
+        finally:
+            self._requests -= 1
+
+    async def transcribe_segments(
+        self,
+        segments: list[np.ndarray],
+        on_segment: SegmentCallback | None = None,
+        on_queued: QueueCallback | None = None,
+    ) -> list[str]:
+        """
+        Распознать куски одной длинной записи параллельно на всех воркерах.
+
+        on_segment(index, text) вызывается по мере готовности каждого куска
+        (не обязательно по порядку). Вся запись считается одной заявкой
+        при проверке переполнения очереди.
+        """
+        await self._check_admission()
+        try:
+            return await self._run_segments(segments, on_segment, on_queued)
+        finally:
+            self._requests -= 1
+
+    async def _run_segments(
+        self,
+        segments: list[np.ndarray],
+        on_segment: SegmentCallback | None,
+        on_queued: QueueCallback | None,
+    ) -> list[str]:
+        # О позиции в очереди сообщаем по первому куску
+        job_ids = [
+            self._submit(segment, on_queued if index == 0 else None)
+            for index, segment in enumerate(segments)
+        ]
+        self._report_positions()
+
+        async def wait_one(index: int, job_id: str) -> str:
+            text = await self._wait(job_id)
+            if on_segment is not None:
+                on_segment(index, text)
+            return text
+
+        tasks = [asyncio.ensure_future(wait_one(i, job_id)) for i, job_id in enumerate(job_ids)]
+        try:
+            return list(await asyncio.gather(*tasks))
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
@@ -1,59 +1,333 @@
 from __future__ import annotations
 
-import asyncio
+import abc
+import gc
 import logging
+import os
+import queue
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
 from pathlib import Path
+from typing import TYPE_CHECKING, Any
 
-import whisper
+from .config import (
+    WHISPER_BACKEND,
+    WHISPER_COMPUTE_TYPE,
+    WHISPER_FALLBACK_IDLE_SECONDS,
+    WHISPER_FALLBACK_LOGPROB,
+    WHISPER_FALLBACK_MODEL,
+    WHISPER_IDLE_UNLOAD_SECONDS,
+    WHISPER_LANGUAGE,
+    WHISPER_MEMORY_BUDGET_MB,
+    WHISPER_MODEL,
+)
+
+if TYPE_CHECKING:
+    import numpy as np
 
 logger = logging.getLogger(__name__)
 
-# Кэш для модели Whisper (загружается один раз)
-_whisper_model: whisper.Whisper | None = None
-_whisper_model_name = "base"  # Можно использовать "tiny", "base", "small", "medium", "large"
+# Примерное число параметров моделей Whisper: оценка памяти до загрузки
+_MODEL_PARAMS = {
+    "tiny": 39_000_000,
+    "base": 74_000_000,
+    "small": 244_000_000,
+    "medium": 769_000_000,
+    "large": 1_550_000_000,
+    "turbo": 809_000_000,
+}
+# Байт на параметр для типов вычислений CTranslate2
+_COMPUTE_TYPE_BYTES = {"int8": 1, "int8_float32": 1, "int8_float16": 1, "float16": 2, "float32": 4}
+# Как часто воркер без задач проверяет, не пора ли выгрузить модели
+_IDLE_CHECK_INTERVAL = 30.0
+
+
+def _estimate_params(name: str) -> int:
+    base = name.split(".")[0].split("-")[0]
+    return _MODEL_PARAMS.get(base, _MODEL_PARAMS["large"])
+
 
+@dataclass
+class Transcript:
+    text: str
+    # Средний avg_logprob сегментов, взвешенный по длительности; None — речи нет
+    confidence: float | None
 
-def _get_whisper_model() -> whisper.Whisper:
+
+def _confidence(segments: list[tuple[float, float, float]]) -> float | None:
+    """
+    segments — (начало, конец, avg_logprob) распознанных сегментов.
     """
-    Получить модель Whisper (загружается один раз, затем кэшируется).
+    spans = [(end - start, logprob) for start, end, logprob in segments if end > start]
+    total = sum(span for span, _ in spans)
+    if not total:
+        return None
+    return sum(span * logprob for span, logprob in spans) / total
+
+
+class TranscriptionBackend(abc.ABC):
     """
-    global _whisper_model
-    if _whisper_model is None:
-        logger.info(f"Загрузка модели Whisper: {_whisper_model_name}")
-        _whisper_model = whisper.load_model(_whisper_model_name)
-        logger.info("Модель Whisper загружена")
-    return _whisper_model
+    Движок распознавания речи. Методы вызываются только в процессе-воркере,
+    поэтому библиотеки движков (torch, ctranslate2) импортируются внутри них.
+    """
+
+    name = ""
+    # Модуль, без которого движок недоступен
+    module = ""
+
+    def __init__(self, threads: int = 1) -> None:
+        self.threads = threads
+
+    @abc.abstractmethod
+    def load(self, model_name: str) -> Any:
+        ...
+
+    @abc.abstractmethod
+    def model_bytes(self, model: Any, model_name: str) -> int:
+        ...
+
+    @abc.abstractmethod
+    def estimate_bytes(self, model_name: str) -> int:
+        ...
+
+    @abc.abstractmethod
+    def transcribe(self, model: Any, audio: str | np.ndarray) -> Transcript:
+        ...
 
+    def release(self) -> None:
+        """
+        Вернуть освободившуюся после выгрузки модели память.
+        """
 
-async def transcribe_audio(file_path: str) -> str:
+
+class OpenAIWhisperBackend(TranscriptionBackend):
+    """
+    openai-whisper: PyTorch, fp32 на CPU.
     """
-    Транскрибация аудио через Whisper.
 
-    Поддерживает различные форматы аудио (OGG, MP3, WAV и др.),
-    так как Whisper использует ffmpeg под капотом.
+    name = "openai"
+    module = "whisper"
+
+    def load(self, model_name: str) -> Any:
+        import torch
+        import whisper
+
+        torch.set_num_threads(self.threads)
+        return whisper.load_model(model_name)
+
+    def model_bytes(self, model: Any, model_name: str) -> int:
+        return sum(p.numel() * p.element_size() for p in model.parameters())
+
+    def estimate_bytes(self, model_name: str) -> int:
+        return _estimate_params(model_name) * 4
+
+    def transcribe(self, model: Any, audio: str | np.ndarray) -> Transcript:
+        result = model.transcribe(audio, language=WHISPER_LANGUAGE, task="transcribe")
+        segments = [(s["start"], s["end"], s["avg_logprob"]) for s in result.get("segments", [])]
+        return Transcript(result.get("text", "").strip(), _confidence(segments))
+
+    def release(self) -> None:
+        import torch
+
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+class FasterWhisperBackend(TranscriptionBackend):
+    """
+    faster-whisper (CTranslate2): квантованная модель (по умолчанию int8) на CPU,
+    в разы быстрее и легче fp32 PyTorch при почти той же точности.
     """
-    if not Path(file_path).exists():
-        raise FileNotFoundError(f"Аудиофайл не найден: {file_path}")
 
+    name = "faster"
+    module = "faster_whisper"
+
+    def __init__(self, threads: int = 1, compute_type: str = WHISPER_COMPUTE_TYPE) -> None:
+        super().__init__(threads)
+        self.compute_type = compute_type
+
+    def load(self, model_name: str) -> Any:
+        from faster_whisper import WhisperModel
+
+        return WhisperModel(
+            model_name, device="cpu", compute_type=self.compute_type, cpu_threads=self.threads
+        )
+
+    def model_bytes(self, model: Any, model_name: str) -> int:
+        # CTranslate2 не сообщает размер весов — считаем по числу параметров
+        return self.estimate_bytes(model_name)
+
+    def estimate_bytes(self, model_name: str) -> int:
+        return _estimate_params(model_name) * _COMPUTE_TYPE_BYTES.get(self.compute_type, 4)
+
+    def transcribe(self, model: Any, audio: str | np.ndarray) -> Transcript:
+        # Тишину уже вырезал trim_silence в основном процессе, поэтому vad_filter не нужен
+        segments, _ = model.transcribe(audio, language=WHISPER_LANGUAGE, task="transcribe", beam_size=5)
+        # segments — генератор: распознавание идёт по мере чтения
+        segments = list(segments)
+        text = "".join(s.text for s in segments).strip()
+        return Transcript(text, _confidence([(s.start, s.end, s.avg_logprob) for s in segments]))
+
+
+BACKENDS: dict[str, type[TranscriptionBackend]] = {
+    OpenAIWhisperBackend.name: OpenAIWhisperBackend,
+    FasterWhisperBackend.name: FasterWhisperBackend,
+}
+
+
+def create_backend(name: str = WHISPER_BACKEND, threads: int = 1) -> TranscriptionBackend:
     try:
-        # Загружаем модель (кэшируется после первого вызова)
-        model = _get_whisper_model()
-
-        # Запускаем транскрибацию в отдельном потоке, чтобы не блокировать event loop
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(
-            None,
-            lambda: model.transcribe(file_path, language="ru", task="transcribe"),
+        backend = BACKENDS[name]
+    except KeyError:
+        raise ValueError(
+            f"Неизвестный WHISPER_BACKEND={name!r}, допустимо: {', '.join(BACKENDS)}"
+        ) from None
+    return backend(threads)
+
+
+class ModelManager:
+    """
+    Модели Whisper, загруженные в процессе-воркере.
+
+    Модель выгружается, если ею не пользовались дольше её idle-таймаута, а
+    перед загрузкой новой давно не использованные вытесняются, пока оценка
+    памяти не уложится в budget_bytes (0 — без лимита). Так основная
+    небольшая модель может жить долго, а большая загружается по требованию
+    и быстро освобождает память.
+
+    on_event(event, name, resident_bytes) вызывается при загрузке ("load"),
+    выгрузке ("unload", "evict") модели и перераспознавании ("fallback").
+    """
+
+    def __init__(self, backend: TranscriptionBackend, budget_bytes: int = 0, on_event=None) -> None:
+        self.backend = backend
+        self.budget_bytes = budget_bytes
+        self.on_event = on_event
+        # name -> (модель, байт); порядок — от давно использованной к недавней
+        self._models: OrderedDict[str, tuple[Any, int]] = OrderedDict()
+        self._last_used: dict[str, float] = {}
+        self._idle_timeouts: dict[str, float] = {}
+
+    @property
+    def resident_bytes(self) -> int:
+        return sum(size for _, size in self._models.values())
+
+    def get(self, name: str, idle_timeout: float = WHISPER_IDLE_UNLOAD_SECONDS) -> Any:
+        self._idle_timeouts[name] = idle_timeout
+        self._last_used[name] = time.monotonic()
+        if name in self._models:
+            self._models.move_to_end(name)
+            return self._models[name][0]
+
+        if self.budget_bytes > 0:
+            needed = self.backend.estimate_bytes(name)
+            while self._models and self.resident_bytes + needed > self.budget_bytes:
+                self._unload(next(iter(self._models)), "evict")
+            if needed > self.budget_bytes:
+                logger.warning(
+                    "Модель Whisper %s (~%d МБ) больше бюджета памяти (%d МБ)",
+                    name, needed >> 20, self.budget_bytes >> 20,
+                )
+
+        logger.info("Загрузка модели Whisper: %s (%s)", name, self.backend.name)
+        started = time.perf_counter()
+        model = self.backend.load(name)
+        size = self.backend.model_bytes(model, name)
+        self._models[name] = (model, size)
+        logger.info(
+            "Модель Whisper %s загружена за %.1f с (%d МБ)",
+            name, time.perf_counter() - started, size >> 20,
         )
+        self.notify("load", name)
+        return model
 
-        transcript = result.get("text", "").strip()
-        if not transcript:
-            return "[Не удалось распознать речь]"
+    def unload_idle(self) -> None:
+        now = time.monotonic()
+        for name in list(self._models):
+            timeout = self._idle_timeouts.get(name, 0)
+            if timeout > 0 and now - self._last_used[name] >= timeout:
+                self._unload(name, "unload")
 
-        return transcript
+    def _unload(self, name: str, event: str) -> None:
+        del self._models[name]
+        # Веса освобождаются только когда на модель не осталось ссылок
+        gc.collect()
+        self.backend.release()
+        logger.info("Модель Whisper %s выгружена (%s)", name, event)
+        self.notify(event, name)
 
-    except Exception as e:
-        logger.error(f"Ошибка при транскрибации аудио: {e}", exc_info=True)
-        return f"[Ошибка транскрибации: {str(e)}]"
+    def notify(self, event: str, name: str) -> None:
+        if self.on_event is not None:
+            self.on_event(event, name, self.resident_bytes)
 
 
+def transcribe(models: ModelManager, audio: str | np.ndarray) -> str:
+    """
+    Синхронная транскрибация (выполняется в процессе-воркере).
+
+    audio — путь к файлу любого формата, который понимает ffmpeg (OGG, MP3, WAV и др.),
+    или уже декодированный моно float32 PCM 16 кГц (например, кусок длинной записи).
+    Если основная модель не уверена, запись перераспознаётся WHISPER_FALLBACK_MODEL.
+    Возвращает распознанный текст (может быть пустым).
+    """
+    if isinstance(audio, str) and not Path(audio).exists():
+        raise FileNotFoundError(f"Аудиофайл не найден: {audio}")
+
+    result = models.backend.transcribe(models.get(WHISPER_MODEL), audio)
+    if (
+        WHISPER_FALLBACK_MODEL
+        and WHISPER_FALLBACK_MODEL != WHISPER_MODEL
+        and result.confidence is not None
+        and result.confidence < WHISPER_FALLBACK_LOGPROB
+    ):
+        logger.info(
+            "Whisper %s не уверен (avg_logprob %.2f), перераспознаю моделью %s",
+            WHISPER_MODEL, result.confidence, WHISPER_FALLBACK_MODEL,
+        )
+        models.notify("fallback", WHISPER_FALLBACK_MODEL)
+        model = models.get(WHISPER_FALLBACK_MODEL, WHISPER_FALLBACK_IDLE_SECONDS)
+        result = models.backend.transcribe(model, audio)
+    return result.text
+
+
+def worker_main(worker_id: int, threads: int, jobs, results) -> None:
+    """
+    Точка входа процесса-воркера транскрибации (см. transcription.py).
+
+    Основная модель загружается сразу при старте, чтобы первое голосовое не
+    ждало её загрузки; без задач модели выгружаются (см. ModelManager).
+    Протокол сообщений в results:
+      ("ready", worker_id, pid) / ("started", worker_id, job_id)
+      ("done", job_id, text) / ("error", job_id, описание ошибки)
+      ("model", worker_id, (событие, модель, занято байт))
+    """
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+    models = ModelManager(
+        create_backend(WHISPER_BACKEND, threads),
+        WHISPER_MEMORY_BUDGET_MB << 20,
+        on_event=lambda event, name, size: results.put(("model", worker_id, (event, name, size))),
+    )
+    models.get(WHISPER_MODEL)
+    results.put(("ready", worker_id, os.getpid()))
+
+    while True:
+        try:
+            job = jobs.get(timeout=_IDLE_CHECK_INTERVAL)
+        except queue.Empty:
+            models.unload_idle()
+            continue
+        if job is None:
+            return
+        job_id, audio = job
+        results.put(("started", worker_id, job_id))
+        try:
+            results.put(("done", job_id, transcribe(models, audio)))
+        except Exception as e:
+            logger.error(f"Ошибка при транскрибации аудио: {e}", exc_info=True)
+            results.put(("error", job_id, str(e)))
+        # Крупная модель после фолбэка не должна ждать простоя всего воркера
+        models.unload_idle()
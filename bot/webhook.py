@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import asyncio
+import hmac
+import json
+import logging
+import secrets
+from urllib.parse import urlsplit
+
+from telegram import Update
+from telegram.ext import Application
+
+from .config import (
+    WEBHOOK_HOST,
+    WEBHOOK_MAX_CONNECTIONS,
+    WEBHOOK_PORT,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+)
+from .metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_REQUESTS = Counter(
+    "bot_webhook_requests_total", "Запросы к webhook по результату.", ["result"]
+)
+
+_SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """
+    Приём апдейтов от Telegram через webhook (на aiohttp) вместо long polling.
+
+    Запрос проверяется по секретному токену, апдейт кладётся в ограниченную
+    очередь, и Telegram сразу получает 200 — обработка идёт в фоне. Если
+    очередь полна, отвечаем 503: Telegram повторит доставку позже, так что
+    всплеск не теряет сообщения и не раздувает память.
+
+    Из очереди апдейты передаются обработчику апдейтов приложения не больше,
+    чем он готов принять (max_pending), поэтому при webhook он не отклоняет
+    сообщения с просьбой прислать их ещё раз.
+    """
+
+    def __init__(
+        self,
+        application: Application,
+        url: str = WEBHOOK_URL,
+        host: str = WEBHOOK_HOST,
+        port: int = WEBHOOK_PORT,
+        secret: str = WEBHOOK_SECRET,
+        queue_size: int = WEBHOOK_QUEUE_SIZE,
+    ) -> None:
+        self.application = application
+        self.url = url
+        self.path = urlsplit(url).path or "/"
+        self.host = host
+        self.port = port
+        self.secret = secret or secrets.token_urlsafe(32)
+        self.queue: asyncio.Queue[Update] = asyncio.Queue(maxsize=queue_size)
+        processor = application.update_processor
+        self._slots = asyncio.Semaphore(getattr(processor, "max_pending", processor.max_concurrent_updates))
+        self._tasks: set[asyncio.Task] = set()
+        self._dispatcher: asyncio.Task | None = None
+        self._runner = None
+
+    @property
+    def pending(self) -> int:
+        return self.queue.qsize()
+
+    async def start(self) -> None:
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_post(self.path, self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        if not self.port:
+            self.port = self._runner.addresses[0][1]
+        self._dispatcher = asyncio.create_task(self._dispatch())
+        logger.info("Webhook слушает %s:%s%s", self.host, self.port, self.path)
+
+    async def set_webhook(self) -> None:
+        await self.application.bot.set_webhook(
+            self.url,
+            secret_token=self.secret,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        logger.info("Webhook зарегистрирован в Telegram: %s", self.url)
+
+    async def stop(self) -> None:
+        """
+        Перестаёт принимать запросы и дорабатывает уже подтверждённые апдейты.
+        """
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._dispatcher is not None:
+            await self.queue.join()
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _handle(self, request):
+        from aiohttp import web
+
+        token = request.headers.get(_SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode(), self.secret.encode()):
+            WEBHOOK_REQUESTS.inc("forbidden")
+            return web.Response(status=403)
+        try:
+            update = Update.de_json(json.loads(await request.read()), self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            WEBHOOK_REQUESTS.inc("bad_request")
+            logger.warning("Webhook: некорректный апдейт: %s", e)
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            WEBHOOK_REQUESTS.inc("overloaded")
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        WEBHOOK_REQUESTS.inc("accepted")
+        return web.Response()
+
+    async def _dispatch(self) -> None:
+        # Один потребитель очереди: апдейты уходят в обработку в порядке поступления
+        while True:
+            update = await self.queue.get()
+            await self._slots.acquire()
+            task = self.application.create_task(self._process(update), update=update)
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            self.queue.task_done()
+
+    async def _process(self, update: Update) -> None:
+        application = self.application
+        try:
+            await application.update_processor.process_update(
+                update, application.process_update(update)
+            )
+        finally:
+            self._slots.release()